@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from src.rag.index_factory import IndexParams, apply_search_params, build_index, index_memory_bytes
+
+
+def synthetic_corpus(n: int, dim: int, n_queries: int, clusters: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    # 带聚类结构的归一化向量，比均匀随机分布更接近真实条款嵌入
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    def sample(m: int) -> np.ndarray:
+        x = centers[rng.integers(0, clusters, m)] + 0.35 * rng.standard_normal((m, dim)).astype(np.float32)
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    return sample(n), sample(n_queries)
+
+
+def measure(index: Any, queries: np.ndarray, truth: np.ndarray, k: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, q in enumerate(queries):
+        t = time.perf_counter()
+        _, idx = index.search(q[None, :], k)
+        latencies.append(time.perf_counter() - t)
+        found[i] = idx[0]
+    t = time.perf_counter()
+    index.search(queries, k)
+    batch_s = time.perf_counter() - t
+    recall = float(np.mean([len(set(f) & set(g)) / k for f, g in zip(found, truth)]))
+    lat = np.array(latencies) * 1000
+    return {
+        "recall_at_k": round(recall, 4),
+        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+        "p99_ms": round(float(np.percentile(lat, 99)), 4),
+        "batch_qps": round(len(queries) / batch_s, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ANN 索引召回率/延迟/内存对比（以 Flat 为真值）")
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--types", default="flat,ivf_flat,ivf_pq,hnsw")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", default="4,16,64")
+    parser.add_argument("--ef-search", default="32,64,128")
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="结果 JSON 输出路径（默认打印到标准输出）")
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_corpus(args.n, args.dim, args.queries, args.clusters, args.seed)
+    flat, _ = build_index(corpus, None, IndexParams(index_type="flat"))
+    _, truth = flat.search(queries, args.k)
+
+    results: List[Dict[str, Any]] = []
+    for kind in [t.strip() for t in args.types.split(",") if t.strip()]:
+        params = IndexParams(index_type=kind, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+        t = time.perf_counter()
+        index, actual = build_index(corpus, None, params)
+        build_s = time.perf_counter() - t
+        if actual.startswith("ivf"):
+            sweep = [("nprobe", int(v)) for v in args.nprobe.split(",")]
+        elif actual == "hnsw":
+            sweep = [("ef_search", int(v)) for v in args.ef_search.split(",")]
+        else:
+            sweep = [("", 0)]
+        for knob, value in sweep:
+            if knob:
+                setattr(params, knob, value)
+                apply_search_params(index, params)
+            row = {
+                "index_type": actual,
+                "knob": f"{knob}={value}" if knob else "",
+                "build_s": round(build_s, 3),
+                "memory_mb": round(index_memory_bytes(index) / 2**20, 2),
+                **measure(index, queries, truth, args.k),
+            }
+            results.append(row)
+            print(json.dumps(row, ensure_ascii=False))
+
+    report = {"config": vars(args), "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
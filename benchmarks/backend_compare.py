@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import argparse
+import difflib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+# 每个后端在独立子进程中加载与生成，RSS 互不干扰；第一个后端作为输出一致性的基线
+BACKENDS = {
+    "fp32": {"LLM_BACKEND": "hf"},
+    "int8": {"LLM_BACKEND": "int8"},
+    "gguf": {"LLM_BACKEND": "gguf"},
+}
+
+
+def build_cases(n: int, stages: List[str]) -> List[Dict[str, Any]]:
+    from src.agents.prompts import REVIEW_SYSTEM, RISK_SYSTEM, STRATEGY_SYSTEM
+    from src.graph.pipeline_graph import PipelineGraph
+    from src.main import demo_request
+    from src.tools.llm import heuristic_generate_strategy
+
+    goals = ["income_protection", "medical_expense", "critical_illness", "education_fund", "retirement"]
+    cases: List[Dict[str, Any]] = []
+    for i in range(n):
+        req = demo_request()
+        req.insured.age = 25 + 4 * i
+        req.finance.annual_income = 120000 + 60000 * i
+        req.goals.goals = goals[: 2 + i % 4]
+        profile = PipelineGraph._profile(req)
+        draft = heuristic_generate_strategy(req).model_dump_json()
+        prompts = {
+            "strategy": (STRATEGY_SYSTEM, PipelineGraph._strategy_prompt(profile, [])),
+            "risk": (RISK_SYSTEM, PipelineGraph._risk_prompt(profile, draft)),
+            "review": (REVIEW_SYSTEM, PipelineGraph._review_prompt(draft, "[]")),
+        }
+        for stage in stages:
+            sp, up = prompts[stage]
+            cases.append({"id": f"{i}-{stage}", "stage": stage, "system": sp, "user": up})
+    return cases
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_worker(cases_path: str) -> Dict[str, Any]:
+    from src.graph.pipeline_graph import STAGE_SCHEMAS
+    from src.tools.local_llm import load_llm
+
+    with open(cases_path, encoding="utf-8") as f:
+        cases = json.load(f)
+    started = time.perf_counter()
+    llm = load_llm()
+    load_s = time.perf_counter() - started
+    llm.warmup()
+    outputs: List[str] = []
+    generate_s = 0.0
+    for case in cases:
+        t = time.perf_counter()
+        outputs.append(llm.chat(case["system"], case["user"], STAGE_SCHEMAS[case["stage"]], case["stage"]))
+        generate_s += time.perf_counter() - t
+    stages = llm.stats()["stages"]
+    tokens = sum(st["tokens"] for st in stages.values())
+    return {
+        "load_s": round(load_s, 2),
+        "generate_s": round(generate_s, 2),
+        "tokens": tokens,
+        "tokens_per_s": round(tokens / generate_s, 2) if generate_s else 0.0,
+        "rss_mb": round(_rss_mb(), 1),
+        # Linux 上 ru_maxrss 单位为 KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": stages,
+        "outputs": outputs,
+    }
+
+
+def _valid(text: str, stage: str) -> bool:
+    from pydantic import TypeAdapter
+
+    from src.graph.pipeline_graph import STAGE_SCHEMAS
+
+    try:
+        TypeAdapter(STAGE_SCHEMAS[stage]).validate_json(text)
+        return True
+    except Exception:
+        return False
+
+
+def agreement(cases: List[Dict[str, Any]], baseline: List[str], outputs: List[str]) -> Dict[str, Any]:
+    n = len(cases) or 1
+    exact = sum(a == b for a, b in zip(baseline, outputs))
+    similarity = sum(difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(baseline, outputs))
+    valid = sum(_valid(o, c["stage"]) for c, o in zip(cases, outputs))
+    return {"exact_match": round(exact / n, 3), "similarity": round(similarity / n, 3), "valid_json": round(valid / n, 3)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比推理后端（fp32 / int8 / gguf）的吞吐、内存与输出一致性")
+    parser.add_argument("--backends", default="fp32,int8", help="逗号分隔，第一个为基线；可选 fp32 / int8 / gguf")
+    parser.add_argument("--int8-dir", default=os.getenv("MERGED_MODEL_DIR", ""), help="model_export --format int8 的导出目录")
+    parser.add_argument("--gguf", default=os.getenv("GGUF_MODEL_PATH", ""), help="GGUF 模型文件")
+    parser.add_argument("--cases", type=int, default=4, help="合成用户数（每个用户每个阶段一条 prompt）")
+    parser.add_argument("--stages", default="strategy,risk,review")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--out", default=None, help="结果 JSON 输出路径（默认打印到标准输出）")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker), ensure_ascii=False))
+        return
+
+    names = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in names if b not in BACKENDS]
+    if unknown:
+        parser.error(f"未知后端: {unknown}")
+    cases = build_cases(args.cases, [s.strip() for s in args.stages.split(",") if s.strip()])
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+        json.dump(cases, f, ensure_ascii=False)
+        cases_path = f.name
+
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for name in names:
+            env = dict(os.environ, **BACKENDS[name])
+            # 贪心解码，输出差异只来自量化误差
+            env.update(GEN_TEMPERATURE="0", BATCH_MAX_SIZE="1", MAX_NEW_TOKENS=str(args.max_new_tokens))
+            if args.int8_dir:
+                env["MERGED_MODEL_DIR"] = args.int8_dir
+            if args.gguf:
+                env["GGUF_MODEL_PATH"] = args.gguf
+            env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.backend_compare", "--worker", cases_path],
+                capture_output=True, text=True, env=env,
+            )
+            if out.returncode != 0:
+                results[name] = {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+            else:
+                results[name] = json.loads(out.stdout.strip().splitlines()[-1])
+            row = {k: v for k, v in results[name].items() if k not in ("outputs", "stages")}
+            print(json.dumps({"backend": name, **row}, ensure_ascii=False))
+    finally:
+        os.remove(cases_path)
+
+    baseline = results.get(names[0], {}).get("outputs")
+    for name in names:
+        if baseline is not None and "outputs" in results[name]:
+            results[name]["agreement"] = agreement(cases, baseline, results[name]["outputs"])
+            print(json.dumps({"backend": name, "vs": names[0], **results[name]["agreement"]}, ensure_ascii=False))
+
+    report = {"config": vars(args), "cases": [c["id"] for c in cases], "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
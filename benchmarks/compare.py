@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+# 指标方向按键名后缀判断：耗时越小越好，吞吐与召回越大越好；其余数值（样本数、文档数等）只展示不判定
+LOWER_BETTER = ("_ms", "_s")
+HIGHER_BETTER = ("per_s", "rps", "qps", "recall_at_k", "avg_batch_size")
+
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            out.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        out[prefix] = float(data)
+    return out
+
+
+def direction(path: str) -> int:
+    # 1：越大越好；-1：越小越好；0：不判定
+    leaf = path.rsplit(".", 1)[-1]
+    if leaf.endswith(HIGHER_BETTER):
+        return 1
+    if leaf.endswith(LOWER_BETTER) or ".stage_p50_ms." in path:
+        return -1
+    return 0
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float, noise_ms: float) -> List[Dict[str, Any]]:
+    a, b = flatten(base.get("suites", {})), flatten(new.get("suites", {}))
+    rows: List[Dict[str, Any]] = []
+    for path in sorted(set(a) & set(b)):
+        sign = direction(path)
+        if sign == 0:
+            continue
+        old, cur = a[path], b[path]
+        change = (cur - old) / old if old else 0.0
+        verdict = "same"
+        # 亚毫秒级耗时的相对抖动很大，绝对差低于 noise_ms 的不判定
+        small = (path.endswith("_ms") or "_ms." in path) and abs(cur - old) < noise_ms
+        if not small and abs(change) >= threshold:
+            verdict = "better" if change * sign > 0 else "worse"
+        rows.append({"metric": path, "base": old, "new": cur, "change": round(change, 4), "verdict": verdict})
+    return rows
+
+
+def _commit(report: Dict[str, Any]) -> Optional[str]:
+    return report.get("meta", {}).get("commit")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比两次 pipeline_suite 结果，列出超出阈值的性能变化")
+    parser.add_argument("base", help="基线结果 JSON")
+    parser.add_argument("new", help="新结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定为变化的相对幅度（默认 10%%）")
+    parser.add_argument("--noise-ms", type=float, default=0.5, help="耗时指标的绝对差低于此值时视为噪声")
+    parser.add_argument("--all", action="store_true", help="同时列出未变化的指标")
+    parser.add_argument("--fail-on-regression", action="store_true", help="存在变差的指标时以退出码 1 结束")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    if base.get("meta", {}).get("args") != new.get("meta", {}).get("args"):
+        print("warning: 两次运行的参数不同，结果不可直接比较", file=sys.stderr)
+
+    rows = compare(base, new, args.threshold, args.noise_ms)
+    counts: Tuple[int, int] = (
+        sum(r["verdict"] == "worse" for r in rows),
+        sum(r["verdict"] == "better" for r in rows),
+    )
+    print(f"{_commit(base)} -> {_commit(new)}: {counts[0]} worse, {counts[1]} better, {len(rows)} compared")
+    width = max((len(r["metric"]) for r in rows), default=10)
+    for r in rows:
+        if r["verdict"] == "same" and not args.all:
+            continue
+        print(f"{r['verdict']:>6}  {r['metric']:<{width}}  {r['base']:>12.3f} -> {r['new']:>12.3f}  ({r['change']:+.1%})")
+    if args.fail_on_regression and counts[0]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+# 重依赖单独计时，作为入口模块导入耗时的对照
+HEAVY = ["torch", "transformers", "peft", "sentence_transformers", "faiss", "langgraph.graph"]
+ENTRYPOINTS = ["src.api.server", "src.main", "src.batch", "src.db.models", "src.rag.indexer", "src.graph.pipeline_graph"]
+COMMANDS = [["-m", "src.db", "--help"], ["-m", "src.batch", "--help"], ["-m", "src.rag.indexer", "--help"]]
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy_loaded": heavy}}))
+"""
+
+
+def probe_import(module: str, repeat: int, env: Dict[str, str]) -> Dict[str, Any]:
+    # 每次在全新解释器中导入，排除 sys.modules 缓存的影响
+    runs: List[float] = []
+    heavy: List[str] = []
+    for _ in range(repeat):
+        code = _PROBE.format(module=module, heavy=[h.split(".")[0] for h in HEAVY])
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+        row = json.loads(out.stdout.strip().splitlines()[-1])
+        runs.append(row["seconds"])
+        heavy = row["heavy_loaded"]
+    return {"target": module, "median_s": round(statistics.median(runs), 3), "min_s": round(min(runs), 3), "heavy_loaded": heavy}
+
+
+def probe_command(args: List[str], repeat: int, env: Dict[str, str]) -> Dict[str, Any]:
+    runs: List[float] = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True, env=env, check=True)
+        runs.append(time.perf_counter() - t)
+    return {"target": "python " + " ".join(args), "median_s": round(statistics.median(runs), 3), "min_s": round(min(runs), 3)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="入口模块与 CLI 的冷启动导入耗时")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modules", default=",".join(ENTRYPOINTS))
+    parser.add_argument("--skip-heavy", action="store_true", help="不单独测量重依赖的导入耗时")
+    parser.add_argument("--out", default=None, help="结果 JSON 输出路径（默认打印到标准输出）")
+    args = parser.parse_args()
+
+    # 指向不存在的库文件：若导入阶段仍连接数据库或建表，会在结果中留下该文件
+    env = dict(os.environ)
+    probe_db = os.path.abspath("import_time_probe.db")
+    env["DATABASE_URL"] = f"sqlite:///{probe_db}"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+
+    results: List[Dict[str, Any]] = []
+    targets = ([] if args.skip_heavy else HEAVY) + [m.strip() for m in args.modules.split(",") if m.strip()]
+    for module in targets:
+        row = probe_import(module, args.repeat, env)
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+    for command in COMMANDS:
+        row = probe_command(command, args.repeat, env)
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+
+    touched_db = os.path.exists(probe_db)
+    if touched_db:
+        os.remove(probe_db)
+    print(json.dumps({"import_touched_database": touched_db}))
+
+    report = {"config": vars(args), "results": results, "import_touched_database": touched_db}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from .stand_ins import HashEmbedder, build_tiny_model
+from .synthetic import TOPICS, seed_users, synthetic_requests, write_corpus
+
+SUITES = ("heuristic", "vectorstore", "kb", "e2e")
+# 影响性能、由调用方环境决定的开关，原样记录到报告里便于对照
+KNOBS = (
+    "BATCH_MAX_SIZE", "BATCH_WINDOW_MS", "PREFIX_CACHE", "JSON_CONSTRAINT", "RAG_INDEX_TYPE", "RAG_RETRIEVAL_MODE",
+    "RAG_LEXICAL_TOKENIZER", "TRACING", "OMP_NUM_THREADS",
+)
+
+
+def latency(samples_s: Sequence[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    if not len(ms):
+        return {"n": 0}
+    return {
+        "n": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _queries(requests: List[Any], seed: int) -> List[List[str]]:
+    # 与管线一致：每个用户的检索词为其保险目的，再加一两个条款术语
+    rng = np.random.default_rng(seed)
+    out: List[List[str]] = []
+    for req in requests:
+        topic, terms = TOPICS[int(rng.integers(len(TOPICS)))]
+        picked = [f"{topic}{terms[int(i)]}" for i in rng.choice(len(terms), size=2, replace=False)]
+        out.append(list(req.goals.goals) + picked)
+    return out
+
+
+def bench_heuristic(requests: List[Any]) -> Dict[str, Any]:
+    import asyncio
+
+    from src.agents.reviewer import ReviewRejected
+    from src.graph.pipeline_graph import PipelineGraph
+
+    # fast 模式不访问 LLM 与向量库，占位对象即可
+    graph = PipelineGraph(llm=object(), vs=object())  # type: ignore[arg-type]
+    chain: List[float] = []
+    errors = Counter()
+    started = time.perf_counter()
+    for req in requests:
+        t = time.perf_counter()
+        try:
+            _, rec = graph.heuristic_chain(req)
+            graph.reviewer.act(rec)
+        except ReviewRejected:
+            errors["review_rejected"] += 1
+        chain.append(time.perf_counter() - t)
+    chain_s = time.perf_counter() - started
+
+    async def run_fast() -> List[float]:
+        samples: List[float] = []
+        for req in requests:
+            t = time.perf_counter()
+            try:
+                await graph.arun(req, "fast")
+            except ReviewRejected:
+                pass
+            samples.append(time.perf_counter() - t)
+        return samples
+
+    started = time.perf_counter()
+    fast = asyncio.run(run_fast())
+    fast_s = time.perf_counter() - started
+    return {
+        "chain": {**latency(chain), "per_s": round(len(requests) / chain_s, 1)},
+        "fast_dag": {**latency(fast), "per_s": round(len(requests) / fast_s, 1)},
+        "errors": dict(errors),
+    }
+
+
+def bench_vectorstore(corpus_dir: str, queries: List[List[str]], top_k: int) -> Dict[str, Any]:
+    from src.config import rag_config
+    from src.rag.embed_cache import EmbeddingCache
+    from src.rag.vectorstore import VectorStore
+
+    vs = VectorStore(autoload=False, embedder=HashEmbedder())
+    t = time.perf_counter()
+    built = vs.build_from_dir(corpus_dir)
+    build_s = time.perf_counter() - t
+    result: Dict[str, Any] = {"build_s": round(build_s, 3), "docs": len(vs.docs), "build": built, "modes": {}}
+    original = rag_config.retrieval_mode
+    try:
+        for mode in ("dense", "lexical", "hybrid"):
+            rag_config.retrieval_mode = mode
+            # 第一轮查询向量未命中缓存（含嵌入耗时），第二轮全部命中
+            runs: Dict[str, Any] = {}
+            for phase in ("cold", "warm"):
+                if phase == "cold":
+                    vs.query_cache = EmbeddingCache(rag_config.embedding_model, None, rag_config.embed_cache_size)
+                samples = []
+                for hints in queries:
+                    t = time.perf_counter()
+                    vs.search(hints, top_k)
+                    samples.append(time.perf_counter() - t)
+                runs[phase] = {**latency(samples), "per_s": round(len(samples) / sum(samples), 1)}
+            result["modes"][mode] = runs
+    finally:
+        rag_config.retrieval_mode = original
+        vs.close()
+    return result
+
+
+def bench_kb(corpus_dir: str, queries: List[List[str]], top_k: int) -> Dict[str, Any]:
+    from src.tools.retriever import KnowledgeBase
+
+    t = time.perf_counter()
+    kb = KnowledgeBase(corpus_dir)
+    build_s = time.perf_counter() - t
+    samples = []
+    for hints in queries:
+        t = time.perf_counter()
+        kb.retrieve(hints, top_k)
+        samples.append(time.perf_counter() - t)
+    retrieve = {**latency(samples), "per_s": round(len(samples) / sum(samples), 1)}
+    return {"build_s": round(build_s, 3), "docs": len(kb.docs), "retrieve": retrieve}
+
+
+async def _e2e_level(client: Any, user_ids: List[int], n: int, concurrency: int, mode: str) -> Dict[str, Any]:
+    import asyncio
+
+    from src.serving.registry import registry
+    from src.tracing import metrics
+
+    metrics.reset()
+    before = (registry.stats().get("llm") or {}).get("batching") or {}
+    samples: List[float] = []
+    statuses: Counter[int] = Counter()
+    modes: Counter[str] = Counter()
+    cursor = iter(range(n))
+
+    async def worker() -> None:
+        for i in cursor:
+            t = time.perf_counter()
+            r = await client.post("/strategy/generate", json={"user_id": user_ids[i % len(user_ids)], "mode": mode})
+            samples.append(time.perf_counter() - t)
+            statuses[r.status_code] += 1
+            modes[r.headers.get("x-pipeline-mode", "")] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_s = time.perf_counter() - started
+    after = (registry.stats().get("llm") or {}).get("batching") or {}
+    batches = after.get("batches", 0) - before.get("batches", 0)
+    rows = after.get("requests", 0) - before.get("requests", 0)
+    stages = metrics.snapshot().get("insur_stage_duration_ms", {})
+    return {
+        "requests": n,
+        "wall_s": round(wall_s, 3),
+        "rps": round(n / wall_s, 2),
+        "latency": latency(samples),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "modes": dict(modes),
+        "avg_batch_size": round(rows / batches, 2) if batches else 0.0,
+        # 各阶段 span 的 p50（ms），定位延迟变化发生在哪一段
+        "stage_p50_ms": {k.split("=", 1)[1]: v["p50"] for k, v in stages.items()},
+    }
+
+
+def bench_e2e(corpus_dir: str, user_ids: List[int], args: argparse.Namespace) -> Dict[str, Any]:
+    import asyncio
+
+    import httpx
+
+    from src.api.server import app
+    from src.db.models import adispose_engine
+    from src.rag.vectorstore import VectorStore
+    from src.serving.registry import registry
+    from src.tools.local_llm import load_llm
+
+    vs = VectorStore(autoload=False, embedder=HashEmbedder())
+    vs.build_from_dir(corpus_dir)
+    # load_s 只计权重加载；torch/transformers 的导入耗时由 import_time 基准单独衡量
+    import transformers  # noqa: F401
+
+    t = time.perf_counter()
+    llm = load_llm()
+    load_s = time.perf_counter() - t
+    registry.use(llm=llm, vs=vs)
+
+    async def run() -> Dict[str, Any]:
+        # ASGITransport 不触发 lifespan，这里按服务启动流程手动预热
+        t = time.perf_counter()
+        await registry.astartup(warmup=True)
+        levels: Dict[str, Any] = {"load_s": round(load_s, 3), "warmup_s": round(time.perf_counter() - t, 3)}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for c in args.concurrency:
+                levels[f"c{c}"] = await _e2e_level(client, user_ids, args.e2e_requests, c, args.mode)
+                print(json.dumps({"suite": "e2e", "concurrency": c, **levels[f"c{c}"]}, ensure_ascii=False), file=sys.stderr)
+        registry.shutdown()
+        await adispose_engine()
+        return levels
+
+    return asyncio.run(run())
+
+
+def _prepare_env(args: argparse.Namespace, work: str) -> Dict[str, str]:
+    # 所有路径与模型指向工作目录：不读写仓库内的索引、缓存与数据库，也不访问网络
+    budget = str(args.max_new_tokens)
+    env = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(work, 'bench.db')}",
+        "DB_INIT_ON_STARTUP": "0",
+        "KNOWLEDGE_DIR": os.path.join(work, "corpus"),
+        "FAISS_INDEX_PATH": os.path.join(work, "index.faiss"),
+        "EMBEDDING_MODEL": "hash-bigram-384",
+        "EMBED_CACHE_DIR": "",
+        "RESULT_CACHE_SIZE": "0",
+        "LLM_BACKEND": "hf",
+        "LOCAL_QWEN_DIR": os.path.join(work, "tiny-model"),
+        "LORA_ADAPTER_DIR": "",
+        "MERGED_CACHE_DIR": "",
+        "GEN_TEMPERATURE": "0",
+        "MAX_NEW_TOKENS": budget,
+        "STAGE_MAX_NEW_TOKENS": f"strategy={budget},risk={budget},review={budget}",
+        "FAST_FALLBACK_QUEUE_DEPTH": "0",
+    }
+    os.environ.update(env)
+    return env
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="推荐管线分层基准：启发式链、向量检索、BM25 知识库与端到端 API（合成数据 + 替身模型）")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"逗号分隔，可选 {' / '.join(SUITES)}")
+    parser.add_argument("--users", type=int, default=200, help="合成用户数")
+    parser.add_argument("--docs", type=int, default=300, help="合成知识库文档数")
+    parser.add_argument("--doc-chars", type=int, default=2000, help="每篇文档的大致字符数")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--concurrency", default="1,4,16", help="端到端并发档位")
+    parser.add_argument("--e2e-requests", type=int, default=32, help="每个并发档位的请求数")
+    parser.add_argument("--mode", default="full", choices=["fast", "hybrid", "full"], help="端到端请求的管线模式")
+    parser.add_argument("--max-new-tokens", type=int, default=48, help="替身模型每个阶段的生成预算")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="合成数据与替身模型目录（默认临时目录；复用可跳过模型生成）")
+    parser.add_argument("--out", default=None, help="结果 JSON 输出路径（默认打印到标准输出）")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        parser.error(f"未知套件: {unknown}")
+
+    work = args.workdir or tempfile.mkdtemp(prefix="insur-bench-")
+    os.makedirs(work, exist_ok=True)
+    env = _prepare_env(args, work)
+    db_path = os.path.join(work, "bench.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    requests = synthetic_requests(args.users, args.seed)
+    queries = _queries(requests, args.seed)
+    corpus_dir = env["KNOWLEDGE_DIR"]
+    if not os.path.isdir(corpus_dir) or not os.listdir(corpus_dir):
+        write_corpus(corpus_dir, args.docs, args.doc_chars, args.seed)
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "workdir")},
+            "knobs": {k: os.environ[k] for k in KNOBS if k in os.environ},
+        },
+        "suites": {},
+    }
+    for suite in suites:
+        t = time.perf_counter()
+        if suite == "heuristic":
+            result = bench_heuristic(requests)
+        elif suite == "vectorstore":
+            result = bench_vectorstore(corpus_dir, queries, args.top_k)
+        elif suite == "kb":
+            result = bench_kb(corpus_dir, queries, args.top_k)
+        else:
+            build_tiny_model(env["LOCAL_QWEN_DIR"], seed=args.seed)
+            result = bench_e2e(corpus_dir, seed_users(requests), args)
+        report["suites"][suite] = result
+        print(json.dumps({"suite": suite, "seconds": round(time.perf_counter() - t, 2)}), file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Any, List
+
+import numpy as np
+
+# 无网络、无 GPU 环境下的替身：嵌入模型与 LLM 换成本地可生成的小模型，其余代码路径（批处理、约束解码、检索）不变
+
+
+class HashEmbedder:
+    # 字符二元组哈希到固定维度后归一化；满足 VectorStore 对 SentenceTransformer 的两个调用
+    def __init__(self, dim: int = 384) -> None:
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **kwargs: Any) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for j in range(max(len(text) - 1, 1)):
+                h = int.from_bytes(hashlib.blake2b(text[j:j + 2].encode("utf-8"), digest_size=8).digest(), "little")
+                out[row, h % self.dim] += 1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms > 0, norms, 1.0)
+        return out
+
+
+def build_tiny_model(out_dir: str, hidden: int = 64, layers: int = 2, vocab: int = 800, seed: int = 0) -> str:
+    # 随机初始化的 Qwen2 结构 + 在系统提示词上训练的 BPE 分词器，作为 LOCAL_QWEN_DIR 交给 LocalQwen
+    if os.path.exists(os.path.join(out_dir, "model.safetensors")):
+        return out_dir
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    from src.agents.prompts import PLANNER_SYSTEM, REVIEW_SYSTEM, RISK_SYSTEM, STRATEGY_SYSTEM
+
+    corpus = [
+        STRATEGY_SYSTEM,
+        RISK_SYSTEM,
+        REVIEW_SYSTEM,
+        PLANNER_SYSTEM,
+        '{"items": [], "a": 1.5, "b": true, "c": null} 0123456789 {}[]:,."\\',
+        "<|system|> <|user|> <|assistant|> 受保人信息 财务状况 保险目的 已有保单 参考资料 low medium high annual",
+    ] * 20
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab, special_tokens=["<|endoftext|>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tok.train_from_iterator(corpus, trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="<|endoftext|>", pad_token="<|endoftext|>")
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden,
+        intermediate_size=2 * hidden,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer.save_pretrained(out_dir)
+    Qwen2ForCausalLM(config).save_pretrained(out_dir)
+    return out_dir
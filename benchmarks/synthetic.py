@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import os
+import random
+from typing import Any, List
+
+# 合成数据：固定 seed 下逐字节可复现，跨提交对比时输入完全一致
+OCCUPATIONS = ["软件工程师", "教师", "医生", "销售", "个体经营", "公务员", "外卖骑手", "设计师", "会计", "建筑工人"]
+HEALTH = ["良好", "良好", "良好", "高血压", "甲状腺结节", "轻度脂肪肝"]
+FAMILIES = ["单身", "已婚", "已婚，一孩", "已婚，两孩", "离异，一孩", "已婚，赡养父母"]
+CITIES = ["上海", "北京", "深圳", "成都", "武汉", "杭州", None]
+COVERAGES = [("medical", "百万医疗"), ("critical_illness", "重疾险"), ("life", "定期寿险"), ("accident", "意外险")]
+
+PRODUCTS = ["安心百万医疗", "守护重疾", "金色年华年金", "定惠寿险", "无忧意外", "成长教育金", "臻享增额终身寿"]
+TOPICS = [
+    ("重疾", ["疾病定义", "等待期", "轻症", "中症", "豁免", "多次赔付", "确诊即赔"]),
+    ("医疗", ["免赔额", "报销比例", "社保内外", "住院", "门急诊", "特需部", "续保条件"]),
+    ("寿险", ["保额", "身故", "全残", "受益人", "健康告知", "免责条款"]),
+    ("年金", ["现金价值", "领取方式", "保证领取", "万能账户", "结算利率"]),
+    ("意外", ["意外身故", "伤残等级", "意外医疗", "职业类别", "猝死"]),
+    ("教育金", ["领取节点", "投保人豁免", "保单贷款", "缴费期"]),
+]
+
+
+def synthetic_requests(n: int, seed: int = 0) -> List[Any]:
+    from src.models.schemas import (
+        INSURANCE_GOALS,
+        ExistingPolicy,
+        FinancialStatus,
+        InsuranceGoal,
+        InsuredInfo,
+        UserRequest,
+    )
+
+    rng = random.Random(seed)
+    out: List[Any] = []
+    for _ in range(n):
+        income = round(rng.lognormvariate(12.2, 0.6), -3)
+        policies = [
+            ExistingPolicy(
+                company=rng.choice(["平安", "国寿", "太保", None]),
+                product=product,
+                coverage_type=coverage,
+                sum_assured=rng.choice([100000, 300000, 500000, 1000000, 2000000]),
+                term_years=rng.choice([1, 10, 20, 30, None]),
+                premium_annual=rng.choice([300, 1200, 5000, 12000, None]),
+            )
+            for coverage, product in rng.sample(COVERAGES, rng.choice([0, 0, 1, 1, 2]))
+        ]
+        out.append(
+            UserRequest(
+                insured=InsuredInfo(
+                    age=rng.randint(18, 65),
+                    gender=rng.choice(["male", "female"]),
+                    occupation=rng.choice(OCCUPATIONS),
+                    health_status=rng.choice(HEALTH),
+                    family_structure=rng.choice(FAMILIES),
+                    smoker=rng.random() < 0.2,
+                    city=rng.choice(CITIES),
+                ),
+                finance=FinancialStatus(
+                    annual_income=income,
+                    liabilities=round(income * rng.choice([0, 0.5, 2, 5]), -3),
+                    assets=round(income * rng.uniform(0.5, 10), -3),
+                    monthly_budget_for_insurance=rng.choice([None, 500, 1000, 2000, 5000]),
+                ),
+                goals=InsuranceGoal(goals=rng.sample(INSURANCE_GOALS, rng.randint(1, 4))),
+                existing_policies=policies,
+            )
+        )
+    return out
+
+
+def write_corpus(dir_path: str, n_docs: int, doc_chars: int, seed: int = 0) -> int:
+    # 由产品名、条款编号、金额与主题术语拼成的条款式文档，兼顾向量与 BM25 两路检索的词项分布
+    rng = random.Random(seed)
+    os.makedirs(dir_path, exist_ok=True)
+    total = 0
+    for i in range(n_docs):
+        topic, terms = TOPICS[i % len(TOPICS)]
+        product = rng.choice(PRODUCTS)
+        lines = [f"# {product}·{topic}条款解读 {i}", ""]
+        size = 0
+        clause = 1
+        while size < doc_chars:
+            term = rng.choice(terms)
+            line = (
+                f"第{clause}条 {term}：{product}对{term}的约定为"
+                f"{rng.choice(['按合同约定给付', '不超过基本保额的', '以实际发生费用为准，上限'])}"
+                f"{rng.randint(1, 300) * 1000}元，{rng.choice(['等待期', '犹豫期', '宽限期'])}{rng.choice([15, 30, 60, 90, 180])}天。"
+                f"{rng.choice(terms)}与{rng.choice(terms)}需结合{topic}需求一并评估。"
+            )
+            lines.append(line)
+            size += len(line)
+            clause += 1
+        text = "\n".join(lines) + "\n"
+        total += len(text)
+        with open(os.path.join(dir_path, f"{topic}_{i:05d}.md"), "w", encoding="utf-8") as f:
+            f.write(text)
+    return total
+
+
+def seed_users(requests: List[Any]) -> List[int]:
+    # 按 ORM 模型写入数据库，返回与 requests 同序的 user_id
+    from sqlalchemy.orm import Session
+
+    from src.db.models import Policy, User, get_engine, init_db
+
+    init_db()
+    ids: List[int] = []
+    with Session(get_engine()) as s:
+        for req in requests:
+            u = User(
+                age=req.insured.age,
+                gender=req.insured.gender,
+                occupation=req.insured.occupation,
+                health_status=req.insured.health_status,
+                family_structure=req.insured.family_structure,
+                smoker=int(req.insured.smoker),
+                city=req.insured.city,
+                annual_income=req.finance.annual_income,
+                liabilities=req.finance.liabilities,
+                assets=req.finance.assets,
+                monthly_budget_for_insurance=req.finance.monthly_budget_for_insurance,
+                goals=",".join(req.goals.goals),
+            )
+            u.policies = [Policy(**p.model_dump()) for p in req.existing_policies]
+            s.add(u)
+            s.flush()
+            ids.append(u.id)
+        s.commit()
+    return ids
@@ -8,6 +8,13 @@ from ..tools.evaluator import build_renewal_claims_tips
 import asyncio
 
 
+class ReviewRejected(ValueError):
+    # 复核未通过：策略缺少必需部分。显式异常而非 assert，python -O 下同样生效
+    def __init__(self, issues: List[str]) -> None:
+        super().__init__("；".join(issues))
+        self.issues = issues
+
+
 class ReviewAgent(BaseAgent):
     def act(self, rec: StrategyRecommendation) -> StrategyRecommendation:  # type: ignore[override]
         # 填充续保/理赔提醒
@@ -16,9 +23,15 @@ class ReviewAgent(BaseAgent):
             rec.renewal_and_claims = {"renewal": renewal, "claims": claims}
 
         # 简单完整性检查
-        assert rec.items, "策略项不能为空"
-        assert rec.purchase_plan, "需包含分阶段购买计划"
-        assert rec.policy_combo_explanation, "需包含保单组合说明"
+        issues: List[str] = []
+        if not rec.items:
+            issues.append("策略项不能为空")
+        if not rec.purchase_plan:
+            issues.append("需包含分阶段购买计划")
+        if not rec.policy_combo_explanation:
+            issues.append("需包含保单组合说明")
+        if issues:
+            raise ReviewRejected(issues)
         return rec
 
     async def aact(self, rec: StrategyRecommendation) -> StrategyRecommendation:  # type: ignore[override]
@@ -1,32 +1,291 @@
 from __future__ import annotations
 
 import json
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-from ..db.models import afetch_user_request
-from ..graph.pipeline_graph import PipelineGraph
+from ..agents.reviewer import ReviewRejected
+from ..config import get_db_config, pipeline_config, serving_config
+from ..db.models import adispose_engine, afetch_user_request, ainit_db, iter_user_request_pages
+from ..graph.pipeline_graph import PipelineMode
+from ..models.schemas import UserRequest
+from ..serving.batch import BatchRunner
+from ..serving.registry import registry
+from ..serving.result_cache import cacheable, fingerprint
+from ..serving.scheduler import Abandoned, Rejected, Ticket
+from ..serving.singleflight import flight_key
+from ..tracing import TracingMiddleware, debug_trace, metrics
 import asyncio
 
 
 class GenerateRequest(BaseModel):
     user_id: int
+    # 不填则使用 PIPELINE_MODE；allow_degrade 允许生成队列饱和时降级为 fast
+    mode: Optional[PipelineMode] = None
+    allow_degrade: bool = True
+    # 准入通道：interactive 优先于 batch；deadline_ms 为排队截止时间，超时返回 503（不填用 SCHED_DEFAULT_DEADLINE_MS）
+    priority: Literal["interactive", "batch"] = "interactive"
+    deadline_ms: Optional[int] = Field(default=None, gt=0)
 
 
-app = FastAPI(title="InsurAgentRAG API", version="0.1.0")
+class JobRequest(BaseModel):
+    user_id: int
+    # 异步任务不降级：按请求模式完整生成，结果落库后轮询获取
+    mode: Optional[PipelineMode] = None
+    priority: Literal["interactive", "batch"] = "interactive"
+
+
+class BatchGenerateRequest(BaseModel):
+    # 三选一：user_ids 列表、[start_id, end_id] 区间，或直接提交 UserRequest 列表（key 为下标）
+    user_ids: Optional[List[int]] = None
+    start_id: Optional[int] = None
+    end_id: Optional[int] = None
+    requests: Optional[List[UserRequest]] = None
+    mode: Optional[PipelineMode] = None
+    concurrency: Optional[int] = Field(default=None, gt=0, le=serving_config.batch_concurrency_max)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 模型、向量库只在启动时加载一次，所有请求共享
+    if get_db_config().init_on_startup:
+        await ainit_db()
+    await registry.astartup()
+    await registry.jobs.start(_execute_job)
+    yield
+    await registry.jobs.stop()
+    registry.shutdown()
+    await adispose_engine()
+
+
+app = FastAPI(title="InsurAgentRAG API", version="0.1.0", lifespan=lifespan)
+app.add_middleware(TracingMiddleware)
+metrics.gauge("insur_llm_queue_depth", "等待进入生成批次的 LLM 请求数", lambda: registry.queue_depth)
+metrics.gauge("insur_sched_inflight", "已获准入、正在执行的管线数", lambda: registry.scheduler.inflight)
+metrics.gauge("insur_sched_queued", "等待准入的请求数", lambda: registry.scheduler.queued)
+
+
+@app.get("/health")
+async def health():
+    return {"loaded": registry.loaded, "warmed_up": registry.warmed_up}
+
+
+@app.get("/stats")
+async def stats():
+    # 多进程部署时含一次到推理进程的同步调用，放到线程中，不阻塞事件循环
+    return {**(await asyncio.to_thread(registry.stats)), "latency": metrics.snapshot()}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/strategy/generate")
-async def generate_strategy(body: GenerateRequest):
+async def generate_strategy(body: GenerateRequest, request: Request, response: Response):
     req = await afetch_user_request(body.user_id)
     if not req:
         raise HTTPException(status_code=404, detail="User not found")
 
-    out = await PipelineGraph().arun(req)
-    final_json = out.get("final_json")
+    # 同档画像（年龄段、收入段、目标、家庭结构等）直接复用已生成的策略
+    requested = body.mode or pipeline_config.mode
+    cache = registry.result_cache if cacheable(requested) else None
+    key = fingerprint(req, requested)
+    if cache is not None:
+        hit = await cache.aget(key)
+        if hit is not None:
+            response.headers["X-Pipeline-Mode"] = hit["mode"]
+            response.headers["X-Cache"] = "hit"
+            return hit["result"]
+
+    mode = registry.pipeline.select_mode(body.mode, body.allow_degrade)
+    # 重复点击/客户端重试：同一用户、同一数据状态、同一实际模式的并发请求共享一次管线执行
+    fkey = flight_key(body.user_id, req, requested, mode)
+    # fast 模式不占用模型；已有相同请求在执行时直接等待其结果，两者都不排队占名额
+    ticket = None
+    if mode != "fast" and not registry.singleflight.running(fkey):
+        ticket = await _admit(request, body)
+    leader = False
+
+    async def run() -> Dict[str, Any]:
+        try:
+            try:
+                # 模式只在准入前选择一次：是否占名额与实际执行的模式一致
+                out = await registry.pipeline.arun_selected(req, mode, allow_degrade=False)
+            except ReviewRejected:
+                if mode == requested:
+                    raise
+                # 降级的 fast 复核未通过时按原模式重跑；原模式要用模型，此时才申请名额
+                async with registry.scheduler.slot(body.priority):
+                    out = await registry.pipeline.arun(req, requested)
+            result = _parse_final(out.get("final_json"))
+            await _cache_result(key, requested, out["mode"], out.get("final_json"), result)
+            return {"mode": out["mode"], "result": result}
+        finally:
+            # 名额随管线执行结束归还；发起者断开后共享的执行仍在进行，不提前释放
+            if ticket is not None:
+                ticket.release()
+
+    def lead() -> Any:
+        nonlocal leader
+        leader = True
+        return run()
+
+    try:
+        out = await registry.singleflight.do(fkey, lead)
+    except ReviewRejected as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Rejected as e:
+        raise HTTPException(status_code=e.status, detail=e.reason, headers={"Retry-After": str(e.retry_after_s)})
+    finally:
+        # 排队期间同一请求已由他人发起，本请求只是等待结果，名额在此归还
+        if ticket is not None and not leader:
+            ticket.release()
+    response.headers["X-Pipeline-Mode"] = out["mode"]
+    response.headers["X-Cache"] = "miss"
+    return out["result"]
+
+
+async def _admit(request: Request, body: GenerateRequest) -> Optional[Ticket]:
+    # 等待执行名额：队列满 429、排队超过截止时间 503，均带 Retry-After；排队期间客户端断开则撤销
+    deadline_ms = body.deadline_ms or serving_config.default_deadline_ms
+    try:
+        return await registry.scheduler.acquire(
+            body.priority, deadline_ms / 1000 if deadline_ms else None, request.is_disconnected
+        )
+    except Rejected as e:
+        raise HTTPException(status_code=e.status, detail=e.reason, headers={"Retry-After": str(e.retry_after_s)})
+    except Abandoned:
+        # 客户端已不在，状态码只出现在访问日志里（同 nginx 的 499）
+        raise HTTPException(status_code=499, detail="客户端已断开")
+
+
+def _parse_final(final_json: Any) -> Any:
     try:
         data = json.loads(final_json)
     except Exception:
         # 若 LLM 格式不完全，直接返回原文本，便于前端观察与调试
         return {"raw": final_json}
-    return data 
\ No newline at end of file
+    return data
+
+
+async def _cache_result(key: str, requested: str, mode: str, final_json: Any, result: Any) -> None:
+    # 只缓存按请求模式完整生成、且能解析为 JSON 的结果；降级产物与原文兜底不入缓存
+    cache = registry.result_cache
+    if cache is None or not cacheable(mode) or mode != requested or result == {"raw": final_json}:
+        return
+    await cache.aput(key, {"mode": mode, "result": result})
+
+
+async def _execute_job(req: UserRequest, mode: str) -> Any:
+    out = await registry.pipeline.arun_selected(req, mode, allow_degrade=False)
+    result = _parse_final(out.get("final_json"))
+    await _cache_result(fingerprint(req, mode), mode, out["mode"], out.get("final_json"), result)
+    return result
+
+
+@app.post("/strategy/jobs", status_code=202)
+async def submit_job(body: JobRequest, response: Response):
+    req = await afetch_user_request(body.user_id)
+    if not req:
+        raise HTTPException(status_code=404, detail="User not found")
+    mode = body.mode or pipeline_config.mode
+    # 结果缓存命中时直接建成已完成的任务，不进入队列
+    cache = registry.result_cache if cacheable(mode) else None
+    hit = await cache.aget(fingerprint(req, mode)) if cache is not None else None
+    try:
+        job, deduplicated = await registry.jobs.submit(
+            body.user_id, req, mode, body.priority, hit["result"] if hit is not None else None
+        )
+    except Rejected as e:
+        raise HTTPException(status_code=e.status, detail=e.reason, headers={"Retry-After": str(e.retry_after_s)})
+    response.headers["Location"] = f"/strategy/jobs/{job['job_id']}"
+    return {"job_id": job["job_id"], "status": job["status"], "deduplicated": deduplicated}
+
+
+@app.get("/strategy/jobs/{job_id}")
+async def get_job(job_id: str, response: Response):
+    job = await registry.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("queued", "running"):
+        # 提示客户端的轮询间隔
+        response.headers["Retry-After"] = "1"
+    return job
+
+
+@app.post("/strategy/batch")
+async def generate_strategy_batch(body: BatchGenerateRequest):
+    if body.requests is not None:
+        pages: Any = [list(enumerate(body.requests))]
+    elif body.user_ids is not None or body.start_id is not None or body.end_id is not None:
+        pages = iter_user_request_pages(body.user_ids, body.start_id, body.end_id, serving_config.batch_page_size)
+    else:
+        raise HTTPException(status_code=422, detail="需要提供 user_ids、start_id/end_id 或 requests")
+    runner = BatchRunner(registry.pipeline, body.mode, body.concurrency, scheduler=registry.scheduler)
+
+    # 每行一个结果事件，按完成顺序输出；最后一行为吞吐统计
+    async def rows() -> AsyncIterator[str]:
+        async for row in runner.run(pages):
+            yield json.dumps({"event": "result", **row}, ensure_ascii=False) + "\n"
+        yield json.dumps({"event": "done", **runner.stats()}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/strategy/generate/stream")
+async def generate_strategy_stream(body: GenerateRequest, request: Request):
+    req = await afetch_user_request(body.user_id)
+    if not req:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # 默认 NDJSON（每行一个事件）；Accept: text/event-stream 时按 SSE 输出
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    def encode(event: Dict[str, Any]) -> str:
+        line = json.dumps(event, ensure_ascii=False)
+        return f"event: {event['event']}\ndata: {line}\n\n" if sse else line + "\n"
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    requested = body.mode or pipeline_config.mode
+    cache = registry.result_cache if cacheable(requested) else None
+    key = fingerprint(req, requested)
+    hit = await cache.aget(key) if cache is not None else None
+    if hit is not None:
+        async def cached() -> AsyncIterator[str]:
+            yield encode({"event": "done", "mode": hit["mode"], "result": hit["result"], "cached": True})
+
+        headers = {"Cache-Control": "no-cache", "X-Pipeline-Mode": hit["mode"], "X-Cache": "hit"}
+        return StreamingResponse(cached(), media_type=media_type, headers=headers)
+
+    mode = registry.pipeline.select_mode(body.mode, body.allow_degrade)
+    trace = debug_trace(request.headers)
+    # 在返回响应头之前完成准入，拒绝时仍能给出 429/503 状态码
+    ticket = await _admit(request, body) if mode != "fast" else None
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event in registry.pipeline.astream(req, mode):
+                if event["event"] == "done":
+                    result = _parse_final(event["final_json"])
+                    await _cache_result(key, requested, mode, event["final_json"], result)
+                    event = {"event": "done", "mode": mode, "result": result}
+                    if trace is not None:
+                        event["trace"] = trace.to_dict()
+                yield encode(event)
+        except ReviewRejected as e:
+            yield encode({"event": "error", "detail": str(e)})
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    stream = events()
+    if ticket is not None:
+        # 生成器从未开始迭代就被丢弃（如发送响应头时连接已断）时 finally 不会执行，回收时兜底归还名额
+        weakref.finalize(stream, ticket.release)
+    headers = {"Cache-Control": "no-cache", "X-Pipeline-Mode": mode, "X-Cache": "miss"}
+    return StreamingResponse(stream, media_type=media_type, headers=headers)
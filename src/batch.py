@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Set
+
+from .config import serving_config
+from .graph.pipeline_graph import PIPELINE_MODES
+from .models.schemas import UserRequest
+from .serving.batch import BatchRunner, Page
+from .serving.registry import registry
+import asyncio
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    pa = None  # type: ignore
+    pq = None  # type: ignore
+
+
+def parse_ids(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def iter_request_file(path: str, page_size: int) -> Iterator[Page]:
+    # 每行一个 UserRequest JSON；可带顶层 "id" 字段作为结果 key，否则使用行号
+    page: Page = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            page.append((obj.pop("id", lineno), UserRequest.model_validate(obj)))
+            if len(page) >= page_size:
+                yield page
+                page = []
+    if page:
+        yield page
+
+
+class JsonlSink:
+    # 逐行追加并立即 flush，输出文件本身即断点：重跑时跳过已成功的 key
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._f = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def completed(path: str) -> Set[str]:
+        done: Set[str] = set()
+        if not os.path.isfile(path):
+            return done
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except Exception:
+                    continue  # 中断时写了一半的行
+                if row.get("ok"):
+                    done.add(str(row["key"]))
+        return done
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+# result 以 JSON 字符串存放；显式 schema 保证各分片列类型一致（error 全空时也是 string）
+_PARQUET_SCHEMA = (
+    pa.schema([
+        ("key", pa.string()),
+        ("mode", pa.string()),
+        ("ok", pa.bool_()),
+        ("result", pa.string()),
+        ("error", pa.string()),
+        ("ms", pa.float64()),
+    ])
+    if pa is not None
+    else None
+)
+
+
+class ParquetSink:
+    # 输出目录下按行组写分片文件；每次运行使用独立前缀，续跑时读取已有分片的 key 列
+    def __init__(self, path: str, rows_per_file: int = 1000) -> None:
+        if pa is None:
+            raise RuntimeError("写 Parquet 需要安装 pyarrow")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self._run = uuid.uuid4().hex[:8]
+        self._parts = 0
+        self._rows: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def completed(path: str) -> Set[str]:
+        done: Set[str] = set()
+        for part in glob.glob(os.path.join(path, "part-*.parquet")):
+            table = pq.read_table(part, columns=["key", "ok"])
+            done.update(k for k, ok in zip(table["key"].to_pylist(), table["ok"].to_pylist()) if ok)
+        return done
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._rows.append(dict(row, result=json.dumps(row["result"], ensure_ascii=False)))
+        if len(self._rows) >= self.rows_per_file:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._rows:
+            return
+        name = os.path.join(self.path, f"part-{self._run}-{self._parts:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(self._rows, schema=_PARQUET_SCHEMA), name + ".tmp")
+        os.replace(name + ".tmp", name)
+        self._parts += 1
+        self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+
+
+def open_sink(path: str) -> Any:
+    return ParquetSink(path) if path.endswith(".parquet") else JsonlSink(path)
+
+
+async def arun(args: argparse.Namespace) -> Dict[str, Any]:
+    from .db.models import iter_user_request_pages
+
+    page_size = args.page_size or serving_config.batch_page_size
+    if args.requests:
+        pages: Any = iter_request_file(args.requests, page_size)
+    elif args.ids:
+        pages = iter_user_request_pages(user_ids=parse_ids(args.ids), page_size=page_size)
+    else:
+        start, _, end = (args.range or "").partition("-")
+        pages = iter_user_request_pages(
+            start_id=int(start) if start else None, end_id=int(end) if end else None, page_size=page_size
+        )
+    sink_cls = ParquetSink if args.out.endswith(".parquet") else JsonlSink
+    skip = set() if args.no_resume else sink_cls.completed(args.out)
+    runner = BatchRunner(registry.pipeline, args.mode, args.concurrency, skip)
+    sink = open_sink(args.out)
+    last_report = time.perf_counter()
+    try:
+        async for row in runner.run(pages):
+            sink.write(row)
+            if time.perf_counter() - last_report >= args.report_every:
+                print(json.dumps(runner.stats(), ensure_ascii=False), file=sys.stderr, flush=True)
+                last_report = time.perf_counter()
+    finally:
+        sink.close()
+    return runner.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量生成保险策略")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--ids", help="逗号分隔的 user_id 列表")
+    source.add_argument("--range", help="user_id 区间，如 1-50000；缺省为全部用户")
+    source.add_argument("--requests", help="UserRequest JSONL 文件（每行一个，可带 id 字段）")
+    parser.add_argument("--out", required=True, help="输出路径：.jsonl，或以 .parquet 结尾的目录（需 pyarrow）")
+    parser.add_argument("--mode", choices=PIPELINE_MODES, default=None, help="fast/hybrid/full，默认取 PIPELINE_MODE")
+    parser.add_argument("--concurrency", type=int, default=None, help="并发用户数，默认 STRATEGY_BATCH_CONCURRENCY")
+    parser.add_argument("--page-size", type=int, default=None, help="数据库分页大小，默认 STRATEGY_BATCH_PAGE_SIZE")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有输出，全部重新生成")
+    parser.add_argument("--report-every", type=float, default=10.0, help="进度输出间隔（秒）")
+    args = parser.parse_args()
+    try:
+        print(json.dumps(asyncio.run(arun(args)), ensure_ascii=False))
+    finally:
+        registry.shutdown()
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 @dataclass
@@ -14,12 +14,57 @@ class ModelConfig:
         r"D:\PycharmProjects\LoveYiNuo\RAG\model-sft\output\v4-20250805-171721\checkpoint-500",
     )
     max_new_tokens: int = int(os.getenv("MAX_NEW_TOKENS", "1024"))
+    # 推理后端：hf（transformers 原精度，CPU 上为 fp32）/ int8（合并 LoRA 后对 Linear 做动态 int8 量化）/ gguf（llama.cpp）
+    backend: str = os.getenv("LLM_BACKEND", "hf")
+    # python -m src.tools.model_export 导出的合并（int8）产物目录；为空时 int8 后端在启动时现场合并并量化
+    merged_model_dir: str = os.getenv("MERGED_MODEL_DIR", "")
+    # 合并 LoRA 后的 checkpoint 缓存（按基座与 LoRA 目录哈希分子目录，safetensors 以 mmap 加载）；置空关闭
+    merged_cache_dir: str = os.getenv("MERGED_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".merged_cache"))
+    # 缓存未命中时，启动阶段合并后顺带写入缓存，下次启动直接命中
+    merged_cache_build: bool = os.getenv("MERGED_CACHE_BUILD", "1") == "1"
+    gguf_path: str = os.getenv("GGUF_MODEL_PATH", "")
+    llama_threads: int = int(os.getenv("LLAMA_THREADS", "0"))
+    llama_n_ctx: int = int(os.getenv("LLAMA_N_CTX", "4096"))
     temperature: float = float(os.getenv("GEN_TEMPERATURE", "0.2"))
+    # 动态微批：攒批窗口内最多合并 batch_max_size 个请求做一次 generate；<=1 关闭
+    batch_max_size: int = int(os.getenv("BATCH_MAX_SIZE", "8"))
+    batch_window_ms: float = float(os.getenv("BATCH_WINDOW_MS", "10"))
+    # 系统提示词前缀的 KV cache 复用（每个 system prompt 只 prefill 一次）
+    prefix_cache: bool = os.getenv("PREFIX_CACHE", "1") == "1"
+    prefix_cache_max_entries: int = int(os.getenv("PREFIX_CACHE_MAX_ENTRIES", "16"))
+    # 按 pydantic schema 约束解码：每步只校验打分最高的 top_k 个候选 token
+    json_constraint: bool = os.getenv("JSON_CONSTRAINT", "1") == "1"
+    json_constraint_top_k: int = int(os.getenv("JSON_CONSTRAINT_TOP_K", "64"))
+    # 各阶段的生成预算（不超过 max_new_tokens），格式 "stage=tokens,..."；未列出的阶段用 max_new_tokens
+    stage_max_new_tokens: str = os.getenv("STAGE_MAX_NEW_TOKENS", "strategy=768,risk=384,review=768")
+    # 生成出现这些文本（模型开始续写下一轮对话）即停止，逗号分隔
+    stop_strings: str = os.getenv("GEN_STOP_STRINGS", "<|user|>,<|system|>,<|assistant|>,<|im_start|>")
+
+    def stage_budgets(self) -> Dict[str, int]:
+        budgets: Dict[str, int] = {}
+        for part in self.stage_max_new_tokens.split(","):
+            name, _, value = part.partition("=")
+            if name.strip() and value.strip().isdigit():
+                budgets[name.strip()] = int(value)
+        return budgets
+
+    def max_new_tokens_for(self, stage: Optional[str]) -> int:
+        return max(1, min(self.stage_budgets().get(stage or "", self.max_new_tokens), self.max_new_tokens))
+
+    def stop_string_list(self) -> List[str]:
+        return [s for s in self.stop_strings.split(",") if s]
 
 
 @dataclass
 class DBConfig:
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./insur_agent.db")
+    # 连接池（SQLite 不适用）：常驻连接数、突发溢出、取连接超时与连接回收周期（秒）
+    pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # 服务启动时建表（已存在则跳过）；由外部迁移工具管理表结构时设为 0
+    init_on_startup: bool = os.getenv("DB_INIT_ON_STARTUP", "1") == "1"
 
 
 @dataclass
@@ -28,11 +73,105 @@ class RagConfig:
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")
     index_path: str = os.getenv("FAISS_INDEX_PATH", os.path.join(os.path.dirname(__file__), "rag_index.faiss"))
     top_k: int = int(os.getenv("RAG_TOP_K", "4"))
+    # 知识库分块（字符数）与相邻块重叠；变化后需全量重建
+    chunk_size: int = int(os.getenv("RAG_CHUNK_SIZE", "500"))
+    chunk_overlap: int = int(os.getenv("RAG_CHUNK_OVERLAP", "80"))
+    embed_batch_size: int = int(os.getenv("RAG_EMBED_BATCH_SIZE", "64"))
+    # ANN 索引类型：flat / ivf_flat / ivf_pq / hnsw；ivf_nlist=0 时按语料规模自动取值
+    index_type: str = os.getenv("RAG_INDEX_TYPE", "flat")
+    ivf_nlist: int = int(os.getenv("RAG_IVF_NLIST", "0"))
+    ivf_nprobe: int = int(os.getenv("RAG_IVF_NPROBE", "8"))
+    pq_m: int = int(os.getenv("RAG_PQ_M", "16"))
+    pq_nbits: int = int(os.getenv("RAG_PQ_NBITS", "8"))
+    hnsw_m: int = int(os.getenv("RAG_HNSW_M", "32"))
+    hnsw_ef_construction: int = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+    hnsw_ef_search: int = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+    # 查询向量缓存：内存 LRU + 磁盘 .npy（mmap）；目录置空则只用内存层
+    embed_cache_dir: str = os.getenv("EMBED_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".embed_cache"))
+    embed_cache_size: int = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+    embed_cache_flush_every: int = int(os.getenv("EMBED_CACHE_FLUSH_EVERY", "64"))
+    # 启动预热的常用检索词（另加全部 InsuranceGoal 取值）
+    prewarm_terms: str = os.getenv("EMBED_PREWARM_TERMS", "重疾,医疗,收入保障,意外,寿险,教育金,养老,年金,等待期,免赔额")
+    # 检索方式：dense（仅向量）/ lexical（仅 BM25）/ hybrid（两路 RRF 融合）
+    retrieval_mode: str = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+    rrf_k: int = int(os.getenv("RAG_RRF_K", "60"))
+    # 混合检索时每一路召回的候选数（不小于 top_k）
+    hybrid_candidates: int = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+    # BM25 分词：bigram（中文字二元组）或 jieba（需安装 jieba）
+    lexical_tokenizer: str = os.getenv("RAG_LEXICAL_TOKENIZER", "bigram")
+
+
+@dataclass
+class PipelineConfig:
+    # fast: 纯启发式 + 规则 Agent；hybrid: 启发式草案 + LLM 复核；full: 三段 LLM
+    mode: str = os.getenv("PIPELINE_MODE", "full")
+    # 生成队列积压达到该深度时，允许降级的请求自动切到 fast；0 表示不降级
+    fast_fallback_queue_depth: int = int(os.getenv("FAST_FALLBACK_QUEUE_DEPTH", "0"))
+    # full 模式下风控阶段基于启发式草案提前启动，与 LLM 策略生成并行
+    risk_on_draft: bool = os.getenv("RISK_ON_DRAFT", "0") == "1"
+
+
+@dataclass
+class ServingConfig:
+    # 启动时预热：加载模型/索引后跑一次极短推理，避免首个请求承担冷启动
+    warmup_on_startup: bool = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+    # 策略结果缓存：按分档后的画像指纹复用整条生成结果；容量为 0 关闭，路径置空则只用内存
+    result_cache_size: int = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+    result_cache_ttl_s: float = float(os.getenv("RESULT_CACHE_TTL_S", "3600"))
+    result_cache_path: str = os.getenv("RESULT_CACHE_PATH", "")
+    # 批量生成：并发用户数（应大于 BATCH_MAX_SIZE 才能攒满生成批）与数据库分页大小
+    batch_concurrency: int = int(os.getenv("STRATEGY_BATCH_CONCURRENCY", "16"))
+    # HTTP 批量接口允许客户端指定的并发上限（每个并发对应一个 worker 协程与两个队列槽位）
+    batch_concurrency_max: int = int(os.getenv("STRATEGY_BATCH_CONCURRENCY_MAX", "64"))
+    batch_page_size: int = int(os.getenv("STRATEGY_BATCH_PAGE_SIZE", "500"))
+    # 准入控制：同时执行的管线上限（<=0 关闭）与各通道排队上限，队列满返回 429
+    max_inflight: int = int(os.getenv("SCHED_MAX_INFLIGHT", "16"))
+    max_queue: int = int(os.getenv("SCHED_MAX_QUEUE", "64"))
+    max_batch_queue: int = int(os.getenv("SCHED_MAX_BATCH_QUEUE", "256"))
+    # 为交互请求保留的名额数，批量通道最多占用 max_inflight - interactive_reserve
+    interactive_reserve: int = int(os.getenv("SCHED_INTERACTIVE_RESERVE", "2"))
+    # 请求未指定 deadline_ms 时的默认排队截止时间（毫秒，0 表示不限），超时返回 503
+    default_deadline_ms: int = int(os.getenv("SCHED_DEFAULT_DEADLINE_MS", "0"))
+    # 异步任务：worker 数与排队任务上限（<=0 不限），超过上限时提交返回 429
+    jobs_workers: int = int(os.getenv("JOBS_WORKERS", "4"))
+    jobs_max_pending: int = int(os.getenv("JOBS_MAX_PENDING", "1000"))
+    # 任务租约（秒）：执行中每 1/3 租约续约一次；进程退出后租约过期的任务由其他 worker 接手，
+    # 同一周期内还会扫描排队超过一个租约仍无人认领的任务
+    jobs_lease_s: float = float(os.getenv("JOBS_LEASE_S", "30"))
+    # 每个任务最多被认领执行的次数：执行中进程反复崩溃（OOM 等）的任务达到上限后标记为 failed，不再重试
+    jobs_max_attempts: int = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+    # 多进程部署：设置后 API 进程不加载模型，LLM 生成与查询嵌入经该 Unix socket 交给推理进程，FAISS 索引以只读 mmap 打开
+    inference_socket: str = os.getenv("INFERENCE_SOCKET", "")
+    # 连接推理进程的等待上限（推理进程可能仍在加载模型）与同步调用（嵌入、统计）的超时
+    inference_connect_timeout_s: float = float(os.getenv("INFERENCE_CONNECT_TIMEOUT_S", "300"))
+    inference_call_timeout_s: float = float(os.getenv("INFERENCE_CALL_TIMEOUT_S", "60"))
+    # 远程生成的超时（含在推理进程生成队列中的等待）；流式生成为相邻两段输出之间的最长间隔
+    inference_generate_timeout_s: float = float(os.getenv("INFERENCE_GENERATE_TIMEOUT_S", "300"))
+
+
+@dataclass
+class TracingConfig:
+    # 分阶段计时与 /metrics 直方图；关闭时 span() 返回共享的空对象，不计时、不加锁
+    enabled: bool = os.getenv("TRACING", "1") == "1"
+    # 允许请求带 X-Debug-Trace: 1 时在响应头 X-Trace（流式为 done 事件）返回本次请求的各阶段耗时与 LLM 用量；
+    # 会暴露内部信息，默认关闭，仅在调试环境开启
+    debug_header: bool = os.getenv("TRACE_DEBUG_HEADER", "0") == "1"
+    # X-Trace 响应头的字节上限（常见代理默认 8KB 头部上限），超出时改为按阶段名汇总
+    header_max_bytes: int = int(os.getenv("TRACE_HEADER_MAX_BYTES", "4096"))
+    # 每个指标保留最近 N 个样本，用于 /stats 中的 p50/p95/p99
+    reservoir: int = int(os.getenv("TRACE_RESERVOIR", "2048"))
 
 
 model_config = ModelConfig()
 rag_config = RagConfig()
+pipeline_config = PipelineConfig()
+serving_config = ServingConfig()
+tracing_config = TracingConfig()
 _db_config = DBConfig()
 
 def get_database_url() -> str:
-    return _db_config.database_url 
\ No newline at end of file
+    return _db_config.database_url
+
+
+def get_db_config() -> DBConfig:
+    return _db_config 
\ No newline at end of file
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import argparse
+
+from ..config import get_database_url
+from .models import Base, dispose_engine, init_db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m src.db", description="数据库维护")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init", help="创建缺失的表（已存在的表不变）")
+    args = parser.parse_args()
+    if args.command == "init":
+        init_db()
+        dispose_engine()
+        print(f"已初始化 {', '.join(sorted(Base.metadata.tables))} @ {get_database_url()}")
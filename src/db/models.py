@@ -1,14 +1,18 @@
 from __future__ import annotations
 
-from typing import Optional, List
+from typing import Any, Dict, Iterator, Optional, List, Sequence, Tuple
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
-from sqlalchemy import create_engine, String, Integer, Float, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import create_engine, or_, select, update, String, Integer, Float, ForeignKey, Text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload, relationship, selectinload
 
-from ..config import get_database_url
+from ..config import get_database_url, get_db_config
 from ..models.schemas import (
     InsuredInfo, FinancialStatus, InsuranceGoal, ExistingPolicy, UserRequest
 )
+from ..tracing import span
 import asyncio
 
 
@@ -50,8 +54,112 @@ class Policy(Base):
     user: Mapped[User] = relationship(back_populates="policies")
 
 
-_engine = create_engine(get_database_url(), echo=False)
-Base.metadata.create_all(_engine)
+class StrategyJob(Base):
+    __tablename__ = "strategy_jobs"
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    mode: Mapped[str] = mapped_column(String(16))
+    priority: Mapped[str] = mapped_column(String(16), default="interactive")
+    # user_id + 模式 + 请求内容摘要：相同 key 的排队中/执行中任务与结果缓存有效期内的已完成任务直接复用
+    dedup_key: Mapped[str] = mapped_column(String(128), index=True)
+    # 仅排队中/执行中的任务持有（= dedup_key），结束时置空；唯一约束保证跨进程同一 key 只有一个在途任务
+    active_key: Mapped[Optional[str]] = mapped_column(String(128), nullable=True, unique=True)
+    # queued / running / done / failed
+    status: Mapped[str] = mapped_column(String(16), index=True)
+    # 提交时的 UserRequest 快照：执行与重启恢复都基于它，不受之后资料修改影响
+    request: Mapped[str] = mapped_column(Text)
+    result: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # 结果 JSON
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[float] = mapped_column(Float)
+    started_at: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    finished_at: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # 认领的 worker 与租约到期时间：执行中定期续约，租约过期的 running 任务才允许被重新认领
+    worker_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+
+# 同步驱动 -> asyncio 驱动；已是异步驱动的连接串原样使用
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False) if driver else url
+
+
+def _engine_kwargs(url: str) -> Dict[str, Any]:
+    # SQLite 为单文件、无连接池调优意义；服务端数据库启用连接池与断线探测
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    cfg = get_db_config()
+    return {
+        "pool_size": cfg.pool_size,
+        "max_overflow": cfg.max_overflow,
+        "pool_timeout": cfg.pool_timeout,
+        "pool_recycle": cfg.pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+# 引擎在首次使用时创建：导入本模块（以及 server、CLI）不连接数据库、不执行 DDL
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_async_session: Optional[async_sessionmaker[AsyncSession]] = None
+
+
+def get_engine() -> Engine:
+    global _engine
+    if _engine is None:
+        url = get_database_url()
+        _engine = create_engine(url, echo=False, **_engine_kwargs(url))
+    return _engine
+
+
+def get_async_session() -> async_sessionmaker[AsyncSession]:
+    # 只跑同步脚本（如建库、批量 CLI）时无需 aiosqlite/asyncpg
+    global _async_engine, _async_session
+    if _async_session is None:
+        url = async_database_url(get_database_url())
+        _async_engine = create_async_engine(url, echo=False, **_engine_kwargs(url))
+        _async_session = async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_session
+
+
+def init_db() -> None:
+    # 显式建表（已存在的表跳过）：python -m src.db init，或服务启动时按 DB_INIT_ON_STARTUP 执行
+    Base.metadata.create_all(get_engine())
+
+
+async def ainit_db() -> None:
+    get_async_session()
+    assert _async_engine is not None
+    async with _async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def dispose_engine() -> None:
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+    _engine = None
+
+
+async def adispose_engine() -> None:
+    global _async_engine, _async_session
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session = None
+    dispose_engine()
 
 
 def _to_user_request(u: User, ps: List[Policy]) -> UserRequest:
@@ -86,12 +194,224 @@ def _to_user_request(u: User, ps: List[Policy]) -> UserRequest:
 
 
 def fetch_user_request(user_id: int) -> Optional[UserRequest]:
-    with Session(_engine) as s:
-        u = s.get(User, user_id)
+    # 单用户：joinedload 让用户与保单在一次往返内取回
+    with span("db.fetch_user", users=1), Session(get_engine()) as s:
+        u = s.get(User, user_id, options=[joinedload(User.policies)])
         if not u:
             return None
-        ps = s.query(Policy).filter(Policy.user_id == user_id).all()
-        return _to_user_request(u, ps)
+        return _to_user_request(u, u.policies)
+
+
+def fetch_user_requests(user_ids: Sequence[int]) -> Dict[int, UserRequest]:
+    # 多用户：一条 IN 查询取用户，selectinload 再用一条 IN 查询批量取全部保单，与用户数无关
+    if not user_ids:
+        return {}
+    with span("db.fetch_user", users=len(user_ids)), Session(get_engine()) as s:
+        rows = s.scalars(select(User).where(User.id.in_(list(user_ids))).options(selectinload(User.policies))).all()
+        return {u.id: _to_user_request(u, u.policies) for u in rows}
+
+def iter_user_request_pages(
+    user_ids: Optional[Sequence[int]] = None,
+    start_id: Optional[int] = None,
+    end_id: Optional[int] = None,
+    page_size: int = 500,
+) -> Iterator[List[Tuple[int, UserRequest]]]:
+    # 分页读取：显式 id 列表按块 IN 查询，区间/全表按主键 keyset 翻页；保单用 selectinload 每页一次批量加载
+    if user_ids is not None:
+        ids = list(dict.fromkeys(user_ids))
+        for i in range(0, len(ids), page_size):
+            chunk = ids[i:i + page_size]
+            by_id = fetch_user_requests(chunk)
+            yield [(uid, by_id[uid]) for uid in chunk if uid in by_id]
+        return
+    last_id = (start_id - 1) if start_id is not None else None
+    while True:
+        stmt = select(User).options(selectinload(User.policies)).order_by(User.id).limit(page_size)
+        if last_id is not None:
+            stmt = stmt.where(User.id > last_id)
+        if end_id is not None:
+            stmt = stmt.where(User.id <= end_id)
+        with Session(get_engine()) as s:
+            page = [(u.id, _to_user_request(u, u.policies)) for u in s.scalars(stmt).all()]
+        if not page:
+            return
+        yield page
+        last_id = page[-1][0]
+        if len(page) < page_size:
+            return
+
 
 async def afetch_user_request(user_id: int) -> Optional[UserRequest]:
-    return await asyncio.to_thread(fetch_user_request, user_id) 
\ No newline at end of file
+    # 原生异步驱动：不占用线程池，等待数据库期间事件循环继续处理其他请求
+    with span("db.fetch_user", users=1):
+        async with get_async_session()() as s:
+            u = await s.get(User, user_id, options=[joinedload(User.policies)])
+            if not u:
+                return None
+            return _to_user_request(u, u.policies)
+
+
+async def afetch_user_requests(user_ids: Sequence[int]) -> Dict[int, UserRequest]:
+    if not user_ids:
+        return {}
+    with span("db.fetch_user", users=len(user_ids)):
+        async with get_async_session()() as s:
+            stmt = select(User).where(User.id.in_(list(user_ids))).options(selectinload(User.policies))
+            rows = (await s.scalars(stmt)).all()
+            return {u.id: _to_user_request(u, u.policies) for u in rows}
+
+
+async def acreate_job(job: StrategyJob) -> bool:
+    # active_key 冲突（其他进程刚提交了同一 key 的任务）时返回 False
+    async with get_async_session()() as s:
+        s.add(job)
+        try:
+            await s.commit()
+        except IntegrityError:
+            await s.rollback()
+            return False
+        return True
+
+
+async def aget_job(job_id: str) -> Optional[StrategyJob]:
+    async with get_async_session()() as s:
+        return await s.get(StrategyJob, job_id)
+
+
+async def afind_job(dedup_key: str, done_since: float) -> Optional[StrategyJob]:
+    # 优先复用在途任务；已完成任务只复用 done_since 之后完成的，失败的任务不参与去重
+    async with get_async_session()() as s:
+        job = (await s.scalars(select(StrategyJob).where(StrategyJob.active_key == dedup_key).limit(1))).first()
+        if job is not None:
+            return job
+        stmt = (
+            select(StrategyJob)
+            .where(
+                StrategyJob.dedup_key == dedup_key,
+                StrategyJob.status == "done",
+                StrategyJob.finished_at >= done_since,
+            )
+            .order_by(StrategyJob.finished_at.desc())
+            .limit(1)
+        )
+        return (await s.scalars(stmt)).first()
+
+
+def _claimable(now: float, max_attempts: int):
+    # queued 或租约已过期的 running，且尝试次数未达上限（<=0 不限）
+    cond = or_(
+        StrategyJob.status == "queued",
+        (StrategyJob.status == "running") & (StrategyJob.lease_until < now),
+    )
+    return cond & (StrategyJob.attempts < max_attempts) if max_attempts > 0 else cond
+
+
+async def aclaim_job(
+    job_id: str, worker_id: str, now: float, lease_until: float, max_attempts: int = 0
+) -> Optional[StrategyJob]:
+    # 条件更新：多个 worker（或进程）取到同一 id 时只有一个成功
+    async with get_async_session()() as s:
+        claimed = await s.execute(
+            update(StrategyJob)
+            .where(StrategyJob.id == job_id, _claimable(now, max_attempts))
+            .values(
+                status="running",
+                started_at=now,
+                worker_id=worker_id,
+                lease_until=lease_until,
+                attempts=StrategyJob.attempts + 1,
+            )
+        )
+        await s.commit()
+        if claimed.rowcount != 1:
+            return None
+        return await s.get(StrategyJob, job_id)
+
+
+def _owned(job_id: str, worker_id: str):
+    return (StrategyJob.id == job_id) & (StrategyJob.worker_id == worker_id) & (StrategyJob.status == "running")
+
+
+async def arenew_lease(job_id: str, worker_id: str, lease_until: float) -> bool:
+    # 续约失败说明租约已过期并被其他 worker 接手
+    async with get_async_session()() as s:
+        renewed = await s.execute(update(StrategyJob).where(_owned(job_id, worker_id)).values(lease_until=lease_until))
+        await s.commit()
+        return renewed.rowcount == 1
+
+
+async def afinish_job(
+    job_id: str, worker_id: str, status: str, now: float, result: Optional[str] = None, error: Optional[str] = None
+) -> bool:
+    # 只有仍持有租约的 worker 能写结果
+    async with get_async_session()() as s:
+        finished = await s.execute(
+            update(StrategyJob)
+            .where(_owned(job_id, worker_id))
+            .values(status=status, finished_at=now, result=result, error=error, active_key=None, lease_until=None)
+        )
+        await s.commit()
+        return finished.rowcount == 1
+
+
+async def arelease_job(job_id: str, worker_id: str) -> None:
+    # 正常停机时交还执行中的任务，其他 worker 无需等租约过期即可接手；本次不计入尝试次数
+    async with get_async_session()() as s:
+        await s.execute(
+            update(StrategyJob)
+            .where(_owned(job_id, worker_id))
+            .values(
+                status="queued",
+                worker_id=None,
+                lease_until=None,
+                started_at=None,
+                attempts=StrategyJob.attempts - 1,
+            )
+        )
+        await s.commit()
+
+
+async def aclaimable_jobs(now: float, queued_before: float, limit: int, max_attempts: int = 0) -> List[str]:
+    # 只读查询，不改状态：提交时间早于 queued_before 仍在排队的任务（提交它的进程可能已退出）
+    # 与租约已过期的 running 任务，按提交顺序返回
+    async with get_async_session()() as s:
+        stmt = (
+            select(StrategyJob.id)
+            .where(
+                or_(
+                    (StrategyJob.status == "queued") & (StrategyJob.created_at < queued_before),
+                    (StrategyJob.status == "running") & (StrategyJob.lease_until < now),
+                )
+            )
+            .order_by(StrategyJob.created_at)
+            .limit(limit)
+        )
+        if max_attempts > 0:
+            stmt = stmt.where(StrategyJob.attempts < max_attempts)
+        return list((await s.scalars(stmt)).all())
+
+
+async def afail_exhausted_jobs(now: float, max_attempts: int) -> int:
+    # 尝试次数已达上限、又因进程退出回到可认领状态的任务：标记为 failed，不再重试
+    if max_attempts <= 0:
+        return 0
+    async with get_async_session()() as s:
+        failed = await s.execute(
+            update(StrategyJob)
+            .where(
+                or_(
+                    StrategyJob.status == "queued",
+                    (StrategyJob.status == "running") & (StrategyJob.lease_until < now),
+                ),
+                StrategyJob.attempts >= max_attempts,
+            )
+            .values(
+                status="failed",
+                finished_at=now,
+                error=f"执行 {max_attempts} 次均未完成（进程退出或被终止），不再重试",
+                active_key=None,
+                lease_until=None,
+            )
+        )
+        await s.commit()
+        return failed.rowcount
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from ..tracing import span
+import asyncio
+
+# 节点函数：读取共享 state，返回需要合并进 state 的增量字段
+NodeFn = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class Node:
+    name: str
+    fn: NodeFn
+    deps: Tuple[str, ...] = ()
+
+
+@dataclass
+class DagTrace:
+    nodes: Dict[str, Tuple[float, float]] = field(default_factory=dict)  # name -> (start, end)，单位秒，相对起点
+    critical_path: List[str] = field(default_factory=list)
+    total_s: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(1000 * self.total_s, 3),
+            "critical_path": self.critical_path,
+            "nodes": {
+                name: {
+                    "start_ms": round(1000 * start, 3),
+                    "end_ms": round(1000 * end, 3),
+                    "ms": round(1000 * (end - start), 3),
+                }
+                for name, (start, end) in self.nodes.items()
+            },
+        }
+
+
+class DagExecutor:
+    # 依赖感知的异步执行器：依赖全部完成的节点立即并发启动，并记录每次运行的关键路径
+    def __init__(self, nodes: Sequence[Node]) -> None:
+        self.nodes: Dict[str, Node] = {}
+        for node in nodes:
+            if node.name in self.nodes:
+                raise ValueError(f"重复的节点: {node.name}")
+            self.nodes[node.name] = node
+        for node in nodes:
+            for dep in node.deps:
+                if dep not in self.nodes:
+                    raise ValueError(f"节点 {node.name} 依赖不存在的节点 {dep}")
+        self.order = self._toposort()
+
+    def _toposort(self) -> List[str]:
+        order: List[str] = []
+        state: Dict[str, int] = {}  # 1: 访问中, 2: 完成
+
+        def visit(name: str) -> None:
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"节点依赖存在环: {name}")
+            state[name] = 1
+            for dep in self.nodes[name].deps:
+                visit(dep)
+            state[name] = 2
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name)
+        return order
+
+    @property
+    def sinks(self) -> List[str]:
+        used = {dep for node in self.nodes.values() for dep in node.deps}
+        return [name for name in self.order if name not in used]
+
+    async def run(self, state: Dict[str, Any]) -> Tuple[Dict[str, Any], DagTrace]:
+        trace = DagTrace()
+        t0 = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_node(node: Node) -> None:
+            if node.deps:
+                await asyncio.gather(*(tasks[d] for d in node.deps))
+            start = time.perf_counter() - t0
+            with span(f"node.{node.name}"):
+                update = await node.fn(state)
+            trace.nodes[node.name] = (start, time.perf_counter() - t0)
+            state.update(update or {})
+
+        # 按拓扑序创建任务，保证依赖任务先于依赖方存在
+        for name in self.order:
+            tasks[name] = asyncio.create_task(run_node(self.nodes[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        trace.total_s = time.perf_counter() - t0
+        trace.critical_path = self._critical_path(trace)
+        return state, trace
+
+    def _critical_path(self, trace: DagTrace) -> List[str]:
+        if not trace.nodes:
+            return []
+        # 从最晚结束的节点出发，沿“最晚完成的依赖”回溯
+        name = max(trace.nodes, key=lambda n: trace.nodes[n][1])
+        path = [name]
+        while self.nodes[name].deps:
+            name = max(self.nodes[name].deps, key=lambda n: trace.nodes[n][1])
+            path.append(name)
+        return list(reversed(path))
+
+    def add_to_graph(self, graph: Any, start: Any, end: Any) -> None:
+        # 将同一组节点注册到 LangGraph StateGraph：多依赖节点使用扇入边
+        for name in self.order:
+            graph.add_node(name, self.nodes[name].fn)
+        for name in self.order:
+            deps = list(self.nodes[name].deps)
+            if not deps:
+                graph.add_edge(start, name)
+            elif len(deps) == 1:
+                graph.add_edge(deps[0], name)
+            else:
+                graph.add_edge(deps, name)
+        for name in self.sinks:
+            graph.add_edge(name, end)
@@ -1,123 +1,322 @@
 from __future__ import annotations
 
-from typing import Dict, Any, List
-
-try:
-    from langgraph.graph import StateGraph, END  # type: ignore
-except Exception:
-    StateGraph = None  # type: ignore
-    END = None  # type: ignore
+import json
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Any, AsyncIterator, List, Literal, Optional, Tuple, TypedDict
 
+from ..agents.executor import ExecutionAgent
 from ..agents.prompts import PLANNER_SYSTEM, STRATEGY_SYSTEM, RISK_SYSTEM, REVIEW_SYSTEM
-from ..tools.local_llm import LocalQwen
-from ..rag.vectorstore import VectorStore
-from ..models.schemas import UserRequest, StrategyRecommendation
+from ..agents.reviewer import ReviewAgent, ReviewRejected
+from ..agents.risk import RiskAgent
+from ..config import pipeline_config
+from ..tools.evaluator import assess_budget, assess_gaps
+from ..tools.llm import heuristic_generate_strategy
+from ..models.schemas import RiskWarning, UserRequest, StrategyRecommendation
+from ..tracing import span
+from .dag import DagExecutor, Node
 import asyncio
 
+if TYPE_CHECKING:
+    from ..rag.vectorstore import VectorStore
+    from ..tools.local_llm import LocalQwen
+
+PipelineMode = Literal["fast", "hybrid", "full"]
+PIPELINE_MODES: Tuple[str, ...] = ("fast", "hybrid", "full")
+# 各 LLM 阶段的输出 schema，用于约束解码
+STAGE_SCHEMAS: Dict[str, Any] = {
+    "strategy": StrategyRecommendation,
+    "risk": List[RiskWarning],
+    "review": StrategyRecommendation,
+}
+
+
+class PipelineState(TypedDict, total=False):
+    req: UserRequest
+    plan: Dict[str, Any]
+    hints: List[str]
+    profile: Dict[str, str]
+    ctx_docs: List[str]
+    draft_json: str
+    precheck_json: str
+    strategy_json: str
+    risk_json: str
+    final_json: str
+
+
+def _default_llm() -> LocalQwen:
+    from ..tools.local_llm import load_llm
+
+    return load_llm()
+
+
+def _default_vs() -> VectorStore:
+    from ..rag.vectorstore import VectorStore
+
+    return VectorStore()
+
 
 class PipelineGraph:
-    def __init__(self) -> None:
-        self.llm = LocalQwen()
-        self.vs = VectorStore()
+    def __init__(
+        self,
+        llm: Optional[LocalQwen] = None,
+        vs: Optional[VectorStore] = None,
+        llm_factory: Optional[Callable[[], LocalQwen]] = None,
+        vs_factory: Optional[Callable[[], VectorStore]] = None,
+    ) -> None:
+        # 模型与索引加载代价高，服务端应通过 serving.registry 注入共享实例（或其工厂）。
+        # 未传入实例时在首次用到 LLM / 检索的阶段才加载，fast 模式全程不加载模型与嵌入
+        self._llm = llm
+        self._vs = vs
+        self._llm_factory = llm_factory or _default_llm
+        self._vs_factory = vs_factory or _default_vs
+        self._load_lock = threading.Lock()
+        # 规则 Agent 不依赖模型，fast/hybrid 模式下直接完成执行细化、风控与复核
+        self.executor = ExecutionAgent("execution", None)
+        self.risk_agent = RiskAgent("risk", None)
+        self.reviewer = ReviewAgent("review", None)
+        self._dags: Dict[str, DagExecutor] = {}
 
-    def build(self):
-        if StateGraph is None:
-            raise RuntimeError("LangGraph 未安装，请安装 langgraph 以使用图编排")
+    @property
+    def llm(self) -> LocalQwen:
+        if self._llm is None:
+            with self._load_lock:
+                if self._llm is None:
+                    self._llm = self._llm_factory()
+        return self._llm
 
-        def plan_node(state: Dict[str, Any]) -> Dict[str, Any]:
-            req: UserRequest = state["req"]
-            hints = list(set((req.knowledge_hints or []) + req.goals.goals))
-            plan = {
-                "steps": [
-                    {"id": "rag", "desc": "向量检索相关知识"},
-                    {"id": "strategy", "desc": "生成结构化策略"},
-                    {"id": "risk", "desc": "风险合并与提示"},
-                    {"id": "review", "desc": "复核与补全"},
-                ]
-            }
-            return {**state, "plan": plan, "hints": hints}
-
-        def rag_node(state: Dict[str, Any]) -> Dict[str, Any]:
-            hints: List[str] = state.get("hints", [])
-            ctx_docs = self.vs.search(hints, top_k=4)
-            return {**state, "ctx_docs": ctx_docs}
-
-        def strategy_node(state: Dict[str, Any]) -> Dict[str, Any]:
-            req: UserRequest = state["req"]
-            ctx = state.get("ctx_docs", [])
-            user_prompt = (
-                f"受保人信息: {req.insured.model_dump()}\n"
-                f"财务状况: {req.finance.model_dump()}\n"
-                f"保险目的: {req.goals.model_dump()}\n"
-                f"已有保单: {[p.model_dump() for p in req.existing_policies]}\n"
-                f"检索上下文(节选):\n{chr(10).join(ctx[:3])}\n"
-                "请输出严格符合 schema 的 JSON。"
-            )
-            text = self.llm.chat(STRATEGY_SYSTEM, user_prompt)
-            return {**state, "strategy_json": text}
-
-        def risk_node(state: Dict[str, Any]) -> Dict[str, Any]:
-            req: UserRequest = state["req"]
-            # 将 req + strategy_json 一起给风控进行 JSON 合并（由前置 prompt 约束）
-            user_prompt = (
-                f"投保人: {req.insured.model_dump()}\n财务: {req.finance.model_dump()}\n目标: {req.goals.model_dump()}\n"
-                f"策略草案(JSON):\n{state.get('strategy_json','')}\n"
-                "仅输出风控合并后的 risk_warnings JSON 数组。"
-            )
-            text = self.llm.chat(RISK_SYSTEM, user_prompt)
-            return {**state, "risk_json": text}
-
-        def review_node(state: Dict[str, Any]) -> Dict[str, Any]:
-            user_prompt = (
-                f"策略草案(JSON):\n{state.get('strategy_json','')}\n"
-                f"风控(JSON):\n{state.get('risk_json','')}\n"
-                "请输出修订后的最终 JSON 对象。"
-            )
-            text = self.llm.chat(REVIEW_SYSTEM, user_prompt)
-            return {**state, "final_json": text}
-
-        graph = StateGraph(dict)
-        graph.add_node("plan", plan_node)
-        graph.add_node("rag", rag_node)
-        graph.add_node("strategy", strategy_node)
-        graph.add_node("risk", risk_node)
-        graph.add_node("review", review_node)
-
-        graph.set_entry_point("plan")
-        graph.add_edge("plan", "rag")
-        graph.add_edge("rag", "strategy")
-        graph.add_edge("strategy", "risk")
-        graph.add_edge("risk", "review")
-        graph.add_edge("review", END)
-        return graph.compile()
+    @property
+    def vs(self) -> VectorStore:
+        if self._vs is None:
+            with self._load_lock:
+                if self._vs is None:
+                    self._vs = self._vs_factory()
+        return self._vs
+
+    def select_mode(self, requested: Optional[str] = None, allow_degrade: bool = True) -> str:
+        mode = requested or pipeline_config.mode
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f"未知的管线模式: {mode}")
+        depth = pipeline_config.fast_fallback_queue_depth
+        # 生成队列饱和时降级为 fast，避免请求继续堆积在模型前
+        if allow_degrade and mode != "fast" and depth > 0 and self.llm.queue_depth >= depth:
+            return "fast"
+        return mode
+
+    def heuristic_chain(self, req: UserRequest, ctx_docs: Optional[List[str]] = None) -> Tuple[str, StrategyRecommendation]:
+        draft = heuristic_generate_strategy(req, ctx_docs)
+        draft_json = draft.model_dump_json()
+        rec = self.executor.act(draft)
+        rec = self.risk_agent.act(req, rec)
+        return draft_json, rec
 
-    async def arun(self, req: UserRequest) -> Dict[str, Any]:
-        # 使用与同步图逻辑等价的异步实现，避免阻塞事件循环
-        hints = list(set((req.knowledge_hints or []) + req.goals.goals))
-        ctx_docs = await self.vs.asearch(hints, top_k=4)
+    @staticmethod
+    def _warnings_json(rec: StrategyRecommendation) -> str:
+        return json.dumps([w.model_dump() for w in rec.risk_warnings], ensure_ascii=False)
 
-        user_prompt_strategy = (
-            f"受保人信息: {req.insured.model_dump()}\n"
-            f"财务状况: {req.finance.model_dump()}\n"
-            f"保险目的: {req.goals.model_dump()}\n"
-            f"已有保单: {[p.model_dump() for p in req.existing_policies]}\n"
+    @staticmethod
+    def _hints(req: UserRequest) -> List[str]:
+        return list(set((req.knowledge_hints or []) + req.goals.goals))
+
+    @staticmethod
+    def _profile(req: UserRequest) -> Dict[str, str]:
+        # 数据库派生的 prompt 片段，策略与风控阶段共用
+        return {
+            "insured": str(req.insured.model_dump()),
+            "finance": str(req.finance.model_dump()),
+            "goals": str(req.goals.model_dump()),
+            "policies": str([p.model_dump() for p in req.existing_policies]),
+        }
+
+    @staticmethod
+    def _strategy_prompt(profile: Dict[str, str], ctx_docs: List[str]) -> str:
+        return (
+            f"受保人信息: {profile['insured']}\n"
+            f"财务状况: {profile['finance']}\n"
+            f"保险目的: {profile['goals']}\n"
+            f"已有保单: {profile['policies']}\n"
             f"检索上下文(节选):\n{chr(10).join(ctx_docs[:3])}\n"
             "请输出严格符合 schema 的 JSON。"
         )
-        strategy_json = await self.llm.achat(STRATEGY_SYSTEM, user_prompt_strategy)
 
-        user_prompt_risk = (
-            f"投保人: {req.insured.model_dump()}\n财务: {req.finance.model_dump()}\n目标: {req.goals.model_dump()}\n"
+    @staticmethod
+    def _risk_prompt(profile: Dict[str, str], strategy_json: str, precheck_json: Optional[str] = None) -> str:
+        precheck = f"规则预检(JSON):\n{precheck_json}\n" if precheck_json else ""
+        return (
+            f"投保人: {profile['insured']}\n财务: {profile['finance']}\n目标: {profile['goals']}\n"
             f"策略草案(JSON):\n{strategy_json}\n"
+            f"{precheck}"
             "仅输出风控合并后的 risk_warnings JSON 数组。"
         )
-        risk_json = await self.llm.achat(RISK_SYSTEM, user_prompt_risk)
 
-        user_prompt_review = (
+    @staticmethod
+    def _review_prompt(strategy_json: str, risk_json: str) -> str:
+        return (
             f"策略草案(JSON):\n{strategy_json}\n"
             f"风控(JSON):\n{risk_json}\n"
             "请输出修订后的最终 JSON 对象。"
         )
-        final_json = await self.llm.achat(REVIEW_SYSTEM, user_prompt_review)
 
-        return {"final_json": final_json, "strategy_json": strategy_json, "risk_json": risk_json, "ctx_docs": ctx_docs} 
\ No newline at end of file
+    # ---- 节点定义：arun 的 DAG 执行器与 LangGraph build() 共用 ----
+
+    async def _plan_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        plan = {
+            "steps": [
+                {"id": "rag", "desc": "向量检索相关知识"},
+                {"id": "strategy", "desc": "生成结构化策略"},
+                {"id": "risk", "desc": "风险合并与提示"},
+                {"id": "review", "desc": "复核与补全"},
+            ]
+        }
+        return {"plan": plan, "hints": self._hints(state["req"])}
+
+    async def _profile_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {"profile": self._profile(state["req"])}
+
+    async def _rag_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {"ctx_docs": await self.vs.asearch(state.get("hints", []), top_k=4)}
+
+    async def _draft_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        draft = heuristic_generate_strategy(state["req"])
+        return {"draft_json": draft.model_dump_json()}
+
+    @staticmethod
+    def _precheck(req: UserRequest, draft_json: str) -> str:
+        draft = StrategyRecommendation.model_validate_json(draft_json)
+        warnings = assess_budget(req, draft) + assess_gaps(req, draft)
+        return json.dumps([w.model_dump() for w in warnings], ensure_ascii=False)
+
+    async def _precheck_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # 预算与缺口的确定性检查基于启发式草案，与检索、LLM 生成并行
+        return {"precheck_json": self._precheck(state["req"], state["draft_json"])}
+
+    async def _strategy_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = self._strategy_prompt(state["profile"], state.get("ctx_docs", []))
+        return {"strategy_json": await self.llm.achat(STRATEGY_SYSTEM, prompt, STAGE_SCHEMAS["strategy"], "strategy")}
+
+    async def _risk_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # 将 req + strategy_json 一起给风控进行 JSON 合并（由前置 prompt 约束）
+        source = state["draft_json"] if pipeline_config.risk_on_draft else state["strategy_json"]
+        prompt = self._risk_prompt(state["profile"], source, state.get("precheck_json"))
+        return {"risk_json": await self.llm.achat(RISK_SYSTEM, prompt, STAGE_SCHEMAS["risk"], "risk")}
+
+    async def _review_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = self._review_prompt(state["strategy_json"], state["risk_json"])
+        return {"final_json": await self.llm.achat(REVIEW_SYSTEM, prompt, STAGE_SCHEMAS["review"], "review")}
+
+    async def _rules_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # hybrid：启发式草案即策略 JSON，风控走规则
+        _, rec = self.heuristic_chain(state["req"], state.get("ctx_docs"))
+        return {"strategy_json": rec.model_dump_json(), "risk_json": self._warnings_json(rec)}
+
+    async def _fast_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # 不检索、不调模型：启发式草案 + 执行/风控/复核规则链
+        strategy_json, rec = self.heuristic_chain(state["req"])
+        rec = self.reviewer.act(rec)
+        return {"final_json": rec.model_dump_json(), "strategy_json": strategy_json, "risk_json": self._warnings_json(rec)}
+
+    def nodes(self, mode: str = "full") -> List[Node]:
+        if mode == "fast":
+            return [Node("fast", self._fast_node)]
+        if mode == "hybrid":
+            return [
+                Node("plan", self._plan_node),
+                Node("rag", self._rag_node, ("plan",)),
+                Node("rules", self._rules_node, ("rag",)),
+                Node("review", self._review_node, ("rules",)),
+            ]
+        risk_source = "draft" if pipeline_config.risk_on_draft else "strategy"
+        return [
+            Node("plan", self._plan_node),
+            Node("profile", self._profile_node),
+            Node("draft", self._draft_node),
+            Node("rag", self._rag_node, ("plan",)),
+            Node("precheck", self._precheck_node, ("draft",)),
+            Node("strategy", self._strategy_node, ("profile", "rag")),
+            Node("risk", self._risk_node, ("profile", risk_source, "precheck")),
+            Node("review", self._review_node, ("strategy", "risk")),
+        ]
+
+    def dag(self, mode: str = "full") -> DagExecutor:
+        if mode not in self._dags:
+            self._dags[mode] = DagExecutor(self.nodes(mode))
+        return self._dags[mode]
+
+    def build(self, mode: str = "full"):
+        # 请求路径由 DAG 执行器驱动，LangGraph 仅在编译图时导入
+        try:
+            from langgraph.graph import StateGraph, START, END  # type: ignore
+        except Exception:
+            raise RuntimeError("LangGraph 未安装，请安装 langgraph 以使用图编排")
+        # 节点为异步函数，编译后的图需通过 ainvoke({"req": req}) 调用
+        graph = StateGraph(PipelineState)
+        self.dag(mode).add_to_graph(graph, START, END)
+        return graph.compile()
+
+    async def arun(self, req: UserRequest, mode: str = "full") -> Dict[str, Any]:
+        with span("pipeline", mode=mode):
+            state, trace = await self.dag(mode).run({"req": req})
+        return {
+            "final_json": state.get("final_json"),
+            "strategy_json": state.get("strategy_json"),
+            "risk_json": state.get("risk_json"),
+            "ctx_docs": state.get("ctx_docs", []),
+            "mode": mode,
+            "trace": trace.to_dict(),
+        }
+
+    async def arun_selected(
+        self, req: UserRequest, requested: Optional[str] = None, allow_degrade: bool = True
+    ) -> Dict[str, Any]:
+        mode = self.select_mode(requested, allow_degrade)
+        try:
+            return await self.arun(req, mode)
+        except ReviewRejected:
+            # 降级到 fast 后规则复核未通过（如目标不在启发式覆盖范围内），回到原模式
+            original = requested or pipeline_config.mode
+            if mode == original:
+                raise
+            return await self.arun(req, original)
+
+    async def astream(self, req: UserRequest, mode: str = "full") -> AsyncIterator[Dict[str, Any]]:
+        # 按 rag/strategy/risk/review 顺序产出阶段边界与逐 token 事件，便于前端边生成边展示
+        outputs: Dict[str, str] = {}
+        ctx_docs: List[str] = []
+        if mode == "fast":
+            out = await self.arun(req, mode)
+            outputs = {"strategy": out["strategy_json"], "risk": out["risk_json"], "review": out["final_json"]}
+        else:
+            yield {"event": "stage", "stage": "rag", "status": "start"}
+            ctx_docs = await self.vs.asearch(self._hints(req), top_k=4)
+            yield {"event": "stage", "stage": "rag", "status": "end", "docs": len(ctx_docs)}
+        if mode == "hybrid":
+            _, rec = self.heuristic_chain(req, ctx_docs)
+            outputs = {"strategy": rec.model_dump_json(), "risk": self._warnings_json(rec)}
+        profile = self._profile(req)
+        draft_json = heuristic_generate_strategy(req).model_dump_json()
+
+        def risk_prompt() -> str:
+            source = draft_json if pipeline_config.risk_on_draft else outputs["strategy"]
+            return self._risk_prompt(profile, source, self._precheck(req, draft_json))
+
+        stages = [
+            ("strategy", STRATEGY_SYSTEM, lambda: self._strategy_prompt(profile, ctx_docs)),
+            ("risk", RISK_SYSTEM, risk_prompt),
+            ("review", REVIEW_SYSTEM, lambda: self._review_prompt(outputs["strategy"], outputs["risk"])),
+        ]
+        for stage, system_prompt, make_prompt in stages:
+            yield {"event": "stage", "stage": stage, "status": "start"}
+            if stage not in outputs:
+                pieces: List[str] = []
+                async for piece in self.llm.astream_chat(system_prompt, make_prompt(), STAGE_SCHEMAS[stage], stage):
+                    pieces.append(piece)
+                    yield {"event": "token", "stage": stage, "text": piece}
+                outputs[stage] = "".join(pieces).strip()
+            yield {"event": "stage", "stage": stage, "status": "end"}
+
+        yield {
+            "event": "done",
+            "final_json": outputs["review"],
+            "strategy_json": outputs["strategy"],
+            "risk_json": outputs["risk"],
+            "mode": mode,
+        }
@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from types import ModuleType
+
+# 重量级依赖在首次使用时导入并缓存模块对象：快速模式与 CLI 不会加载，逐 token 的热路径也不再执行 import 语句
+
+
+@lru_cache(maxsize=None)
+def torch() -> ModuleType:
+    import torch as module
+
+    return module
+
+
+@lru_cache(maxsize=None)
+def faiss() -> ModuleType:
+    import faiss as module  # type: ignore
+
+    return module
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import argparse
 import json
 
 from .models.schemas import UserRequest, InsuredInfo, FinancialStatus, InsuranceGoal
-from .graph.pipeline_graph import PipelineGraph
+from .graph.pipeline_graph import PIPELINE_MODES
+from .serving.registry import registry
 import asyncio
 
 
@@ -35,12 +37,15 @@ def demo_request() -> UserRequest:
     )
 
 
-async def amain() -> None:
+async def amain(mode: str | None = None) -> None:
     req = demo_request()
-    out = await PipelineGraph().arun(req)
+    out = await registry.pipeline.arun_selected(req, mode, allow_degrade=False)
     final_json = out.get("final_json")
-    print(json.dumps({"raw": final_json}, ensure_ascii=False, indent=2))
+    print(json.dumps({"mode": out["mode"], "raw": final_json}, ensure_ascii=False, indent=2))
 
 
 if __name__ == "__main__":
-    asyncio.run(amain())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=PIPELINE_MODES, default=None, help="fast/hybrid/full，默认取 PIPELINE_MODE")
+    args = parser.parse_args()
+    asyncio.run(amain(args.mode))
\ No newline at end of file
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Optional, Literal, Dict
+from typing import List, Optional, Literal, Dict, get_args
 from pydantic import BaseModel, Field, validator
 
 
@@ -21,18 +21,20 @@ class FinancialStatus(BaseModel):
     monthly_budget_for_insurance: Optional[float] = Field(default=None, ge=0)
 
 
+GoalLiteral = Literal[
+    "income_protection",
+    "medical_expense",
+    "education_fund",
+    "wealth_legacy",
+    "critical_illness",
+    "accident",
+    "retirement",
+]
+INSURANCE_GOALS: List[str] = list(get_args(GoalLiteral))
+
+
 class InsuranceGoal(BaseModel):
-    goals: List[
-        Literal[
-            "income_protection",
-            "medical_expense",
-            "education_fund",
-            "wealth_legacy",
-            "critical_illness",
-            "accident",
-            "retirement",
-        ]
-    ]
+    goals: List[GoalLiteral]
 
 
 class ExistingPolicy(BaseModel):
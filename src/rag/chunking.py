@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import re
+from typing import List
+
+# 中英文句末标点与换行均视为句子边界，标点保留在句尾
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;\n])")
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences: List[str] = []
+    for part in _SENTENCE_END.split(text):
+        if not part:
+            continue
+        if not part.strip() and sentences:
+            # 连续换行等空白并入上一句，保留原文排版
+            sentences[-1] += part
+        else:
+            sentences.append(part)
+    return sentences
+
+
+def split_text(text: str, chunk_size: int = 500, overlap: int = 80) -> List[str]:
+    # 按句子累积到 chunk_size 个字符为一块；相邻块之间回带不超过 overlap 个字符的尾部句子
+    chunk_size = max(1, chunk_size)
+    overlap = max(0, min(overlap, chunk_size - 1))
+    pieces: List[str] = []
+    for sent in split_sentences(text):
+        if len(sent) <= chunk_size:
+            pieces.append(sent)
+            continue
+        # 超长句（如无标点的条款表格）按固定窗口硬切
+        step = chunk_size - overlap
+        pieces.extend(sent[i:i + chunk_size] for i in range(0, len(sent), step))
+
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    for piece in pieces:
+        if current and length + len(piece) > chunk_size:
+            chunks.append("".join(current).strip())
+            carry: List[str] = []
+            carry_len = 0
+            for prev in reversed(current):
+                if carry_len + len(prev) > overlap:
+                    break
+                carry.insert(0, prev)
+                carry_len += len(prev)
+            current, length = carry, carry_len
+        current.append(piece)
+        length += len(piece)
+    if current:
+        tail = "".join(current).strip()
+        if tail and (not chunks or tail not in chunks[-1]):
+            chunks.append(tail)
+    return [c for c in chunks if c]
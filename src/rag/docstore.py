@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import re
+import uuid
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+_SUFFIXES = (".bin", ".off.npy", ".src.npy", ".sources.json")
+
+
+class DocStore:
+    # 只读的分块文本存储，按 FAISS id 直接寻址：
+    #   <base>.<gen>.bin          全部分块文本的 UTF-8 拼接
+    #   <base>.<gen>.off.npy      int64 偏移表，id 为 i 的文本是 bin[off[i]:off[i+1]]（空区间表示不存在）
+    #   <base>.<gen>.src.npy      int32 来源文件下标，-1 表示该 id 已删除
+    #   <base>.<gen>.sources.json 来源文件名列表
+    #   <base>.current            当前代号 gen；不存在时为旧版不带代号的 <base>.bin 等文件
+    # 三个数据文件都以 mmap 打开，多 worker 进程共享同一份页缓存，查找 O(1) 且零拷贝。
+    # 每次写入生成新一代文件，再原子替换 .current 切换：已映射的文件从不被覆盖（Windows 上无法替换已映射的文件），
+    # 打开时看到的总是同一代的完整文件组。
+    def __init__(
+        self,
+        blob: Union[mmap.mmap, bytes],
+        offsets: np.ndarray,
+        src: np.ndarray,
+        sources: List[str],
+    ) -> None:
+        self._blob = blob
+        self._view = memoryview(blob)
+        self._off = offsets
+        self._src = src
+        self.sources = sources
+        self._count = int((src >= 0).sum())
+
+    @classmethod
+    def empty(cls) -> "DocStore":
+        return cls(b"", np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), [])
+
+    @staticmethod
+    def paths(base: str, generation: str = "") -> Tuple[str, str, str, str]:
+        prefix = f"{base}.{generation}" if generation else base
+        return prefix + ".bin", prefix + ".off.npy", prefix + ".src.npy", prefix + ".sources.json"
+
+    @staticmethod
+    def current(base: str) -> str:
+        try:
+            with open(base + ".current", "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    @classmethod
+    def exists(cls, base: str) -> bool:
+        return all(os.path.isfile(p) for p in cls.paths(base, cls.current(base)))
+
+    @classmethod
+    def open(cls, base: str) -> Optional["DocStore"]:
+        generation = cls.current(base)
+        store = cls._open(base, generation)
+        if store is None and cls.current(base) != generation:
+            # 读到旧代号后写入方已切换并清理了旧文件：按新代号重试一次
+            store = cls._open(base, cls.current(base))
+        return store
+
+    @classmethod
+    def _open(cls, base: str, generation: str) -> Optional["DocStore"]:
+        bin_path, off_path, src_path, sources_path = cls.paths(base, generation)
+        if not all(os.path.isfile(p) for p in (bin_path, off_path, src_path, sources_path)):
+            return None
+        try:
+            with open(sources_path, "r", encoding="utf-8") as f:
+                sources = json.load(f)
+            offsets = np.load(off_path, mmap_mode="r")
+            src = np.load(src_path, mmap_mode="r")
+            if os.path.getsize(bin_path) == 0:
+                blob: Union[mmap.mmap, bytes] = b""
+            else:
+                with open(bin_path, "rb") as f:
+                    blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            return None
+        if offsets.shape[0] != src.shape[0] + 1 or int(offsets[-1]) > len(blob):
+            # 各文件不是同一次写入的产物（写入中断等），视为不可用
+            return None
+        return cls(blob, offsets, src, sources)
+
+    @classmethod
+    def write(cls, base: str, entries: Iterable[Tuple[int, str, Union[str, bytes, memoryview]]], n_slots: int) -> None:
+        # entries 需按 id 升序；未出现的 id 写为空区间。写入全新的一代文件，完成后才切换 .current
+        generation = uuid.uuid4().hex[:12]
+        bin_path, off_path, src_path, sources_path = cls.paths(base, generation)
+        offsets = np.zeros(n_slots + 1, dtype=np.int64)
+        src = np.full(n_slots, -1, dtype=np.int32)
+        sources: List[str] = []
+        source_index = {}
+        pos = 0
+        last = -1
+        with open(bin_path, "wb") as f:
+            for doc_id, source, text in entries:
+                if doc_id <= last or doc_id >= n_slots:
+                    raise ValueError(f"文档 id 必须升序且小于 {n_slots}: {doc_id}")
+                offsets[last + 1:doc_id + 1] = pos
+                data = text.encode("utf-8") if isinstance(text, str) else text
+                f.write(data)
+                pos += len(data)
+                if source not in source_index:
+                    source_index[source] = len(sources)
+                    sources.append(source)
+                src[doc_id] = source_index[source]
+                last = doc_id
+        offsets[last + 1:] = pos
+        np.save(off_path, offsets)
+        np.save(src_path, src)
+        with open(sources_path, "w", encoding="utf-8") as f:
+            json.dump(sources, f, ensure_ascii=False)
+        # 单次原子替换切换到新一代；.current 本身不被映射，任何平台上都可替换
+        with open(base + ".current.tmp", "w", encoding="utf-8") as f:
+            f.write(generation)
+        os.replace(base + ".current.tmp", base + ".current")
+        cls._remove_stale(base, generation)
+
+    @staticmethod
+    def _remove_stale(base: str, keep: str) -> None:
+        # 删除其他代（含旧版不带代号的文件）。POSIX 上已映射的进程继续读旧 inode；
+        # Windows 上仍被映射的文件删除失败，留待下次写入时再清理
+        directory, name = os.path.split(os.path.abspath(base))
+        pattern = re.compile(re.escape(name) + r"(?:\.([0-9a-f]{12}))?(?:" + "|".join(map(re.escape, _SUFFIXES)) + r")$")
+        for entry in os.listdir(directory):
+            m = pattern.match(entry)
+            if m is None or m.group(1) == keep:
+                continue
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                pass
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def slots(self) -> int:
+        # 写入时的 id 空间大小（= 当时 manifest 的 next_id），含已删除的空位
+        return int(self._src.shape[0])
+
+    def __contains__(self, doc_id: int) -> bool:
+        return 0 <= doc_id < self._src.shape[0] and self._src[doc_id] >= 0
+
+    def get_bytes(self, doc_id: int) -> Optional[memoryview]:
+        if doc_id not in self:
+            return None
+        return self._view[int(self._off[doc_id]):int(self._off[doc_id + 1])]
+
+    def source(self, doc_id: int) -> Optional[str]:
+        return self.sources[int(self._src[doc_id])] if doc_id in self else None
+
+    def text(self, doc_id: int) -> Optional[str]:
+        data = self.get_bytes(doc_id)
+        return None if data is None else str(data, "utf-8")
+
+    def get(self, doc_id: int) -> Optional[Tuple[str, str]]:
+        text = self.text(doc_id)
+        return None if text is None else (self.sources[int(self._src[doc_id])], text)
+
+    def ids(self) -> Iterator[int]:
+        return (int(i) for i in np.flatnonzero(np.asarray(self._src) >= 0))
+
+    def iter_raw(self) -> Iterator[Tuple[int, str, memoryview]]:
+        for doc_id in self.ids():
+            yield doc_id, self.sources[int(self._src[doc_id])], self._view[int(self._off[doc_id]):int(self._off[doc_id + 1])]
+
+    def close(self) -> None:
+        try:
+            self._view.release()
+            if isinstance(self._blob, mmap.mmap):
+                self._blob.close()
+        except BufferError:
+            # 仍有调用方持有零拷贝切片，交给 GC 回收映射
+            pass
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    # 归一化查询向量缓存，键为 (模型名, 文本)：
+    # 内存 LRU 为第一层；磁盘层为按模型名分文件的 .npy（mmap 只读）+ 文本到行号的 keys.json，
+    # 新向量攒够 flush_every 条或显式 flush() 时整体重写并原子替换。
+    def __init__(self, model_name: str, cache_dir: Optional[str], capacity: int = 4096, flush_every: int = 64) -> None:
+        self.model_name = model_name
+        self.capacity = max(1, capacity)
+        self.flush_every = max(1, flush_every)
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, np.ndarray] = {}
+        self._disk_keys: Dict[str, int] = {}
+        self._disk: Optional[np.ndarray] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._base: Optional[str] = None
+        if cache_dir:
+            slug = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:16]
+            self._base = os.path.join(cache_dir, f"query_emb_{slug}")
+            self._load()
+
+    def _load(self) -> None:
+        assert self._base is not None
+        vec_path, key_path = self._base + ".npy", self._base + ".keys.json"
+        if not (os.path.isfile(vec_path) and os.path.isfile(key_path)):
+            return
+        try:
+            with open(key_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            disk = np.load(vec_path, mmap_mode="r")
+        except Exception:
+            # 缓存文件损坏时直接忽略，后续 flush 会重写
+            return
+        if meta.get("model") != self.model_name or len(meta.get("keys", [])) != disk.shape[0]:
+            return
+        self._disk = disk
+        self._disk_keys = {k: i for i, k in enumerate(meta["keys"])}
+
+    def _lookup(self, text: str) -> Optional[np.ndarray]:
+        vec = self._lru.get(text)
+        if vec is not None:
+            self._lru.move_to_end(text)
+            self.hits += 1
+            return vec
+        vec = self._pending.get(text)
+        if vec is None and self._disk is not None and text in self._disk_keys:
+            # 拷贝出映射：LRU 中的向量不引用 mmap，flush 时旧映射可以立即释放
+            vec = np.array(self._disk[self._disk_keys[text]], dtype=np.float32)
+        if vec is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.disk_hits += 1
+        self._remember(text, vec)
+        return vec
+
+    def _remember(self, text: str, vec: np.ndarray) -> None:
+        self._lru[text] = vec
+        self._lru.move_to_end(text)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        found: Dict[int, np.ndarray] = {}
+        missing: List[int] = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                vec = self._lookup(text)
+                if vec is None:
+                    missing.append(i)
+                else:
+                    found[i] = vec
+        return found, missing
+
+    def put_many(self, texts: List[str], vecs: np.ndarray) -> None:
+        with self._lock:
+            for text, vec in zip(texts, vecs):
+                vec = np.asarray(vec, dtype=np.float32)
+                self._remember(text, vec)
+                if self._base is not None and text not in self._disk_keys:
+                    self._pending[text] = vec
+            should_flush = len(self._pending) >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._base is None:
+            return
+        with self._lock:
+            if not self._pending:
+                return
+            keys = sorted(self._disk_keys, key=self._disk_keys.__getitem__) + list(self._pending)
+            rows = [self._disk] if self._disk is not None and len(self._disk_keys) else []
+            rows.append(np.stack(list(self._pending.values())).astype(np.float32))
+            merged = np.concatenate(rows, axis=0)
+            os.makedirs(os.path.dirname(self._base), exist_ok=True)
+            # 临时文件带 pid，多个进程同时 flush 时互不覆盖对方的临时文件
+            tmp_vec, tmp_key = f"{self._base}.{os.getpid()}.tmp.npy", f"{self._base}.keys.json.{os.getpid()}.tmp"
+            np.save(tmp_vec, merged)
+            with open(tmp_key, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "keys": keys}, f, ensure_ascii=False)
+            # 先解除旧 .npy 的映射再替换（Windows 上无法替换仍被映射的文件）；持锁期间没有读取方
+            rows.clear()
+            self._disk = None
+            os.replace(tmp_vec, self._base + ".npy")
+            os.replace(tmp_key, self._base + ".keys.json")
+            self._disk = np.load(self._base + ".npy", mmap_mode="r")
+            self._disk_keys = {k: i for i, k in enumerate(keys)}
+            self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._lru),
+            "disk_entries": len(self._disk_keys),
+            "pending": len(self._pending),
+        }
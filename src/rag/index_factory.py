@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import numpy as np
+
+from ..config import rag_config
+from ..lazy import faiss as _faiss
+
+if TYPE_CHECKING:
+    import faiss  # type: ignore
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# faiss 建议每个聚类中心至少约 39 个训练样本；PQ 码本每个子空间需要 2^nbits 个样本
+_MIN_POINTS_PER_CENTROID = 39
+
+
+@dataclass
+class IndexParams:
+    index_type: str = "flat"
+    nlist: int = 0
+    nprobe: int = 8
+    pq_m: int = 16
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+
+    @classmethod
+    def from_config(cls) -> "IndexParams":
+        return cls(
+            index_type=rag_config.index_type,
+            nlist=rag_config.ivf_nlist,
+            nprobe=rag_config.ivf_nprobe,
+            pq_m=rag_config.pq_m,
+            pq_nbits=rag_config.pq_nbits,
+            hnsw_m=rag_config.hnsw_m,
+            ef_construction=rag_config.hnsw_ef_construction,
+            ef_search=rag_config.hnsw_ef_search,
+        )
+
+    def resolve_nlist(self, n: int) -> int:
+        if self.nlist > 0:
+            return self.nlist
+        return max(1, min(int(4 * math.sqrt(max(n, 1))), n // _MIN_POINTS_PER_CENTROID))
+
+    def trainable(self, n: int) -> bool:
+        # 语料太小不足以训练 IVF/PQ 时退回 Flat
+        if self.index_type == "ivf_flat":
+            return n >= _MIN_POINTS_PER_CENTROID
+        if self.index_type == "ivf_pq":
+            return n >= max(_MIN_POINTS_PER_CENTROID, 2 ** self.pq_nbits)
+        return True
+
+
+def make_index(dim: int, n_train: int, params: IndexParams) -> Tuple[faiss.Index, str]:
+    # 返回未包装 id 的内层索引及实际使用的类型；向量均已归一化，统一用内积度量
+    faiss = _faiss()
+
+    if params.index_type not in INDEX_TYPES:
+        raise ValueError(f"未知的索引类型: {params.index_type}，可选 {INDEX_TYPES}")
+    kind = params.index_type if params.trainable(n_train) else "flat"
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim), kind
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params.ef_construction
+        return index, kind
+    quantizer = faiss.IndexFlatIP(dim)
+    nlist = params.resolve_nlist(n_train)
+    if kind == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT), kind
+    if dim % params.pq_m != 0:
+        raise ValueError(f"PQ 子空间数 {params.pq_m} 需整除向量维度 {dim}")
+    return faiss.IndexIVFPQ(quantizer, dim, nlist, params.pq_m, params.pq_nbits, faiss.METRIC_INNER_PRODUCT), kind
+
+
+def build_index(vectors: np.ndarray, ids: Optional[np.ndarray], params: IndexParams) -> Tuple[faiss.Index, str]:
+    faiss = _faiss()
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    inner, kind = make_index(vectors.shape[1], vectors.shape[0], params)
+    if not inner.is_trained:
+        inner.train(vectors)
+    index = faiss.IndexIDMap(inner)
+    if ids is None:
+        ids = np.arange(vectors.shape[0], dtype=np.int64)
+    if len(vectors):
+        index.add_with_ids(vectors, ids.astype(np.int64))
+    apply_search_params(index, params)
+    return index, kind
+
+
+def inner_index(index: faiss.Index) -> faiss.Index:
+    faiss = _faiss()
+
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+def index_kind(index: faiss.Index) -> str:
+    # 实际的索引类型（与 INDEX_TYPES 对应），不依赖 manifest 中的记录
+    faiss = _faiss()
+
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def max_id(index: faiss.Index) -> int:
+    # IndexIDMap 中最大的外部 id，空索引为 -1
+    faiss = _faiss()
+
+    ids = faiss.vector_to_array(index.id_map)
+    return int(ids.max()) if ids.size else -1
+
+
+def apply_search_params(index: faiss.Index, params: IndexParams) -> None:
+    faiss = _faiss()
+
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = max(1, min(params.nprobe, inner.nlist))
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = params.ef_search
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    faiss = _faiss()
+
+    return not isinstance(inner_index(index), faiss.IndexHNSW)
+
+
+def rebuild_from(index: faiss.Index, params: IndexParams, removed: Optional[np.ndarray] = None) -> Tuple[faiss.Index, str]:
+    # 从 Flat/HNSW 索引取回原始向量（可选剔除 removed 中的 id），按 params 重建，无需重新嵌入
+    faiss = _faiss()
+
+    inner = inner_index(index)
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    vectors = inner.reconstruct_n(0, inner.ntotal) if inner.ntotal else np.zeros((0, inner.d), dtype=np.float32)
+    if removed is not None:
+        keep = ~np.isin(ids, removed)
+        ids, vectors = ids[keep], vectors[keep]
+    return build_index(vectors, ids, params)
+
+
+def rebuild_without(index: faiss.Index, removed: np.ndarray, params: IndexParams) -> faiss.Index:
+    # HNSW 不支持删除：剔除被删 id 后重建图
+    rebuilt, _ = rebuild_from(index, IndexParams(**{**params.__dict__, "index_type": "hnsw"}), removed)
+    return rebuilt
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    faiss = _faiss()
+
+    return int(faiss.serialize_index(index).nbytes)
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import argparse
+import json
+
+from ..config import rag_config
+from .vectorstore import VectorStore
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="增量构建/更新知识库向量索引")
+    parser.add_argument("--dir", default=rag_config.knowledge_dir, help="知识库目录（默认 KNOWLEDGE_DIR）")
+    parser.add_argument("--full", action="store_true", help="忽略 manifest，全量重建")
+    args = parser.parse_args()
+
+    vs = VectorStore(autoload=False)
+    vs.load()
+    summary = vs.sync_dir(args.dir, full=args.full)
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import jieba  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    jieba = None  # type: ignore
+
+_TOKEN_RUN = re.compile(r"[㐀-鿿]+|[a-z0-9]+(?:\.[0-9]+)?")
+_CJK = re.compile(r"[㐀-鿿]")
+
+
+def tokenize(text: str, mode: str = "bigram") -> List[str]:
+    # 中文按字二元组切分（"等待期" -> 等待/待期），英文数字按词；jieba 可用时可切换为搜索引擎模式分词
+    text = text.lower()
+    if mode == "jieba" and jieba is not None:
+        return [t for t in jieba.lcut_for_search(text) if t.strip() and _TOKEN_RUN.fullmatch(t)]
+    tokens: List[str] = []
+    for run in _TOKEN_RUN.findall(text):
+        if _CJK.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    # 倒排索引 + 预计算的 BM25 权重：建库时即算好每个 (词, 文档) 的得分贡献，查询只需累加
+    def __init__(self, tokenizer: str = "bigram", k1: float = 1.5, b: float = 0.75) -> None:
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+        self.n_docs = 0
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def build(self, docs: Iterable[Tuple[int, str]]) -> "BM25Index":
+        tfs: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths: Dict[int, int] = {}
+        for doc_id, text in docs:
+            counts = Counter(tokenize(text, self.tokenizer))
+            lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                tfs[term].append((doc_id, tf))
+        self.n_docs = len(lengths)
+        avgdl = (sum(lengths.values()) / self.n_docs) if self.n_docs else 1.0
+        self._postings = {}
+        for term, rows in tfs.items():
+            ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+            tf = np.fromiter((r[1] for r in rows), dtype=np.float32, count=len(rows))
+            dl = np.fromiter((lengths[r[0]] for r in rows), dtype=np.float32, count=len(rows))
+            idf = math.log(1 + (self.n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * dl / max(avgdl, 1e-9))
+            self._postings[term] = (ids, (idf * tf * (self.k1 + 1) / norm).astype(np.float32))
+        return self
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        terms = [t for t in set(tokenize(query, self.tokenizer)) if t in self._postings]
+        if not terms or top_k <= 0:
+            return []
+        ids = np.concatenate([self._postings[t][0] for t in terms])
+        weights = np.concatenate([self._postings[t][1] for t in terms])
+        uniq, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if len(uniq) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(uniq))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(uniq[i]), float(scores[i])) for i in top]
+
+    def save(self, path: str) -> None:
+        terms = list(self._postings)
+        sizes = np.array([len(self._postings[t][0]) for t in terms], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        ids = np.concatenate([self._postings[t][0] for t in terms]) if terms else np.zeros(0, np.int64)
+        weights = np.concatenate([self._postings[t][1] for t in terms]) if terms else np.zeros(0, np.float32)
+        meta = {"tokenizer": self.tokenizer, "k1": self.k1, "b": self.b, "n_docs": self.n_docs, "terms": terms}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, offsets=offsets, ids=ids, weights=weights, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, tokenizer: str) -> Optional["BM25Index"]:
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data["meta"]))
+                offsets, ids, weights = data["offsets"], data["ids"], data["weights"]
+        except Exception:
+            return None
+        if meta.get("tokenizer") != tokenizer:
+            return None
+        index = cls(tokenizer, meta["k1"], meta["b"])
+        index.n_docs = meta["n_docs"]
+        index._postings = {
+            term: (ids[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]])
+            for i, term in enumerate(meta["terms"])
+        }
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    # RRF：score(d) = Σ 1 / (k + rank)，rank 从 1 开始；对各路得分尺度不敏感
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
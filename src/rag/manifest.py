@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+KB_SUFFIXES = (".md", ".txt")
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def scan_dir(dir_path: str) -> Dict[str, str]:
+    # 返回 {相对路径: 绝对路径}，递归收集 .md/.txt
+    files: Dict[str, str] = {}
+    if not os.path.isdir(dir_path):
+        return files
+    for root, _, names in os.walk(dir_path):
+        for name in names:
+            if name.endswith(KB_SUFFIXES):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, dir_path).replace(os.sep, "/")] = path
+    return files
+
+
+@dataclass
+class FileEntry:
+    sha256: str
+    mtime: float
+    size: int
+    chunks: List[Dict[str, Any]] = field(default_factory=list)  # [{"id": int, "sha1": str}]
+
+    @property
+    def chunk_ids(self) -> List[int]:
+        return [c["id"] for c in self.chunks]
+
+
+@dataclass
+class Manifest:
+    embedding_model: str
+    chunk_size: int
+    chunk_overlap: int
+    index_type: str = "flat"
+    next_id: int = 0
+    files: Dict[str, FileEntry] = field(default_factory=dict)
+
+    def compatible(self, embedding_model: str, chunk_size: int, chunk_overlap: int, index_type: str) -> bool:
+        # 模型、分块参数或索引类型变化后旧索引不可复用，需全量重建。
+        # index_type 记录实际构建的类型：语料不足时退回的 flat 仍兼容，语料增长后由 sync_dir 原地升级
+        return (self.embedding_model, self.chunk_size, self.chunk_overlap) == (
+            embedding_model,
+            chunk_size,
+            chunk_overlap,
+        ) and self.index_type in (index_type, "flat")
+
+    def allocate_id(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest | None":
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            files = {name: FileEntry(**entry) for name, entry in raw.pop("files", {}).items()}
+            return cls(files=files, **raw)
+        except Exception:
+            return None
+
+    def save(self, path: str) -> None:
+        data = {
+            "embedding_model": self.embedding_model,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "index_type": self.index_type,
+            "next_id": self.next_id,
+            "files": {name: e.__dict__ for name, e in sorted(self.files.items())},
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
@@ -1,77 +1,322 @@
 from __future__ import annotations
 
 import os
-from typing import List, Tuple
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import faiss  # type: ignore
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
 from ..config import rag_config
+from ..lazy import faiss as _faiss
+from ..tracing import span
+from .chunking import split_text
+from .docstore import DocStore
+from .embed_cache import EmbeddingCache
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .index_factory import (
+    IndexParams,
+    apply_search_params,
+    build_index,
+    index_kind,
+    inner_index,
+    max_id,
+    rebuild_from,
+    rebuild_without,
+    supports_remove,
+)
+from .manifest import FileEntry, Manifest, scan_dir, sha256_file, text_digest
 import asyncio
 
+if TYPE_CHECKING:
+    import faiss  # type: ignore
+
+
+def _mmap_flags(faiss: Any) -> int:
+    # IO_FLAG_MMAP 映射 IVF 倒排表，IO_FLAG_MMAP_IFC（faiss>=1.8）映射 Flat/HNSW 的向量存储；旧版本没有的标志跳过
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+    return flags | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
 
 class VectorStore:
-    def __init__(self) -> None:
-        self.embedder = SentenceTransformer(rag_config.embedding_model)
-        self.index: faiss.IndexFlatIP | None = None
-        self.docs: List[Tuple[str, str]] = []  # (doc_id, text)
-        self._load_index()
+    def __init__(self, autoload: bool = True, embedder: Any = None, readonly: bool = False) -> None:
+        if embedder is None:
+            # sentence_transformers 导入即初始化 torch，放到构造时
+            from sentence_transformers import SentenceTransformer
+
+            embedder = SentenceTransformer(rag_config.embedding_model)
+        # 需提供 encode(texts, normalize_embeddings=..., batch_size=...) 与 get_sentence_embedding_dimension()
+        self.embedder = embedder
+        # 只读：索引以 mmap 打开，多个进程共享同一份页缓存；不构建、不增量更新
+        self.readonly = readonly
+        self.index: faiss.IndexIDMap | None = None  # IndexIDMap 包装 Flat/IVF/HNSW，见 RAG_INDEX_TYPE
+        self.index_params = IndexParams.from_config()
+        self.docs = DocStore.empty()  # faiss id -> (source, chunk text)，mmap 只读
+        self.manifest: Optional[Manifest] = None
+        self.lexical: Optional[BM25Index] = None  # 分块级 BM25 倒排索引，与向量检索做 RRF 融合
+        # 只读实例（多进程部署的 API worker）只用内存层：磁盘层由推理进程独占写入，避免多个进程互相覆盖
+        self.query_cache = EmbeddingCache(
+            rag_config.embedding_model,
+            None if readonly else rag_config.embed_cache_dir,
+            rag_config.embed_cache_size,
+            rag_config.embed_cache_flush_every,
+        )
+        if autoload:
+            self._load_index()
+
+    @property
+    def _docs_base(self) -> str:
+        return rag_config.index_path + ".docs"
+
+    @property
+    def _manifest_path(self) -> str:
+        return rag_config.index_path + ".manifest.json"
+
+    @property
+    def _lexical_path(self) -> str:
+        return rag_config.index_path + ".bm25.npz"
+
+    def load(self) -> bool:
+        faiss = _faiss()
+
+        if not (os.path.isfile(rag_config.index_path) and os.path.isfile(self._manifest_path)):
+            return False
+        manifest = Manifest.load(self._manifest_path)
+        docs = DocStore.open(self._docs_base)
+        if manifest is None or docs is None:
+            return False
+        self.index = faiss.read_index(rag_config.index_path, _mmap_flags(faiss) if self.readonly else 0)
+        # 文档库与索引先于 manifest 落盘：上次更新在两者之间中断时 manifest 的 next_id 落后于已写入的 id，
+        # 取三者最大值，避免再次分配同一 id 导致 IndexIDMap 中出现重复 id
+        manifest.next_id = max(manifest.next_id, docs.slots, max_id(self.index) + 1)
+        # nprobe / efSearch 属于查询参数，调整后无需重建
+        apply_search_params(self.index, self.index_params)
+        self.docs = docs
+        self.manifest = manifest
+        self.lexical = BM25Index.load(self._lexical_path, rag_config.lexical_tokenizer)
+        if self.lexical is None or len(self.lexical) != len(self.docs):
+            self._rebuild_lexical()
+        return True
+
+    def _rebuild_lexical(self) -> None:
+        # 来源文件名一并入索引，"重疾险.md" 这类文件名本身就是强词项信号
+        self.lexical = BM25Index(rag_config.lexical_tokenizer).build(
+            (doc_id, f"{source}\n{str(data, 'utf-8')}") for doc_id, source, data in self.docs.iter_raw()
+        )
+        self.lexical.save(self._lexical_path)
 
     def _load_index(self) -> None:
-        if os.path.isfile(rag_config.index_path) and os.path.isfile(rag_config.index_path + ".meta"):
-            self.index = faiss.read_index(rag_config.index_path)
-            with open(rag_config.index_path + ".meta", "r", encoding="utf-8") as f:
-                for line in f:
-                    doc_id, text = line.rstrip("\n").split("\t", 1)
-                    self.docs.append((doc_id, text))
-        else:
+        if not self.load():
+            if self.readonly:
+                raise RuntimeError(f"索引不存在或不完整: {rag_config.index_path}（只读模式不构建，需先由推理进程或建库命令生成）")
             self.build_from_dir(rag_config.knowledge_dir)
 
-    def build_from_dir(self, dir_path: str) -> None:
-        contents: List[Tuple[str, str]] = []
-        if os.path.isdir(dir_path):
-            for name in os.listdir(dir_path):
-                if name.endswith(".md") or name.endswith(".txt"):
-                    p = os.path.join(dir_path, name)
-                    with open(p, "r", encoding="utf-8") as f:
-                        text = f.read()
-                        contents.append((name, text))
-        if not contents:
-            # seed with an empty index to avoid crash
-            self.index = faiss.IndexFlatIP(384)
-            self.docs = []
-            return
-        embeddings = self.embedder.encode([c[1] for c in contents], normalize_embeddings=True)
-        dim = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dim)
-        self.index.add(embeddings.astype(np.float32))
-        self.docs = contents
-        faiss.write_index(self.index, rag_config.index_path)
-        with open(rag_config.index_path + ".meta", "w", encoding="utf-8") as f:
-            for doc_id, text in self.docs:
-                f.write(f"{doc_id}\t{text}\n")
+    def build_from_dir(self, dir_path: str) -> Dict[str, Any]:
+        return self.sync_dir(dir_path, full=True)
+
+    def sync_dir(self, dir_path: str, full: bool = False) -> Dict[str, Any]:
+        # 基于 manifest（文件哈希 + mtime）增量索引：只嵌入新增/变化的分块，删除已移除文件的分块
+        if self.readonly:
+            raise RuntimeError("只读索引不支持更新，请在推理进程或建库命令中执行")
+        started = time.perf_counter()
+        size, overlap = rag_config.chunk_size, rag_config.chunk_overlap
+        manifest = None if full else self.manifest
+        params = self.index_params
+        if manifest is None or self.index is None or not manifest.compatible(
+            rag_config.embedding_model, size, overlap, params.index_type
+        ):
+            manifest = Manifest(rag_config.embedding_model, size, overlap, params.index_type)
+            # 全量重建：索引在拿到全部向量后再创建，IVF/PQ 需要用这些向量训练
+            self.index = None
+            self.docs = DocStore.empty()
+
+        files = scan_dir(dir_path)
+        removed_ids: List[int] = []
+        if manifest is self.manifest:
+            # 上次更新在 manifest 落盘前中断时遗留的分块：已写入文档库与索引但不属于任何文件，随本次更新删除
+            known = {i for entry in manifest.files.values() for i in entry.chunk_ids}
+            removed_ids.extend(i for i in self.docs.ids() if i not in known)
+        new_chunks: List[Tuple[int, str, str]] = []
+        files_changed = files_removed = 0
+        for name in [n for n in manifest.files if n not in files]:
+            removed_ids.extend(manifest.files.pop(name).chunk_ids)
+            files_removed += 1
+        for name, path in sorted(files.items()):
+            st = os.stat(path)
+            entry = manifest.files.get(name)
+            if entry is not None and entry.mtime == st.st_mtime and entry.size == st.st_size:
+                continue
+            digest = sha256_file(path)
+            if entry is not None and entry.sha256 == digest:
+                entry.mtime, entry.size = st.st_mtime, st.st_size
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            # 文件内容变化时，未改动的分块沿用原 id 与向量
+            reusable: Dict[str, List[int]] = {}
+            for chunk in entry.chunks if entry is not None else []:
+                reusable.setdefault(chunk["sha1"], []).append(chunk["id"])
+            chunks: List[Dict[str, Any]] = []
+            for chunk_text in split_text(text, size, overlap):
+                h = text_digest(chunk_text)
+                if reusable.get(h):
+                    chunk_id = reusable[h].pop()
+                else:
+                    chunk_id = manifest.allocate_id()
+                    new_chunks.append((chunk_id, name, chunk_text))
+                chunks.append({"id": chunk_id, "sha1": h})
+            removed_ids.extend(i for ids in reusable.values() for i in ids)
+            manifest.files[name] = FileEntry(digest, st.st_mtime, st.st_size, chunks)
+            files_changed += 1
+
+        dim = self.embedder.get_sentence_embedding_dimension()
+        embeddings = np.zeros((0, dim), dtype=np.float32)
+        new_ids = np.array([c[0] for c in new_chunks], dtype=np.int64)
+        if new_chunks:
+            embeddings = self.embedder.encode(
+                [c[2] for c in new_chunks],
+                batch_size=rag_config.embed_batch_size,
+                normalize_embeddings=True,
+            ).astype(np.float32)
+        if self.index is None:
+            # IndexIDMap 让每个分块拥有稳定 id，增量更新时可按 id 删除与追加
+            self.index, _ = build_index(embeddings, new_ids, params)
+        else:
+            if removed_ids:
+                removed = np.array(removed_ids, dtype=np.int64)
+                if supports_remove(self.index):
+                    self.index.remove_ids(removed)
+                else:
+                    self.index = rebuild_without(self.index, removed, params)
+            if new_chunks:
+                # IVF 沿用全量构建时训练的聚类中心；语料分布大幅变化后建议 --full 重新训练
+                self.index.add_with_ids(embeddings, new_ids)
+            if index_kind(self.index) == "flat" and params.index_type != "flat" and params.trainable(self.index.ntotal):
+                # 建库时语料不足以训练而退回了 flat：语料增长到可训练后按配置类型重建（取回向量，无需重新嵌入）
+                self.index, _ = rebuild_from(self.index, params)
+        # 记录实际构建的类型，而不是配置值
+        manifest.index_type = index_kind(self.index)
+        if removed_ids or new_chunks or files_removed or self.manifest is not manifest:
+            self._rewrite_docs(set(removed_ids), new_chunks, manifest.next_id)
+            self.lexical = None
+        self.manifest = manifest
+        self._save()
+        if self.lexical is None:
+            self._rebuild_lexical()
+        return {
+            "files": len(files),
+            "files_changed": files_changed,
+            "files_removed": files_removed,
+            "chunks_embedded": len(new_chunks),
+            "chunks_removed": len(removed_ids),
+            "chunks_total": len(self.docs),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def _rewrite_docs(self, removed: set, new_chunks: List[Tuple[int, str, str]], n_slots: int) -> None:
+        # 顺序流式重写：旧分块直接拷贝 mmap 中的字节，新分块 id 总是大于已有 id，整体保持升序
+        def entries():
+            for doc_id, source, data in self.docs.iter_raw():
+                if doc_id not in removed:
+                    yield doc_id, source, data
+            yield from new_chunks
+
+        # 新一代写入独立文件后切换，当前映射的旧文件不被覆盖
+        DocStore.write(self._docs_base, entries(), n_slots)
+        # 旧映射不主动关闭：并发检索线程可能仍在读取，随引用释放自动解除映射（Windows 上旧文件随后一次写入清理）
+        self.docs = DocStore.open(self._docs_base) or DocStore.empty()
+
+    def _save(self) -> None:
+        faiss = _faiss()
+
+        assert self.index is not None and self.manifest is not None
+        faiss.write_index(self.index, rag_config.index_path + ".tmp")
+        os.replace(rag_config.index_path + ".tmp", rag_config.index_path)
+        # manifest 最后落盘：中途失败时下次仍会重新处理这些文件；已写入的新 id 由 load 推进 next_id 跳过，
+        # 遗留分块由下次 sync_dir 清理
+        self.manifest.save(self._manifest_path)
 
     def search(self, queries: List[str], top_k: int | None = None) -> List[str]:
         if self.index is None or not self.docs or not queries:
             return []
         top_k = top_k or rag_config.top_k
-        q_emb = self.embedder.encode(queries, normalize_embeddings=True).astype(np.float32)
-        sims, idxs = self.index.search(q_emb, top_k)
-        seen = set()
-        results: List[str] = []
-        for row in idxs:
-            for i in row:
-                if i < 0 or i >= len(self.docs):
-                    continue
-                if i in seen:
-                    continue
-                seen.add(i)
-                results.append(self.docs[i][1])
+        mode = rag_config.retrieval_mode
+        with span("rag.search", queries=len(queries), top_k=top_k, mode=mode) as sp:
+            if mode == "lexical" and self.lexical is not None:
+                with span("rag.bm25"):
+                    rows = [[i for i, _ in self.lexical.search(q, top_k)] for q in queries]
+            elif mode == "hybrid" and self.lexical is not None:
+                rows = self._hybrid_rows(queries, top_k)
+            else:
+                vecs = self.encode_queries(queries)
+                with span("rag.faiss"):
+                    _, idxs = self.index.search(vecs, top_k)
+                rows = [[int(i) for i in row if i >= 0] for row in idxs]
+            seen = set()
+            results: List[str] = []
+            for row in rows:
+                for i in row:
+                    if i in seen:
+                        continue
+                    text = self.docs.text(int(i))
+                    if text is None:
+                        continue
+                    seen.add(i)
+                    results.append(text)
+            sp.set(hits=len(results))
         return results
 
-    async def abuild_from_dir(self, dir_path: str) -> None:
-        await asyncio.to_thread(self.build_from_dir, dir_path)
+    def _hybrid_rows(self, queries: List[str], top_k: int) -> List[List[int]]:
+        # 每个查询各取两路候选，按 RRF 融合后截取 top_k；条款编号、金额等精确词项由 BM25 兜底
+        assert self.index is not None and self.lexical is not None
+        depth = max(top_k, rag_config.hybrid_candidates)
+        vecs = self.encode_queries(queries)
+        with span("rag.faiss"):
+            _, idxs = self.index.search(vecs, depth)
+        with span("rag.bm25"):
+            lexical_rows = [[i for i, _ in self.lexical.search(q, depth)] for q in queries]
+        rows: List[List[int]] = []
+        for dense, lexical in zip(idxs, lexical_rows):
+            fused = reciprocal_rank_fusion([[int(i) for i in dense if i >= 0], lexical], rag_config.rrf_k)
+            rows.append([i for i, _ in fused[:top_k]])
+        return rows
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        # 检索词高度重复（目标枚举 + 常用术语），绝大多数查询向量直接命中缓存
+        found, missing = self.query_cache.get_many(queries)
+        if missing:
+            texts = [queries[i] for i in missing]
+            with span("rag.embed", misses=len(missing)):
+                fresh = self.embedder.encode(texts, normalize_embeddings=True).astype(np.float32)
+            self.query_cache.put_many(texts, fresh)
+            for i, vec in zip(missing, fresh):
+                found[i] = vec
+        return np.stack([found[i] for i in range(len(queries))]).astype(np.float32)
+
+    def prewarm(self, texts: List[str]) -> None:
+        self.encode_queries(list(dict.fromkeys(texts)))
+        self.query_cache.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "docs": len(self.docs),
+            "index": type(inner_index(self.index)).__name__ if self.index is not None else None,
+            "retrieval_mode": rag_config.retrieval_mode,
+            "query_cache": self.query_cache.stats(),
+        }
+
+    def close(self) -> None:
+        self.query_cache.flush()
+        self.docs.close()
+
+    def warmup(self) -> None:
+        self.embedder.encode(["保险"], normalize_embeddings=True)
+        self.search(["保险"], top_k=1)
+
+    async def abuild_from_dir(self, dir_path: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.build_from_dir, dir_path)
+
+    async def async_dir(self, dir_path: str, full: bool = False) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.sync_dir, dir_path, full)
 
     async def asearch(self, queries: List[str], top_k: int | None = None) -> List[str]:
         return await asyncio.to_thread(self.search, queries, top_k) 
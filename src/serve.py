@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import subprocess
+import sys
+from typing import Dict
+
+from .config import serving_config
+from .serving.ipc import DEFAULT_SOCKET, wait_for_socket
+
+
+# 多进程部署：一个推理进程独占模型与生成批处理，N 个 uvicorn worker 只处理 HTTP、数据库与检索，
+# 经 Unix socket 调用推理进程；FAISS 索引与文档库在各 worker 中只读 mmap，内存不随 worker 数翻倍。
+def main() -> None:
+    parser = argparse.ArgumentParser(description="启动推理进程与多个 API worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="uvicorn worker 数，默认 CPU 核数")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=serving_config.inference_socket or DEFAULT_SOCKET, help="推理进程 Unix socket 路径")
+    parser.add_argument("--no-warmup", action="store_true", help="推理进程跳过启动预热")
+    args = parser.parse_args()
+
+    cmd = [sys.executable, "-m", "src.serving.ipc", "--socket", args.socket]
+    if args.no_warmup:
+        cmd.append("--no-warmup")
+    # 推理进程先启动：加载模型、按需构建索引并预热，socket 可连接后再起 API worker，避免各 worker 抢建索引
+    inference = subprocess.Popen(cmd)
+    try:
+        wait_for_socket(args.socket, serving_config.inference_connect_timeout_s, lambda: inference.poll() is None)
+        import uvicorn
+
+        # worker 以 spawn 方式启动，重新导入配置时读取 INFERENCE_SOCKET 进入远程模式；API 进程的启动预热只涉及检索缓存
+        os.environ["INFERENCE_SOCKET"] = args.socket
+        workers = max(1, args.workers)
+        os.environ.update(_split_admission(workers))
+        uvicorn.run("src.api.server:app", host=args.host, port=args.port, workers=workers)
+    finally:
+        inference.terminate()
+        try:
+            inference.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            inference.kill()
+
+
+def _split_admission(workers: int) -> Dict[str, str]:
+    # 每个 worker 各有一个准入调度器，而模型只有推理进程一份：把 SCHED_* 总量按 worker 数均分，
+    # 推理进程上同时执行的管线数仍不超过配置的 SCHED_MAX_INFLIGHT（worker 数多于总量时每个 worker 至少 1）
+    if serving_config.max_inflight <= 0:
+        return {}
+    inflight = max(1, serving_config.max_inflight // workers)
+    reserve = min(inflight - 1, math.ceil(serving_config.interactive_reserve / workers))
+    return {
+        "SCHED_MAX_INFLIGHT": str(inflight),
+        "SCHED_INTERACTIVE_RESERVE": str(max(0, reserve)),
+        "SCHED_MAX_QUEUE": str(max(1, math.ceil(serving_config.max_queue / workers))),
+        "SCHED_MAX_BATCH_QUEUE": str(max(1, math.ceil(serving_config.max_batch_queue / workers))),
+    }
+
+
+if __name__ == "__main__":
+    main()
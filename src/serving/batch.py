@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from ..config import serving_config
+from ..graph.pipeline_graph import PipelineGraph
+from ..models.schemas import UserRequest
+from .scheduler import AdmissionScheduler, Rejected
+import asyncio
+
+Page = List[Tuple[Any, UserRequest]]
+
+
+class BatchRunner:
+    # 批量生成：分页读取 -> 有界工作队列 -> 固定数量的并发 worker -> 按完成顺序产出结果行
+    # 并发数大于生成攒批上限时，多个用户的 LLM 调用会被 GenerationBatcher 合并为同一次 generate
+    def __init__(
+        self,
+        pipeline: PipelineGraph,
+        mode: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        skip: Optional[Set[str]] = None,
+        scheduler: Optional[AdmissionScheduler] = None,
+    ) -> None:
+        self.pipeline = pipeline
+        # 与在线接口共用准入控制时走 batch 通道，优先级低于交互请求
+        self.scheduler = scheduler
+        self.mode = pipeline.select_mode(mode, allow_degrade=False)
+        self.concurrency = max(1, concurrency or serving_config.batch_concurrency)
+        self.skip = skip or set()
+        self.ok = self.errors = self.skipped = 0
+        self.started = time.perf_counter()
+
+    async def run(self, pages: Iterable[Page]) -> AsyncIterator[Dict[str, Any]]:
+        # 两个队列都有界：读取速度受 worker 消费速度约束，内存占用与总用户数无关
+        work: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        finished = object()
+
+        async def produce() -> None:
+            it = iter(pages)
+            error: Optional[Exception] = None
+            try:
+                while True:
+                    page = await asyncio.to_thread(next, it, None)
+                    if page is None:
+                        break
+                    todo = [(k, r) for k, r in page if str(k) not in self.skip]
+                    self.skipped += len(page) - len(todo)
+                    if todo and self.mode != "fast":
+                        await self._prefetch(todo)
+                    for item in todo:
+                        await work.put(item)
+            except Exception as e:
+                error = e
+            # 被取消时不再投递结束标记，由 run() 统一取消 worker
+            for _ in range(self.concurrency):
+                await work.put(None)
+            if error is not None:
+                raise error
+
+        async def consume() -> None:
+            while True:
+                item = await work.get()
+                if item is None:
+                    break
+                await results.put(await self._one(*item))
+            await results.put(finished)
+
+        producer = asyncio.create_task(produce())
+        workers = [asyncio.create_task(consume()) for _ in range(self.concurrency)]
+        try:
+            done = 0
+            while done < self.concurrency:
+                row = await results.get()
+                if row is finished:
+                    done += 1
+                    continue
+                yield row
+            # 读取端异常（如数据库错误）在全部在途任务结束后抛出
+            await producer
+        finally:
+            for task in [producer, *workers]:
+                task.cancel()
+
+    async def _prefetch(self, page: Page) -> None:
+        # 整页检索词一次性批量嵌入，写入查询向量缓存；之后每个用户的检索只查缓存
+        queries = list(dict.fromkeys(h for _, req in page for h in PipelineGraph._hints(req)))
+        await asyncio.to_thread(self.pipeline.vs.prewarm, queries)
+
+    async def _one(self, key: Any, req: UserRequest) -> Dict[str, Any]:
+        started = time.perf_counter()
+        row: Dict[str, Any] = {"key": str(key), "mode": self.mode}
+        try:
+            if self.scheduler is not None and self.mode != "fast":
+                ticket = await self._acquire()
+                try:
+                    out = await self.pipeline.arun_selected(req, self.mode, allow_degrade=False)
+                finally:
+                    if ticket is not None:
+                        ticket.release()
+            else:
+                out = await self.pipeline.arun_selected(req, self.mode, allow_degrade=False)
+            try:
+                result = json.loads(out.get("final_json"))
+            except Exception:
+                result = {"raw": out.get("final_json")}
+            row.update(ok=True, mode=out["mode"], result=result, error=None)
+            self.ok += 1
+        except Exception as e:
+            row.update(ok=False, result=None, error=f"{type(e).__name__}: {e}")
+            self.errors += 1
+        row["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return row
+
+    async def _acquire(self) -> Any:
+        # 并发数可能超过 batch 通道容量（名额 + 排队上限）；批量行没有等待中的交互客户端，
+        # 队列满时按 Retry-After 退避重试，而不是把该行记为失败
+        assert self.scheduler is not None
+        while True:
+            try:
+                return await self.scheduler.acquire("batch")
+            except Rejected as e:
+                await asyncio.sleep(e.retry_after_s)
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        done = self.ok + self.errors
+        return {
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "done": done,
+            "ok": self.ok,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "seconds": round(elapsed, 2),
+            "users_per_min": round(done / elapsed * 60, 1) if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,479 @@
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import itertools
+import os
+import pickle
+import socket
+import stat
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from ..config import serving_config
+from ..tracing import record_generation, span
+import asyncio
+
+# 推理进程与 API 进程之间的本地 IPC：Unix socket 上的长度前缀帧，帧内容为 pickle 的元组。
+# 请求 (rid, op, args)；响应 (rid, kind, data, queue_depth)，kind 为 chunk / ok / err。
+# 一条连接上多路复用并发调用；socket 位于仅属主可访问（0700）的目录、文件权限 0600，
+# 只接受同一用户的本机进程（pickle 不可暴露给外部）。
+_HEADER = struct.Struct(">I")
+_MAX_FRAME = 256 * 1024 * 1024
+
+
+def _default_socket() -> str:
+    # 优先 XDG_RUNTIME_DIR（systemd 为每个用户创建的 0700 目录），否则 /tmp 下按 uid 区分的私有目录
+    runtime = os.getenv("XDG_RUNTIME_DIR")
+    base = os.path.join(runtime, "insuragent") if runtime else os.path.join("/tmp", f"insuragent-{os.getuid()}")
+    return os.path.join(base, "inference.sock")
+
+
+DEFAULT_SOCKET = _default_socket()
+
+
+def _private_dir(path: str) -> None:
+    # 确保 socket 所在目录存在、属于当前用户且其他用户无权访问；/tmp 下的同名目录可能被他人抢先创建
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"socket 目录不属于当前用户: {directory}")
+    if st.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def _check_owner(path: str) -> None:
+    # 对端同样会反序列化收到的帧：只连接、只替换当前用户自己创建的 socket
+    st = os.lstat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"不是当前用户的 socket: {path}")
+
+
+def _pack(message: Any) -> bytes:
+    body = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(body)) + body
+
+
+def _pack_error(rid: int, error: BaseException, depth: int) -> bytes:
+    # 异常原样回传（ReviewRejected 等调用方据此处理）；不可 pickle 的异常退化为 RuntimeError
+    try:
+        return _pack((rid, "err", error, depth))
+    except Exception:
+        return _pack((rid, "err", RuntimeError(f"{type(error).__name__}: {error}"), depth))
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Any:
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if size > _MAX_FRAME:
+        raise ConnectionError(f"IPC 帧过大: {size}")
+    return pickle.loads(await reader.readexactly(size))
+
+
+class InferenceServer:
+    # 推理进程：独占 LLM（及其生成攒批）与嵌入模型，多个 API 进程的调用汇入同一个批处理循环；
+    # 查询嵌入经本进程 VectorStore 的查询向量缓存，其磁盘层只由推理进程写入
+    def __init__(self, llm: Any, vs: Any) -> None:
+        self.llm = llm
+        self.vs = vs
+        self._embed_lock: Optional[asyncio.Lock] = None
+        self.connections = 0
+        self.requests: Counter[str] = Counter()
+        self.errors = 0
+
+    async def serve(self, path: str, ready: Optional[Callable[[], None]] = None) -> None:
+        _private_dir(path)
+        if os.path.lexists(path):
+            # 上次退出遗留的 socket；其他文件或他人的 socket 不删除
+            _check_owner(path)
+            os.unlink(path)
+        self._embed_lock = asyncio.Lock()
+        # bind 时即以 0600 创建，不留 bind 与 chmod 之间可被连接的窗口
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._handle, path=path)
+        finally:
+            os.umask(umask)
+        if ready is not None:
+            ready()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        tasks: Dict[int, asyncio.Task] = {}
+        write_lock = asyncio.Lock()
+
+        async def send(frame: bytes) -> None:
+            async with write_lock:
+                writer.write(frame)
+                await writer.drain()
+
+        try:
+            while True:
+                try:
+                    rid, op, args = await _read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if op == "cancel":
+                    task = tasks.get(rid)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                self.requests[op] += 1
+                task = asyncio.create_task(self._dispatch(rid, op, args, send))
+                tasks[rid] = task
+                task.add_done_callback(lambda _t, rid=rid: tasks.pop(rid, None))
+        finally:
+            # API 进程断开：取消它尚未完成的调用，流式生成随之停止
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+            self.connections -= 1
+
+    async def _dispatch(self, rid: int, op: str, args: Tuple[Any, ...], send: Callable[[bytes], Any]) -> None:
+        try:
+            try:
+                if op == "stream":
+                    usage: Dict[str, Any] = {}
+                    async for piece in self.llm.astream_chat(*args, usage=usage):
+                        await send(_pack((rid, "chunk", piece, self.llm.queue_depth)))
+                    result: Any = usage
+                else:
+                    result = await self._call(op, args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                await send(_pack_error(rid, e, self.llm.queue_depth))
+                return
+            await send(_pack((rid, "ok", result, self.llm.queue_depth)))
+        except ConnectionError:
+            # 连接已关闭，结果无人接收
+            pass
+
+    async def _call(self, op: str, args: Tuple[Any, ...]) -> Any:
+        if op == "chat":
+            return await self.llm.agenerate(*args)
+        if op == "encode":
+            texts, normalize = args
+            # 嵌入模型单线程使用，并发请求排队执行；API 进程侧另有各自的内存缓存
+            assert self._embed_lock is not None
+            async with self._embed_lock:
+                if normalize:
+                    vecs = await asyncio.to_thread(self.vs.encode_queries, texts)
+                else:
+                    vecs = await asyncio.to_thread(self.vs.embedder.encode, texts, normalize_embeddings=False)
+            return vecs.astype("float32", copy=False)
+        if op == "hello":
+            return {
+                "pid": os.getpid(),
+                "backend": getattr(self.llm, "backend", None),
+                "dim": self.vs.embedder.get_sentence_embedding_dimension(),
+            }
+        if op == "stats":
+            return {**self.llm.stats(), "ipc": self.stats()}
+        raise ValueError(f"未知的 IPC 调用: {op}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"connections": self.connections, "requests": dict(self.requests), "errors": self.errors}
+
+
+class InferenceClient:
+    # API 进程侧：连接与收发在独立线程的事件循环中进行，同步（嵌入）与异步（生成）调用共用一条连接
+    def __init__(
+        self,
+        path: str,
+        connect_timeout_s: Optional[float] = None,
+        call_timeout_s: Optional[float] = None,
+    ) -> None:
+        self.path = path
+        self.connect_timeout_s = (
+            serving_config.inference_connect_timeout_s if connect_timeout_s is None else connect_timeout_s
+        )
+        self.call_timeout_s = serving_config.inference_call_timeout_s if call_timeout_s is None else call_timeout_s
+        self.queue_depth = 0
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Any] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="inference-ipc", daemon=True)
+        self._thread.start()
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._closed = False
+        self._connected = False
+        # 首次调用即建立连接：推理进程尚在加载时在 connect_timeout_s 内重试
+        self.info: Dict[str, Any] = self.call("hello", timeout_s=self.connect_timeout_s + self.call_timeout_s)
+
+    async def _ensure(self) -> asyncio.StreamWriter:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None:
+                return self._writer
+            # 只有首次连接等待推理进程就绪；运行中断开后只重连一次，失败即报错，不让请求长时间挂起
+            deadline = time.monotonic() + (0.0 if self._connected else self.connect_timeout_s)
+            while True:
+                try:
+                    _check_owner(self.path)
+                    reader, writer = await asyncio.open_unix_connection(self.path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() >= deadline:
+                        raise ConnectionError(f"无法连接推理进程: {self.path}")
+                    await asyncio.sleep(0.2)
+            self._writer = writer
+            self._connected = True
+            self._loop.create_task(self._read_loop(reader, writer))
+            return writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        error: BaseException = ConnectionError("推理进程连接已断开")
+        try:
+            while True:
+                rid, kind, data, depth = await _read_frame(reader)
+                self.queue_depth = depth
+                target = self._pending.get(rid) if kind == "chunk" else self._pending.pop(rid, None)
+                if target is None:
+                    continue
+                if isinstance(target, asyncio.Future):
+                    if target.done():
+                        continue
+                    if kind == "err":
+                        target.set_exception(data)
+                    else:
+                        target.set_result(data)
+                else:
+                    target((kind, data))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            if not isinstance(e, asyncio.IncompleteReadError):
+                error = ConnectionError(f"推理进程连接异常: {e}")
+        finally:
+            # 下一次调用重新连接；在途调用全部以连接错误结束
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            pending, self._pending = self._pending, {}
+            for target in pending.values():
+                if isinstance(target, asyncio.Future):
+                    if not target.done():
+                        target.set_exception(error)
+                else:
+                    target(("err", error))
+
+    async def _send(self, message: Any) -> None:
+        writer = await self._ensure()
+        writer.write(_pack(message))
+        await writer.drain()
+
+    async def _send_cancel(self, rid: int) -> None:
+        if self._pending.pop(rid, None) is None or self._writer is None:
+            return
+        try:
+            await self._send((rid, "cancel", None))
+        except (ConnectionError, OSError):
+            pass
+
+    async def _request(self, op: str, args: Tuple[Any, ...]) -> Any:
+        rid = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[rid] = future
+        try:
+            await self._send((rid, op, args))
+            return await future
+        except asyncio.CancelledError:
+            # 调用方放弃（客户端断开、超时）：通知推理进程取消，释放生成批中的名额
+            self._loop.create_task(self._send_cancel(rid))
+            raise
+        except BaseException:
+            self._pending.pop(rid, None)
+            raise
+
+    async def _open_stream(self, rid: int, op: str, args: Tuple[Any, ...], emit: Callable[[Any], None]) -> None:
+        self._pending[rid] = emit
+        try:
+            await self._send((rid, op, args))
+        except BaseException:
+            self._pending.pop(rid, None)
+            raise
+
+    def call(self, op: str, *args: Any, timeout_s: Optional[float] = None) -> Any:
+        # 同步调用：供线程池中的检索路径使用，不可在本客户端的 IO 线程里调用
+        future = asyncio.run_coroutine_threadsafe(self._request(op, args), self._loop)
+        try:
+            return future.result(self.call_timeout_s if timeout_s is None else timeout_s)
+        except concurrent.futures.TimeoutError:
+            # 取消 IO 线程中的请求，由 _request 通知推理进程
+            future.cancel()
+            raise TimeoutError(f"推理进程调用超时: {op}") from None
+
+    async def acall(self, op: str, *args: Any, timeout_s: Optional[float] = None) -> Any:
+        # 超时或调用方取消时，取消会传到 IO 线程中的 _request，并通知推理进程停止
+        future = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._request(op, args), self._loop))
+        try:
+            return await asyncio.wait_for(future, self.call_timeout_s if timeout_s is None else timeout_s)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"推理进程调用超时: {op}") from None
+
+    async def astream(self, op: str, *args: Any, timeout_s: Optional[float] = None) -> AsyncIterator[Tuple[str, Any]]:
+        # 依次产出 ("chunk", piece)，最后为 ("ok", data)；服务端报错时抛出对应异常。
+        # timeout_s 限制相邻两帧的间隔，超时即取消推理进程中的生成
+        timeout = self.call_timeout_s if timeout_s is None else timeout_s
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Tuple[str, Any]] = asyncio.Queue()
+
+        def emit(item: Tuple[str, Any]) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # 调用方事件循环已关闭
+                pass
+
+        rid = next(self._ids)
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._open_stream(rid, op, args, emit), self._loop))
+        finished = False
+        try:
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"推理进程流式调用超时: {op}") from None
+                if kind == "err":
+                    finished = True
+                    raise data
+                if kind == "ok":
+                    finished = True
+                yield kind, data
+                if finished:
+                    return
+        finally:
+            if not finished and not self._closed:
+                asyncio.run_coroutine_threadsafe(self._send_cancel(rid), self._loop)
+
+    async def _aclose(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._aclose(), self._loop).result(5)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+
+
+class RemoteLLM:
+    # 替代 LocalQwen：接口与 _ChatBackend 的异步部分一致，span 与 token 用量记录在 API 进程（/metrics 所在处）
+    backend = "remote"
+
+    def __init__(self, client: InferenceClient) -> None:
+        self.client = client
+
+    @property
+    def queue_depth(self) -> int:
+        # 推理进程随每个响应帧带回的生成队列深度，供降级判断
+        return self.client.queue_depth
+
+    async def achat(
+        self, system_prompt: str, user_prompt: str, schema: Any = None, stage: Optional[str] = None
+    ) -> str:
+        with span(f"llm.{stage or 'chat'}", remote=True) as sp:
+            text, usage = await self.client.acall(
+                "chat", system_prompt, user_prompt, schema, stage, timeout_s=serving_config.inference_generate_timeout_s
+            )
+            record_generation(sp, stage, usage)
+        return text
+
+    async def astream_chat(
+        self, system_prompt: str, user_prompt: str, schema: Any = None, stage: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        with span(f"llm.{stage or 'chat'}", stream=True, remote=True) as sp:
+            async for kind, data in self.client.astream(
+                "stream", system_prompt, user_prompt, schema, stage, timeout_s=serving_config.inference_generate_timeout_s
+            ):
+                if kind == "chunk":
+                    yield data
+                else:
+                    record_generation(sp, stage, data)
+
+    def warmup(self) -> None:
+        # 推理进程启动时已完成预热与前缀 KV 预计算
+        pass
+
+    def precompute_prefixes(self, system_prompts: Any) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            server = self.client.call("stats")
+        except Exception as e:
+            server = {"error": f"{type(e).__name__}: {e}"}
+        return {"backend": self.backend, "socket": self.client.path, "server": server}
+
+    def close(self) -> None:
+        # 连接由 registry 持有，与 RemoteEmbedder 共用，在 registry.shutdown 时关闭
+        pass
+
+
+class RemoteEmbedder:
+    # 替代 SentenceTransformer：满足 VectorStore 对 encode / get_sentence_embedding_dimension 的调用
+    def __init__(self, client: InferenceClient) -> None:
+        self.client = client
+        self.dim = int(client.info["dim"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: Any, normalize_embeddings: bool = True, **kwargs: Any) -> Any:
+        return self.client.call("encode", list(texts), normalize_embeddings)
+
+
+def wait_for_socket(path: str, timeout_s: float, alive: Optional[Callable[[], bool]] = None) -> None:
+    # 启动器等待推理进程就绪（socket 可连接）；alive 返回 False 表示推理进程已退出
+    deadline = time.monotonic() + timeout_s
+    while True:
+        if alive is not None and not alive():
+            raise RuntimeError("推理进程启动失败")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(path)
+            return
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"等待推理进程超时: {path}")
+            time.sleep(0.2)
+
+
+def run_server(path: str, warmup: bool = True) -> None:
+    # 推理进程入口：按配置加载 LLM、嵌入模型与索引（缺失时构建），预热后开始服务
+    from .registry import registry
+
+    registry.inference_socket = ""
+    if warmup:
+        registry.warmup()
+    else:
+        registry.load()
+    server = InferenceServer(registry.llm, registry.vs)
+    try:
+        asyncio.run(server.serve(path, lambda: print(f"inference server listening on {path}", flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.shutdown()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="推理进程：独占模型与生成批处理，经 Unix socket 服务多个 API 进程")
+    parser.add_argument("--socket", default=serving_config.inference_socket or DEFAULT_SOCKET, help="Unix socket 路径")
+    parser.add_argument("--no-warmup", action="store_true", help="跳过启动预热")
+    args = parser.parse_args()
+    run_server(args.socket, not args.no_warmup)
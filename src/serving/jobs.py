@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from ..config import serving_config
+from ..db.models import (
+    StrategyJob,
+    acreate_job,
+    afind_job,
+    afinish_job,
+    aclaim_job,
+    aclaimable_jobs,
+    afail_exhausted_jobs,
+    aget_job,
+    arelease_job,
+    arenew_lease,
+)
+from ..models.schemas import UserRequest
+from .scheduler import AdmissionScheduler, Rejected
+from .singleflight import flight_key
+import asyncio
+
+# execute(req, mode) -> 解析后的结果；由 API 层提供（负责解析 final_json 与写结果缓存）
+Execute = Callable[[UserRequest, str], Awaitable[Any]]
+
+
+def job_view(job: StrategyJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "user_id": job.user_id,
+        "mode": job.mode,
+        "priority": job.priority,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "result": json.loads(job.result) if job.result is not None else None,
+        "error": job.error,
+    }
+
+
+# 异步任务：提交即返回 job_id，由固定数量的 worker 从队列取出并通过共享管线执行；
+# 任务与结果落在数据库 strategy_jobs 表。执行中的任务持有租约并定期续约，
+# 进程退出后租约过期的任务与长时间无人认领的排队任务由任一进程的定期扫描接手，存活进程的任务不受影响。
+# 执行前同样经过准入调度，任务与同步接口共用名额，不会绕过并发上限。
+class JobManager:
+    def __init__(
+        self, scheduler: AdmissionScheduler, workers: int, max_pending: int, lease_s: float, max_attempts: int = 0
+    ) -> None:
+        self.scheduler = scheduler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.lease_s = max(1.0, lease_s)
+        self.max_attempts = max_attempts
+        # 认领者标识：主机 + 进程 + 随机后缀，同一进程重启后也不会误认旧租约
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue[str]] = None
+        # 已在本进程队列中等待的 id，扫描时跳过
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._execute: Optional[Execute] = None
+        self.submitted = 0
+        self.deduplicated = 0
+        self.recovered = 0
+        self.done = 0
+        self.failed = 0
+        self.lost = 0
+        self.exhausted = 0
+
+    @classmethod
+    def from_config(cls, scheduler: AdmissionScheduler) -> JobManager:
+        return cls(
+            scheduler,
+            serving_config.jobs_workers,
+            serving_config.jobs_max_pending,
+            serving_config.jobs_lease_s,
+            serving_config.jobs_max_attempts,
+        )
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self, execute: Execute) -> None:
+        if self._tasks:
+            return
+        self._execute = execute
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        # 执行中的任务被取消时交还为 queued（见 _run）；交还失败的等租约过期后由其他进程接手
+        tasks, self._tasks = self._tasks, []
+        if self._sweeper is not None:
+            tasks.append(self._sweeper)
+            self._sweeper = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = None
+        self._queued.clear()
+
+    def _enqueue(self, job_id: str) -> bool:
+        if self._queue is None or job_id in self._queued:
+            return False
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+        return True
+
+    async def _sweep(self) -> None:
+        # 启动时立即扫描一次，之后每半个租约一次；只读查询，认领仍由 aclaim_job 的条件更新保证唯一
+        while True:
+            now = time.time()
+            try:
+                self.exhausted += await afail_exhausted_jobs(now, self.max_attempts)
+            except Exception:
+                pass
+            limit = self.max_pending - self.pending if self.max_pending > 0 else 1000
+            if limit > 0:
+                try:
+                    ids = await aclaimable_jobs(now, now - self.lease_s, limit, self.max_attempts)
+                except Exception:
+                    ids = []
+                for job_id in ids:
+                    if self._enqueue(job_id):
+                        self.recovered += 1
+            await asyncio.sleep(self.lease_s / 2)
+
+    async def submit(
+        self, user_id: int, req: UserRequest, mode: str, priority: str = "interactive", cached: Any = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        # 返回 (任务视图, 是否命中已有任务)；cached 为结果缓存命中时直接建成已完成的任务
+        if self._queue is None:
+            raise RuntimeError("JobManager 未启动")
+        key = flight_key(user_id, req, mode)
+        while True:
+            # 已完成任务只在结果缓存有效期内复用，之后重新生成（索引、模型可能已更新）
+            existing = await afind_job(key, time.time() - serving_config.result_cache_ttl_s)
+            if existing is not None:
+                self.deduplicated += 1
+                return job_view(existing), True
+            if cached is None and self.max_pending > 0 and self.pending >= self.max_pending:
+                raise Rejected(429, "任务队列已满", self.scheduler.retry_after(priority))
+            now = time.time()
+            job = StrategyJob(
+                id=uuid.uuid4().hex,
+                user_id=user_id,
+                mode=mode,
+                priority=priority,
+                dedup_key=key,
+                active_key=key if cached is None else None,
+                status="queued" if cached is None else "done",
+                request=req.model_dump_json(),
+                result=None if cached is None else json.dumps(cached, ensure_ascii=False),
+                attempts=0,
+                created_at=now,
+                finished_at=None if cached is None else now,
+            )
+            if await acreate_job(job):
+                break
+            # active_key 冲突：并发的重复提交（本进程或其他进程）已建了在途任务，重新查询并复用
+        self.submitted += 1
+        if cached is None:
+            self._enqueue(job.id)
+        return job_view(job), False
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await aget_job(job_id)
+        return job_view(job) if job is not None else None
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        while True:
+            job_id = await queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 数据库异常等：任务保持原状态，不影响 worker 继续处理后续任务
+                pass
+
+    async def _run(self, job_id: str) -> None:
+        assert self._execute is not None
+        now = time.time()
+        job = await aclaim_job(job_id, self.worker_id, now, now + self.lease_s, self.max_attempts)
+        if job is None:
+            # 已被其他 worker/进程认领（租约未过期）、已完成，或尝试次数已达上限（由扫描标记为 failed）
+            return
+        req = UserRequest.model_validate_json(job.request)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            try:
+                if job.mode == "fast":
+                    result = await self._execute(req, job.mode)
+                else:
+                    ticket = await self._acquire(job.priority)
+                    try:
+                        result = await self._execute(req, job.mode)
+                    finally:
+                        if ticket is not None:
+                            ticket.release()
+            finally:
+                heartbeat.cancel()
+        except asyncio.CancelledError:
+            try:
+                await asyncio.shield(arelease_job(job_id, self.worker_id))
+            except Exception:
+                pass
+            raise
+        except Exception as e:
+            await self._finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+            return
+        await self._finish(job_id, "done", result=json.dumps(result, ensure_ascii=False))
+
+    async def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        if not await afinish_job(job_id, self.worker_id, status, time.time(), result=result, error=error):
+            # 续约中断导致租约过期、任务已被其他 worker 接手：结果以接手者为准
+            self.lost += 1
+        elif status == "done":
+            self.done += 1
+        else:
+            self.failed += 1
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            try:
+                if not await arenew_lease(job_id, self.worker_id, time.time() + self.lease_s):
+                    return
+            except Exception:
+                # 数据库暂时不可用：下个周期重试，租约内恢复即不受影响
+                pass
+
+    async def _acquire(self, lane: str) -> Any:
+        # 任务没有等待中的客户端，准入队列满时按 Retry-After 退避重试而不是失败
+        while True:
+            try:
+                return await self.scheduler.acquire(lane)
+            except Rejected as e:
+                await asyncio.sleep(e.retry_after_s)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "recovered": self.recovered,
+            "done": self.done,
+            "failed": self.failed,
+            "lost": self.lost,
+            "exhausted": self.exhausted,
+            "worker_id": self.worker_id,
+        }
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from ..agents.prompts import PLANNER_SYSTEM, STRATEGY_SYSTEM, RISK_SYSTEM, REVIEW_SYSTEM
+from ..config import rag_config, serving_config
+from ..models.schemas import INSURANCE_GOALS
+from ..graph.pipeline_graph import PipelineGraph
+from .jobs import JobManager
+from .result_cache import ResultCache
+from .scheduler import AdmissionScheduler
+from .singleflight import SingleFlight
+import asyncio
+
+if TYPE_CHECKING:
+    from ..rag.vectorstore import VectorStore
+    from .ipc import InferenceClient
+    from ..tools.local_llm import LocalQwen
+
+
+# 进程级共享资源：LLM、向量库与管线只加载一次，供所有请求复用
+class ResourceRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._llm: Optional[LocalQwen] = None
+        self._vs: Optional[VectorStore] = None
+        self._pipeline: Optional[PipelineGraph] = None
+        self._result_cache: Optional[ResultCache] = None
+        # 非空时为多进程部署的 API 进程：模型在推理进程中，经该 socket 调用
+        self.inference_socket = serving_config.inference_socket
+        self._client: Optional[InferenceClient] = None
+        self.singleflight = SingleFlight()
+        self.scheduler = AdmissionScheduler.from_config()
+        self.jobs = JobManager.from_config(self.scheduler)
+        self.warmed_up = False
+
+    @property
+    def llm(self) -> LocalQwen:
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None and self.inference_socket:
+                    from .ipc import RemoteLLM
+
+                    self._llm = RemoteLLM(self._remote())
+                elif self._llm is None:
+                    # 模型依赖（torch/transformers 或 llama.cpp）在首次加载时才导入；后端由 LLM_BACKEND 决定
+                    from ..tools.local_llm import load_llm
+
+                    self._llm = load_llm()
+        return self._llm
+
+    @property
+    def vs(self) -> VectorStore:
+        if self._vs is None:
+            with self._lock:
+                if self._vs is None and self.inference_socket:
+                    from ..rag.vectorstore import VectorStore
+                    from .ipc import RemoteEmbedder
+
+                    # 查询嵌入交给推理进程；索引与文档库只读 mmap，各 API 进程共享页缓存
+                    self._vs = VectorStore(embedder=RemoteEmbedder(self._remote()), readonly=True)
+                elif self._vs is None:
+                    from ..rag.vectorstore import VectorStore
+
+                    self._vs = VectorStore()
+        return self._vs
+
+    def _remote(self) -> InferenceClient:
+        # 调用方已持有 self._lock
+        if self._client is None:
+            from .ipc import InferenceClient
+
+            self._client = InferenceClient(self.inference_socket)
+        return self._client
+
+    @property
+    def pipeline(self) -> PipelineGraph:
+        if self._pipeline is None:
+            with self._lock:
+                if self._pipeline is None:
+                    # 模型与索引在管线首次用到时才经 registry 加载（load/warmup 会提前触发），fast 模式不加载
+                    self._pipeline = PipelineGraph(llm_factory=lambda: self.llm, vs_factory=lambda: self.vs)
+        return self._pipeline
+
+    @property
+    def result_cache(self) -> Optional[ResultCache]:
+        if serving_config.result_cache_size <= 0:
+            return None
+        if self._result_cache is None:
+            with self._lock:
+                if self._result_cache is None:
+                    self._result_cache = ResultCache(
+                        serving_config.result_cache_size,
+                        serving_config.result_cache_ttl_s,
+                        serving_config.result_cache_path,
+                    )
+        return self._result_cache
+
+    @property
+    def queue_depth(self) -> int:
+        # 未加载模型时不触发加载
+        return self._llm.queue_depth if self._llm is not None else 0
+
+    def use(self, llm: Optional[LocalQwen] = None, vs: Optional[VectorStore] = None) -> None:
+        # 注入已构造的实例（基准测试的替身模型等），之后不再按配置加载
+        with self._lock:
+            if llm is not None:
+                self._llm = llm
+            if vs is not None:
+                self._vs = vs
+            self._pipeline = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._llm is not None and self._vs is not None
+
+    def load(self) -> PipelineGraph:
+        # 服务启动时提前加载模型与索引，首个请求不承担加载延迟
+        pipeline = self.pipeline
+        _ = pipeline.llm, pipeline.vs
+        return pipeline
+
+    def warmup(self) -> None:
+        # 一次极短生成 + 一次检索，触发权重分页、kernel 选择与 FAISS 首次访问
+        pipeline = self.load()
+        pipeline.vs.prewarm(INSURANCE_GOALS + [t.strip() for t in rag_config.prewarm_terms.split(",") if t.strip()])
+        pipeline.vs.warmup()
+        pipeline.llm.warmup()
+        pipeline.llm.precompute_prefixes([STRATEGY_SYSTEM, RISK_SYSTEM, REVIEW_SYSTEM, PLANNER_SYSTEM])
+        self.warmed_up = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "llm": self._llm.stats() if self._llm is not None else None,
+            "vectorstore": self._vs.stats() if self._vs is not None else None,
+            "result_cache": self._result_cache.stats() if self._result_cache is not None else None,
+            "singleflight": self.singleflight.stats(),
+            "scheduler": self.scheduler.stats(),
+            "jobs": self.jobs.stats(),
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._llm is not None:
+                self._llm.close()
+            if self._vs is not None:
+                self._vs.close()
+            if self._result_cache is not None:
+                self._result_cache.close()
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+            self._result_cache = None
+            self._pipeline = None
+            self._llm = None
+            self._vs = None
+            self.warmed_up = False
+
+    async def astartup(self, warmup: bool | None = None) -> None:
+        warmup = serving_config.warmup_on_startup if warmup is None else warmup
+        await asyncio.to_thread(self.warmup if warmup else self.load)
+
+
+registry = ResourceRegistry()
+
+
+def get_pipeline() -> PipelineGraph:
+    return registry.pipeline
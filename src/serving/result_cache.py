@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..models.schemas import UserRequest
+import asyncio
+
+# 指纹格式或分档变化时递增，旧缓存条目随之失效
+_FINGERPRINT_VERSION = 2
+_INCOME_EDGES = [50_000, 100_000, 200_000, 300_000, 500_000, 800_000, 1_200_000, 2_000_000]
+_BUDGET_EDGES = [500, 1_000, 2_000, 5_000, 10_000]
+
+
+def _band(value: float, edges: list) -> int:
+    return bisect.bisect_right(edges, value)
+
+
+def family_class(family_structure: str) -> str:
+    text = family_structure.lower()
+    if any(k in text for k in ["子", "女", "孩", "child", "kid"]):
+        return "with_children"
+    if any(k in text for k in ["已婚", "配偶", "夫", "妻", "married", "spouse"]):
+        return "couple"
+    if any(k in text for k in ["单身", "未婚", "single"]):
+        return "single"
+    return "other"
+
+
+def cacheable(mode: str) -> bool:
+    # fast 为纯启发式，微秒级完成，缓存没有收益；且其保额、年期按精确年龄与收入计算，同档复用会给出别人的数值
+    return mode != "fast"
+
+
+def fingerprint(req: UserRequest, mode: str) -> str:
+    # 分档后的画像：年龄 5 岁一档、收入/预算按区间，目标排序去重；同档画像共享同一份策略
+    budget = req.finance.monthly_budget_for_insurance
+    canonical = {
+        "v": _FINGERPRINT_VERSION,
+        "mode": mode,
+        "age": req.insured.age // 5,
+        "income": _band(req.finance.annual_income, _INCOME_EDGES),
+        # 预算直接影响规则预检与购买节奏，单独分档
+        "budget": None if budget is None else _band(budget, _BUDGET_EDGES),
+        "goals": sorted(set(req.goals.goals)),
+        "smoker": req.insured.smoker,
+        "family": family_class(req.insured.family_structure),
+        "coverage": sorted({p.coverage_type for p in req.existing_policies}),
+        "hints": sorted(set(req.knowledge_hints or [])),
+    }
+    if mode == "hybrid":
+        # hybrid 的策略 JSON 即启发式草案，保额与年期取决于精确年龄与收入，不能按档共享
+        canonical["exact"] = [req.insured.age, req.finance.annual_income]
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    # 整条策略生成结果的缓存：内存 LRU + TTL，可选 SQLite 持久层（进程重启/多 worker 共享）
+    def __init__(self, capacity: int, ttl_s: float, sqlite_path: str = "") -> None:
+        self.capacity = capacity
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = self.disk_hits = self.misses = self.expired = self.evictions = 0
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS strategy_result_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM strategy_result_cache WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if item[0] >= now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._mem[key]
+                self.expired += 1
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM strategy_result_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] >= now:
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO strategy_result_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at),
+                )
+
+    def _remember(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.capacity:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM strategy_result_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._mem),
+            "capacity": self.capacity,
+            "ttl_s": self.ttl_s,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        # 仅有内存层时直接查询；SQLite 层的磁盘 IO 放到线程里
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: Dict[str, Any]) -> None:
+        if self._db is None:
+            self.put(key, value)
+            return
+        await asyncio.to_thread(self.put, key, value)
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import math
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from ..config import serving_config
+from ..tracing import span
+import asyncio
+
+# 优先级从高到低：interactive（单用户接口）先于 batch（批量生成）获得名额
+LANES = ("interactive", "batch")
+# 排队期间检查客户端是否已断开的间隔
+_DISCONNECT_POLL_S = 0.05
+
+
+class Rejected(Exception):
+    # 429：队列已满，稍后重试；503：排队超过截止时间
+    def __init__(self, status: int, reason: str, retry_after_s: int) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class Abandoned(Exception):
+    # 排队期间客户端已断开，请求在获得名额前被撤销
+    pass
+
+
+class Ticket:
+    __slots__ = ("scheduler", "lane", "admitted_at", "released")
+
+    def __init__(self, scheduler: AdmissionScheduler, lane: str) -> None:
+        self.scheduler = scheduler
+        self.lane = lane
+        self.admitted_at = time.perf_counter()
+        self.released = False
+
+    def release(self) -> None:
+        # 可重复调用：流式响应的生成器 finally 与兜底回收可能都会触发
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class _Waiter:
+    __slots__ = ("lane", "future", "enqueued_at")
+
+    def __init__(self, lane: str, future: asyncio.Future) -> None:
+        self.lane = lane
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+# 有界准入：同时执行的管线数不超过 max_inflight，其余请求按优先级排队；
+# 队列满时立即拒绝（429），排队超过截止时间返回 503，客户端断开则撤销排队。
+# batch 通道最多占用 max_inflight - interactive_reserve 个名额，突发的批量任务不会挤占交互请求。
+class AdmissionScheduler:
+    def __init__(
+        self,
+        max_inflight: int,
+        max_queue: int,
+        max_batch_queue: int,
+        interactive_reserve: int = 0,
+    ) -> None:
+        self.max_inflight = max_inflight
+        self.limits = {"interactive": max(0, max_queue), "batch": max(0, max_batch_queue)}
+        self.batch_limit = max(1, max_inflight - max(0, interactive_reserve))
+        self._inflight: Counter[str] = Counter()
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        # 名额占用时长的指数滑动平均，用于估算 Retry-After
+        self._hold_s = 1.0
+        self.admitted: Counter[str] = Counter()
+        self.rejected: Counter[str] = Counter()
+        self.expired: Counter[str] = Counter()
+        self.abandoned: Counter[str] = Counter()
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    @classmethod
+    def from_config(cls) -> AdmissionScheduler:
+        return cls(
+            serving_config.max_inflight,
+            serving_config.max_queue,
+            serving_config.max_batch_queue,
+            serving_config.interactive_reserve,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight > 0
+
+    @property
+    def inflight(self) -> int:
+        return sum(self._inflight.values())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _has_room(self, lane: str) -> bool:
+        if self.inflight >= self.max_inflight:
+            return False
+        return lane != "batch" or self._inflight["batch"] < self.batch_limit
+
+    def retry_after(self, lane: str) -> int:
+        # 前面排队的请求按当前并发度消化完所需的大致秒数
+        ahead = sum(len(self._queues[l]) for l in LANES[: LANES.index(lane) + 1])
+        return max(1, min(60, math.ceil(self._hold_s * (ahead + 1) / max(1, self.max_inflight))))
+
+    def _admit(self, lane: str, waited_s: float) -> Ticket:
+        self._inflight[lane] += 1
+        self.admitted[lane] += 1
+        self.total_wait_s += waited_s
+        self.max_wait_s = max(self.max_wait_s, waited_s)
+        return Ticket(self, lane)
+
+    async def acquire(
+        self,
+        lane: str = "interactive",
+        deadline_s: Optional[float] = None,
+        disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Optional[Ticket]:
+        # 未启用（max_inflight<=0）时不做准入控制，返回 None
+        if not self.enabled:
+            return None
+        if lane not in self._queues:
+            raise ValueError(f"未知的调度通道: {lane}")
+        # 有空闲名额且没有同级或更高优先级的请求在排队时直接放行
+        if self._has_room(lane) and not any(self._queues[l] for l in LANES[: LANES.index(lane) + 1]):
+            return self._admit(lane, 0.0)
+        if len(self._queues[lane]) >= self.limits[lane]:
+            self.rejected[lane] += 1
+            raise Rejected(429, "生成队列已满", self.retry_after(lane))
+
+        waiter = _Waiter(lane, asyncio.get_running_loop().create_future())
+        self._queues[lane].append(waiter)
+        deadline = time.perf_counter() + deadline_s if deadline_s else None
+        with span("sched.wait", lane=lane) as sp:
+            try:
+                while not waiter.future.done():
+                    timeout = _DISCONNECT_POLL_S if disconnected is not None else None
+                    if deadline is not None:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            self.expired[lane] += 1
+                            raise Rejected(503, "排队超过请求截止时间", self.retry_after(lane))
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    try:
+                        await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+                    except asyncio.TimeoutError:
+                        if disconnected is not None and await disconnected():
+                            self.abandoned[lane] += 1
+                            raise Abandoned()
+            except BaseException:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # 名额已移交给本请求但调用方放弃了，归还给下一个排队者
+                    waiter.future.result().release()
+                else:
+                    waiter.future.cancel()
+                    self._drop(waiter)
+                raise
+            sp.set(wait_ms=round(1000 * (time.perf_counter() - waiter.enqueued_at), 3))
+        return waiter.future.result()
+
+    def _drop(self, waiter: _Waiter) -> None:
+        try:
+            self._queues[waiter.lane].remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, ticket: Ticket) -> None:
+        self._inflight[ticket.lane] -= 1
+        self._hold_s = 0.8 * self._hold_s + 0.2 * (time.perf_counter() - ticket.admitted_at)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # 按通道优先级把空出的名额交给排队最久的请求；已撤销的等待者直接跳过
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self._has_room(lane):
+                waiter = queue.popleft()
+                if waiter.future.done():
+                    continue
+                waiter.future.set_result(self._admit(lane, time.perf_counter() - waiter.enqueued_at))
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        lane: str = "interactive",
+        deadline_s: Optional[float] = None,
+        disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> AsyncIterator[Optional[Ticket]]:
+        ticket = await self.acquire(lane, deadline_s, disconnected)
+        try:
+            yield ticket
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    def stats(self) -> Dict[str, Any]:
+        admitted = sum(self.admitted.values())
+        return {
+            "max_inflight": self.max_inflight,
+            "inflight": dict(self._inflight),
+            "queued": {lane: len(q) for lane, q in self._queues.items()},
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "expired": dict(self.expired),
+            "abandoned": dict(self.abandoned),
+            "avg_wait_ms": 1000 * self.total_wait_s / admitted if admitted else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_s,
+            "avg_hold_ms": 1000 * self._hold_s,
+        }
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from ..models.schemas import UserRequest
+import asyncio
+
+T = TypeVar("T")
+
+
+def flight_key(user_id: int, req: UserRequest, mode: str, selected: Optional[str] = None) -> str:
+    # user_id + 当前数据库状态（组装出的请求 JSON）+ 模式；用户资料变化后不会复用旧的在途结果。
+    # selected 为降级后实际执行的模式：降级的执行只与同样降级的请求共享，不允许降级的请求不会拿到 fast 结果
+    digest = hashlib.sha256(req.model_dump_json().encode("utf-8")).hexdigest()[:16]
+    if selected is not None and selected != mode:
+        mode = f"{mode}>{selected}"
+    return f"{user_id}:{mode}:{digest}"
+
+
+class SingleFlight:
+    # 同一 key 的并发请求只执行一次，其余请求等待并共享结果（或异常）
+    def __init__(self) -> None:
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is loop and not task.done():
+            self.coalesced += 1
+        else:
+            # 计算放在独立任务里：发起者断开或被取消时，其余等待者仍能拿到结果
+            task = loop.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self.leaders += 1
+        return await asyncio.shield(task)
+
+    def running(self, key: str) -> bool:
+        task = self._inflight.get(key)
+        return task is not None and not task.done()
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 所有等待者都已离开时避免 "exception was never retrieved" 告警
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"inflight": len(self._inflight), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import contextvars
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+
+
+@dataclass
+class _Pending:
+    system_prompt: str
+    user_prompt: str
+    schema: Any
+    stage: Optional[str]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchStats:
+    def __init__(self) -> None:
+        self.batches = 0
+        self.requests = 0
+        self.size_hist: Counter[int] = Counter()
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.total_generate_s = 0.0
+
+    def record(self, size: int, waits: List[float], generate_s: float) -> None:
+        self.batches += 1
+        self.requests += size
+        self.size_hist[size] += 1
+        self.total_wait_s += sum(waits)
+        self.max_wait_s = max([self.max_wait_s, *waits])
+        self.total_generate_s += generate_s
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_size_hist": dict(sorted(self.size_hist.items())),
+            "avg_wait_ms": 1000 * self.total_wait_s / self.requests if self.requests else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_s,
+            "avg_generate_ms": 1000 * self.total_generate_s / self.batches if self.batches else 0.0,
+        }
+
+
+# 把并发的 chat 请求攒成一批交给 generate_batch 一次性生成：
+# 取到第一个请求后最多再等 window_ms，或凑满 max_batch_size 立即发车；
+# 同一时刻只有一个批次在跑，模型不会被多个线程争用。
+class GenerationBatcher:
+    def __init__(
+        self,
+        generate_batch: Callable[[List[Tuple[str, str]], List[Any], List[Optional[str]]], List[Any]],
+        max_batch_size: int,
+        window_ms: float,
+    ) -> None:
+        self._generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.stats = BatchStats()
+        self._queue: Optional[asyncio.Queue[_Pending]] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_worker(self) -> asyncio.Queue[_Pending]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # 事件循环变化（如多次 asyncio.run）时重建队列与后台任务
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # 后台任务在空 context 中创建：否则会继承首个请求的 contextvar（如 trace），之后所有批次都记到它名下
+            self._worker = contextvars.Context().run(loop.create_task, self._run(self._queue))
+        assert self._queue is not None
+        return self._queue
+
+    async def submit(
+        self, system_prompt: str, user_prompt: str, schema: Any = None, stage: Optional[str] = None
+    ) -> Any:
+        # 返回 generate_batch 为该请求产出的那一行（LocalQwen 为 (文本, 用量)）
+        queue = self._ensure_worker()
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        await queue.put(_Pending(system_prompt, user_prompt, schema, stage, fut))
+        return await fut
+
+    async def _collect(self, queue: asyncio.Queue[_Pending]) -> List[_Pending]:
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + self.window_s
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                while len(batch) < self.max_batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 调用方已取消（客户端断开等）的请求不再占用批次
+        return [p for p in batch if not p.future.cancelled()]
+
+    async def _run(self, queue: asyncio.Queue[_Pending]) -> None:
+        while True:
+            batch = await self._collect(queue)
+            if not batch:
+                continue
+            started = time.perf_counter()
+            waits = [started - p.enqueued_at for p in batch]
+            try:
+                # 同一批次内各请求的输出 schema 与生成预算可以不同（策略/风控/复核混批）
+                outputs = await asyncio.to_thread(
+                    self._generate_batch,
+                    [(p.system_prompt, p.user_prompt) for p in batch],
+                    [p.schema for p in batch],
+                    [p.stage for p in batch],
+                )
+            except Exception as e:
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+            self.stats.record(len(batch), waits, time.perf_counter() - started)
+            for p, text in zip(batch, outputs):
+                if not p.future.done():
+                    p.future.set_result(text)
+
+    def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
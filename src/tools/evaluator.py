@@ -15,6 +15,7 @@ def assess_budget(req: UserRequest, rec: StrategyRecommendation) -> List[RiskWar
         "accident": 0.0004,
         "education_savings": 0.005,
         "annuity_retirement": 0.004,
+        "whole_life": 0.02,
     }
     est = 0.0
     for item in rec.items:
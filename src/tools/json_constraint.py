@@ -0,0 +1,500 @@
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from ..lazy import torch as _torch
+
+# 按 JSON Schema 约束解码：
+#   1) pydantic 类型 -> JSON Schema -> 编译为节点树（解析 $ref / anyOf / enum / additionalProperties）
+#   2) 下推自动机逐字符推进，状态为不可变元组（栈用 cons 链表），可直接作为缓存 key
+#   3) 每步只检查打分最高的 top-K 候选 token（用预先解码好的 token 文本），其余置为 -inf；
+#      JSON 闭合后只允许 EOS，并由停止条件让该行立即结束
+
+_WS = " \t\n\r"
+# 结构位置上连续空白的上限，避免模型在缩进/换行上原地打转
+_MAX_WS = 16
+# 单个数字的最大字符数
+_MAX_NUMBER = 24
+_END = -1
+
+
+class _Any:
+    pass
+
+
+class _Object:
+    def __init__(self) -> None:
+        self.props: Dict[str, Any] = {}
+        self.key_texts: Dict[str, str] = {}  # JSON 编码后的键（含引号）-> 键名
+        self.required: FrozenSet[str] = frozenset()
+        self.extra: Any = None  # None 表示不允许未声明的键
+
+
+class _Array:
+    def __init__(self, items: Any, min_items: int = 0, max_items: Optional[int] = None) -> None:
+        self.items = items
+        self.min_items = min_items
+        self.max_items = max_items
+
+
+class _String:
+    pass
+
+
+class _Number:
+    def __init__(self, integer: bool, nonneg: bool = False, positive: bool = False) -> None:
+        self.integer = integer
+        self.nonneg = nonneg
+        self.positive = positive
+
+
+class _Literal:
+    def __init__(self, words: Tuple[str, ...]) -> None:
+        self.words = words  # true / false / null
+
+
+class _Enum:
+    def __init__(self, texts: Tuple[str, ...]) -> None:
+        self.texts = texts  # 各取值的 JSON 文本，如 '"low"'、'1'
+
+
+class _Union:
+    def __init__(self, options: List[Any]) -> None:
+        self.options = options
+
+
+def _compile(schema: Any, defs: Dict[str, Any], memo: Dict[str, Any]) -> Any:
+    if schema is True or schema == {}:
+        return _Any()
+    if "$ref" in schema:
+        name = schema["$ref"].split("/")[-1]
+        if name not in memo:
+            memo[name] = _compile_ref(name, defs, memo)
+        return memo[name]
+    if "const" in schema:
+        return _Enum((json.dumps(schema["const"], ensure_ascii=False),))
+    if "enum" in schema:
+        return _Enum(tuple(json.dumps(v, ensure_ascii=False) for v in schema["enum"]))
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            return _Union([_compile(s, defs, memo) for s in schema[key]])
+    if "allOf" in schema and len(schema["allOf"]) == 1:
+        return _compile(schema["allOf"][0], defs, memo)
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        return _Union([_compile({**schema, "type": k}, defs, memo) for k in kind])
+    if kind == "object":
+        node = _Object()
+        _fill_object(node, schema, defs, memo)
+        return node
+    if kind == "array":
+        items = _compile(schema.get("items", {}), defs, memo)
+        return _Array(items, schema.get("minItems", 0), schema.get("maxItems"))
+    if kind == "string":
+        return _String()
+    if kind in ("number", "integer"):
+        low = schema.get("minimum")
+        low_ex = schema.get("exclusiveMinimum")
+        nonneg = (low is not None and low >= 0) or (low_ex is not None and low_ex >= 0)
+        positive = kind == "integer" and ((low is not None and low >= 1) or (low_ex is not None and low_ex >= 0))
+        return _Number(kind == "integer", nonneg, positive)
+    if kind == "boolean":
+        return _Literal(("true", "false"))
+    if kind == "null":
+        return _Literal(("null",))
+    return _Any()
+
+
+def _compile_ref(name: str, defs: Dict[str, Any], memo: Dict[str, Any]) -> Any:
+    schema = defs[name]
+    if schema.get("type") == "object":
+        # 先登记再编译子节点，支持递归结构
+        node = _Object()
+        memo[name] = node
+        _fill_object(node, schema, defs, memo)
+        return node
+    return _compile(schema, defs, memo)
+
+
+def _fill_object(node: _Object, schema: Dict[str, Any], defs: Dict[str, Any], memo: Dict[str, Any]) -> None:
+    props = schema.get("properties", {})
+    node.props = {k: _compile(v, defs, memo) for k, v in props.items()}
+    node.key_texts = {json.dumps(k, ensure_ascii=False): k for k in props}
+    node.required = frozenset(schema.get("required", []))
+    extra = schema.get("additionalProperties")
+    if extra is None:
+        # pydantic 模型默认不声明 additionalProperties：有声明字段时按封闭对象处理，纯 Dict 则任意键
+        node.extra = None if props else _Any()
+    elif extra is False:
+        node.extra = None
+    else:
+        node.extra = _compile(extra, defs, memo)
+
+
+def _str_step(sub: int, ch: str) -> Optional[int]:
+    # 字符串内部：0 普通，1 反斜杠之后，2..5 为 \u 之后剩余的十六进制位数 + 1
+    if sub == 0:
+        if ch == '"':
+            return _END
+        if ch == "\\":
+            return 1
+        return None if ord(ch) < 0x20 else 0
+    if sub == 1:
+        if ch in '"\\/bfnrt':
+            return 0
+        return 5 if ch == "u" else None
+    if ch in "0123456789abcdefABCDEF":
+        return sub - 1 if sub > 2 else 0
+    return None
+
+
+class JsonGrammar:
+    def __init__(self, schema: Dict[str, Any]) -> None:
+        self.schema = schema
+        self.root = _compile(schema, schema.get("$defs", {}), {})
+        # 状态 = (栈, 连续空白数)，栈为 (frame, parent) 的 cons 链表，None 表示顶层值已完成
+        self.initial: Tuple[Any, int] = ((("V", self.root), None), 0)
+        self._cache: Dict[Tuple[Any, int], Any] = {}
+
+    @staticmethod
+    def is_done(state: Tuple[Any, int]) -> bool:
+        return state[0] is None
+
+    def advance_token(self, state: Tuple[Any, int], token_id: int, text: Optional[str]) -> Optional[Tuple[Any, int]]:
+        key = (state, token_id)
+        if key in self._cache:
+            return self._cache[key]
+        out = self.advance(state, text) if text else None
+        if len(self._cache) > 500_000:
+            self._cache.clear()
+        self._cache[key] = out
+        return out
+
+    def advance(self, state: Optional[Tuple[Any, int]], text: str) -> Optional[Tuple[Any, int]]:
+        for ch in text:
+            if state is None:
+                return None
+            state = self.step(state, ch)
+        return state
+
+    def step(self, state: Tuple[Any, int], ch: str) -> Optional[Tuple[Any, int]]:
+        stack, ws = state
+        while True:
+            if stack is None:
+                # 顶层值已完成：只接受有限的尾随空白
+                return (None, ws + 1) if ch in _WS and ws < _MAX_WS else None
+            frame, parent = stack
+            kind = frame[0]
+
+            if kind == "V":
+                if ch in _WS:
+                    return (stack, ws + 1) if ws < _MAX_WS else None
+                started = self._start(frame[1], ch)
+                if started is None:
+                    return None
+                return (parent, 0) if started == "pop" else ((started, parent), 0)
+
+            if kind == "S":
+                sub = _str_step(frame[1], ch)
+                if sub is None:
+                    return None
+                return (parent, 0) if sub == _END else ((("S", sub), parent), 0)
+
+            if kind == "O":
+                result = self._object_step(frame, parent, ch, ws)
+                if result is None:
+                    return None
+                return result
+
+            if kind == "A":
+                _, node, phase, count = frame
+                if ch in _WS:
+                    return (stack, ws + 1) if ws < _MAX_WS else None
+                if ch == "]" and count >= node.min_items and (phase == "," or count == 0):
+                    return (parent, 0)
+                if phase == "[":
+                    if node.max_items is not None and node.max_items < 1:
+                        return None
+                    # 第一个元素：数组进入 "," 阶段，压入元素并把当前字符交给它
+                    stack = (("V", node.items), (("A", node, ",", 1), parent))
+                    ws = 0
+                    continue
+                if ch == "," and (node.max_items is None or count < node.max_items):
+                    return ((("V", node.items), (("A", node, ",", count + 1), parent)), 0)
+                return None
+
+            if kind == "N":
+                nxt = self._number_step(frame, ch)
+                if nxt == "pop":
+                    # 数字由后续字符终止：弹出并把该字符交给上层
+                    stack, ws = parent, 0
+                    continue
+                return ((nxt, parent), 0) if nxt is not None else None
+
+            if kind == "E":
+                texts, buf = frame[1], frame[2]
+                nb = buf + ch
+                if any(t.startswith(nb) for t in texts):
+                    if nb in texts and not any(t != nb and t.startswith(nb) for t in texts):
+                        return (parent, 0)
+                    return ((("E", texts, nb), parent), 0)
+                if buf in texts:
+                    stack, ws = parent, 0
+                    continue
+                return None
+
+            if kind == "L":
+                words, buf = frame[1], frame[2] + ch
+                if not any(w.startswith(buf) for w in words):
+                    return None
+                return (parent, 0) if buf in words else ((("L", words, buf), parent), 0)
+
+            return None
+
+    def _start(self, node: Any, ch: str) -> Any:
+        # 值的第一个字符：返回新帧，"pop" 表示该字符本身就构成完整的值，None 表示不可接受
+        if isinstance(node, _Union):
+            # 按首字符选分支；同一首字符对应多个分支时取第一个
+            for option in node.options:
+                started = self._start(option, ch)
+                if started is not None:
+                    return started
+            return None
+        if isinstance(node, _Any):
+            if ch == "{":
+                return self._start(_ANY_OBJECT, ch)
+            if ch == "[":
+                return ("A", _ANY_ARRAY, "[", 0)
+            if ch == '"':
+                return ("S", 0)
+            if ch == "-" or ch.isdigit():
+                return self._start(_ANY_NUMBER, ch)
+            return self._start(_ANY_LITERAL, ch)
+        if isinstance(node, _Object):
+            return ("O", node, "{", frozenset(), "", 0) if ch == "{" else None
+        if isinstance(node, _Array):
+            return ("A", node, "[", 0) if ch == "[" else None
+        if isinstance(node, _String):
+            return ("S", 0) if ch == '"' else None
+        if isinstance(node, _Number):
+            if ch == "-" and not node.nonneg:
+                return ("N", node, "-", 1)
+            if ch == "0" and not node.positive:
+                return ("N", node, "0", 1)
+            if ch in "123456789":
+                return ("N", node, "int", 1)
+            return None
+        if isinstance(node, _Literal):
+            if not any(w.startswith(ch) for w in node.words):
+                return None
+            return ("L", node.words, ch)
+        if isinstance(node, _Enum):
+            if not any(t.startswith(ch) for t in node.texts):
+                return None
+            if ch in node.texts and not any(t != ch and t.startswith(ch) for t in node.texts):
+                return "pop"
+            return ("E", node.texts, ch)
+        return None
+
+    def _object_step(self, frame: Tuple[Any, ...], parent: Any, ch: str, ws: int) -> Optional[Tuple[Any, int]]:
+        _, node, phase, seen, key, sub = frame
+        if phase == "key":
+            if node.extra is None:
+                # 封闭对象：键只能是尚未出现的已声明字段
+                nb = key + ch
+                texts = [t for t, name in node.key_texts.items() if name not in seen and t.startswith(nb)]
+                if not texts:
+                    return None
+                if nb in texts:
+                    return ((("O", node, ":", seen, node.key_texts[nb], 0), parent), 0)
+                return ((("O", node, "key", seen, nb, 0), parent), 0)
+            nxt = _str_step(sub, ch)
+            if nxt is None:
+                return None
+            if nxt == _END:
+                name = json.loads(key + '"')
+                if name in seen:
+                    return None
+                return ((("O", node, ":", seen, name, 0), parent), 0)
+            return ((("O", node, "key", seen, key + ch, nxt), parent), 0)
+
+        if ch in _WS:
+            return (((frame, parent)), ws + 1) if ws < _MAX_WS else None
+        if phase in ("{", "k") and ch == '"':
+            return ((("O", node, "key", seen, '"', 0), parent), 0)
+        if phase in ("{", ",") and ch == "}":
+            return (parent, 0) if node.required <= seen else None
+        if phase == "," and ch == ",":
+            if node.extra is None and all(name in seen for name in node.props):
+                return None
+            return ((("O", node, "k", seen, "", 0), parent), 0)
+        if phase == ":" and ch == ":":
+            value = node.props.get(key, node.extra)
+            if value is None:
+                return None
+            return ((("V", value), (("O", node, ",", seen | {key}, "", 0), parent)), 0)
+        return None
+
+    @staticmethod
+    def _number_step(frame: Tuple[Any, ...], ch: str) -> Any:
+        _, node, phase, length = frame
+        if length >= _MAX_NUMBER:
+            return "pop" if phase in ("0", "int", "frac", "exp") else None
+        digit = ch.isdigit() and ch.isascii()
+        if phase == "-":
+            if ch == "0":
+                return ("N", node, "0", length + 1)
+            return ("N", node, "int", length + 1) if digit else None
+        if phase in ("0", "int"):
+            if digit:
+                return ("N", node, "int", length + 1) if phase == "int" else None
+            if ch == "." and not node.integer:
+                return ("N", node, ".", length + 1)
+            if ch in "eE" and not node.integer:
+                return ("N", node, "e", length + 1)
+            return "pop"
+        if phase == ".":
+            return ("N", node, "frac", length + 1) if digit else None
+        if phase == "frac":
+            if digit:
+                return ("N", node, "frac", length + 1)
+            return ("N", node, "e", length + 1) if ch in "eE" else "pop"
+        if phase == "e":
+            if ch in "+-":
+                return ("N", node, "es", length + 1)
+            return ("N", node, "exp", length + 1) if digit else None
+        if phase == "es":
+            return ("N", node, "exp", length + 1) if digit else None
+        if phase == "exp":
+            return ("N", node, "exp", length + 1) if digit else "pop"
+        return None
+
+
+_ANY_OBJECT = _Object()
+_ANY_OBJECT.extra = _Any()
+_ANY_ARRAY = _Array(_Any())
+_ANY_NUMBER = _Number(False)
+_ANY_LITERAL = _Literal(("true", "false", "null"))
+
+
+def schema_of(schema_type: Any) -> Dict[str, Any]:
+    from pydantic import TypeAdapter
+
+    return TypeAdapter(schema_type).json_schema()
+
+
+@lru_cache(maxsize=32)
+def grammar_for(schema_type: Any) -> JsonGrammar:
+    # schema_type 为 pydantic 模型类或 List[...] 等类型；同一类型的语法与转移缓存在进程内共享
+    return JsonGrammar(schema_of(schema_type))
+
+
+class TokenVocab:
+    # 每个 token 单独解码后的文本；特殊 token 记为 None（从不允许）。
+    # 字节级 BPE 中只含半个 UTF-8 字符的 token 解码为 '�'，它只在字符串内部被接受
+    def __init__(self, tokenizer: Any, size: int, eos_ids: Sequence[int]) -> None:
+        n = min(size, len(tokenizer))
+        texts: List[Optional[str]] = tokenizer.batch_decode(
+            [[i] for i in range(n)], skip_special_tokens=False, clean_up_tokenization_spaces=False
+        )
+        special = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}) or {})
+        for i in special:
+            if i < n:
+                texts[i] = None
+        self.texts: List[Optional[str]] = texts + [None] * (size - n)
+        self.eos_ids = sorted({i for i in eos_ids if i is not None and 0 <= i < size})
+
+
+class JsonConstraint:
+    # 一次 generate 调用内的逐行约束状态；grammars[i] 为 None 的行不受约束（同批可混合不同 schema）
+    def __init__(
+        self, grammars: Sequence[Optional[JsonGrammar]], vocab: TokenVocab, prompt_len: int, top_k: int = 64
+    ) -> None:
+        self.grammars = list(grammars)
+        self.vocab = vocab
+        self.top_k = max(1, top_k)
+        self.states: List[Any] = [g.initial if g is not None else None for g in self.grammars]
+        self.failed = [False] * len(self.grammars)
+        self._seen = prompt_len
+
+    def update(self, input_ids: Any) -> None:
+        length = input_ids.shape[1]
+        if length <= self._seen:
+            return
+        rows = input_ids[:, self._seen:length].tolist()
+        self._seen = length
+        for i, ids in enumerate(rows):
+            grammar, state = self.grammars[i], self.states[i]
+            if grammar is None or state is None:
+                continue
+            for tid in ids:
+                if grammar.is_done(state) or self.vocab.texts[tid] is None:
+                    # 闭合之后的 EOS / 填充，或该行被预算、停止串等外部条件结束后的填充，不再推进
+                    break
+                state = grammar.advance_token(state, tid, self.vocab.texts[tid])
+                if state is None:
+                    # 理论上不会发生（候选已逐一校验）；出现时该行退回无约束生成
+                    self.failed[i] = True
+                    break
+            self.states[i] = state
+
+    def done(self, row: int) -> bool:
+        grammar, state = self.grammars[row], self.states[row]
+        return grammar is not None and state is not None and grammar.is_done(state)
+
+    def allowed(self, row: int, scores: Any) -> List[int]:
+        grammar, state = self.grammars[row], self.states[row]
+        if grammar.is_done(state):
+            return self.vocab.eos_ids
+        torch = _torch()
+
+        n = scores.shape[-1]
+        k, checked = self.top_k, 0
+        while True:
+            k = min(k, n)
+            cand = torch.topk(scores, k).indices.tolist()
+            texts = self.vocab.texts
+            ok = [t for t in cand[checked:] if grammar.advance_token(state, t, texts[t]) is not None]
+            if ok or k >= n:
+                return ok
+            # top-K 全部不合法（如必须输出的键名不在高分候选中）时逐步扩大候选范围
+            checked, k = k, k * 8
+
+
+class JsonLogitsProcessor:
+    def __init__(self, constraint: JsonConstraint) -> None:
+        self.constraint = constraint
+
+    def __call__(self, input_ids: Any, scores: Any) -> Any:
+        torch = _torch()
+
+        c = self.constraint
+        c.update(input_ids)
+        mask = None
+        for row in range(scores.shape[0]):
+            if c.grammars[row] is None or c.states[row] is None:
+                continue
+            keep = c.allowed(row, scores[row])
+            if not keep:
+                continue
+            if mask is None:
+                mask = torch.zeros_like(scores, dtype=torch.bool)
+            mask[row] = True
+            mask[row, keep] = False
+        return scores if mask is None else scores.masked_fill(mask, float("-inf"))
+
+
+class JsonCompleteStop:
+    # JSON 闭合即结束该行，不必再生成 EOS 或跑满 max_new_tokens
+    def __init__(self, constraint: JsonConstraint) -> None:
+        self.constraint = constraint
+
+    def __call__(self, input_ids: Any, scores: Any, **kwargs: Any) -> Any:
+        torch = _torch()
+
+        c = self.constraint
+        c.update(input_ids)
+        done = [c.done(row) for row in range(input_ids.shape[0])]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ..config import model_config
+from .json_constraint import schema_of
+from .local_llm import LocalQwen, _ChatBackend, prompt_text
+from .stopping import JsonBalance
+
+
+# GGUF 量化模型（llama.cpp）后端：LoRA 已在导出时合并进权重，接口与 LocalQwen 一致
+class LlamaCppQwen(_ChatBackend):
+    def __init__(self) -> None:
+        try:
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError as e:  # pragma: no cover - optional dependency
+            raise RuntimeError("LLM_BACKEND=gguf 需要安装 llama-cpp-python") from e
+
+        path = model_config.gguf_path
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(
+                f"GGUF 模型不存在: {path!r}，先运行 python -m src.tools.model_export --format gguf 并设置 GGUF_MODEL_PATH"
+            )
+        self.backend = "gguf"
+        self.path = path
+        self.model = Llama(
+            model_path=path,
+            n_ctx=model_config.llama_n_ctx,
+            n_threads=model_config.llama_threads or None,
+            verbose=False,
+        )
+        # 按 token 前缀缓存 KV 状态：同一 system prompt 的请求只需 prefill 各自的用户部分
+        self.model.set_cache(LlamaRAMCache())
+        self._gen_lock = threading.Lock()
+        self._grammars: Dict[Any, Any] = {}
+        self._stop_strings = model_config.stop_string_list()
+        self.constraint_stats = {"rows": 0, "completed": 0}
+        self.stage_stats: Dict[str, Dict[str, Any]] = {}
+        self.batcher = None
+
+    def _grammar(self, schema: Any) -> Any:
+        if schema is None or not model_config.json_constraint:
+            return None
+        grammar = self._grammars.get(schema)
+        if grammar is None:
+            from llama_cpp import LlamaGrammar
+
+            # 与 hf 后端同一份 JSON Schema，由 llama.cpp 转成 GBNF 在采样时约束
+            grammar = LlamaGrammar.from_json_schema(json.dumps(schema_of(schema), ensure_ascii=False), verbose=False)
+            self._grammars[schema] = grammar
+        return grammar
+
+    def _generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        schema: Any,
+        stage: Optional[str],
+        stop_event: Optional[threading.Event] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        budget = model_config.max_new_tokens_for(stage)
+        balance = JsonBalance() if schema is not None else None
+        grammar = self._grammar(schema)
+        prompt = prompt_text(system_prompt, user_prompt)
+        used, reason = 0, "length"
+        first: Optional[float] = None
+        with self._gen_lock:
+            started = time.perf_counter()
+            stream = self.model.create_completion(
+                prompt,
+                max_tokens=budget,
+                temperature=model_config.temperature,
+                top_p=0.95,
+                repeat_penalty=1.05,
+                stop=self._stop_strings,
+                grammar=grammar,
+                stream=True,
+            )
+            try:
+                for chunk in stream:
+                    choice = chunk["choices"][0]
+                    text = choice["text"]
+                    if first is None:
+                        first = time.perf_counter()
+                    if text:
+                        used += 1
+                        end = balance.feed(text) if balance is not None else -1
+                        if end >= 0:
+                            # 第一个完整 JSON 值已闭合，后续 token 不再生成
+                            yield text[:end]
+                            reason = "json"
+                            break
+                        yield text
+                    if choice.get("finish_reason"):
+                        # llama.cpp 只区分 length 与 stop（EOS 或停止串，停止串本身不会输出）
+                        reason = "budget" if choice["finish_reason"] == "length" else "stop"
+                    if stop_event is not None and stop_event.is_set():
+                        break
+            finally:
+                stream.close()
+            ended = time.perf_counter()
+        if usage is not None:
+            first = first or ended
+            usage.update(
+                {
+                    "batch_size": 1,
+                    "prompt_tokens": len(self.model.tokenize(prompt.encode("utf-8"))),
+                    "generated_tokens": used,
+                    "generate_ms": round(1000 * (ended - started), 3),
+                    "prefill_ms": round(1000 * (first - started), 3),
+                    "decode_ms": round(1000 * (ended - first), 3),
+                    "tokens_per_s": round(used / (ended - started), 2) if ended > started else 0.0,
+                    "stop": reason,
+                }
+            )
+        if grammar is not None:
+            self.constraint_stats["rows"] += 1
+            self.constraint_stats["completed"] += int(reason == "json")
+        self._record_stage(stage, used, budget, reason)
+
+    def _generate_rows(
+        self,
+        prompts: List[Tuple[str, str]],
+        schemas: Optional[List[Any]] = None,
+        stages: Optional[List[Optional[str]]] = None,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        # llama.cpp 单序列解码，批内逐条执行（前缀 KV 由 RAM cache 复用）
+        schemas = schemas or [None] * len(prompts)
+        stages = stages or [None] * len(prompts)
+        rows: List[Tuple[str, Dict[str, Any]]] = []
+        for (sp, up), sc, st in zip(prompts, schemas, stages):
+            usage: Dict[str, Any] = {}
+            text = "".join(self._generate(sp, up, sc, st, usage=usage)).strip()
+            rows.append((text, usage))
+        return rows
+
+    def stream_chat(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        stop_event: Optional[threading.Event] = None,
+        schema: Any = None,
+        stage: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        yield from self._generate(system_prompt, user_prompt, schema, stage, stop_event or threading.Event(), usage)
+
+    def precompute_prefixes(self, system_prompts: List[str]) -> None:
+        # 跑一次只含前缀的补全，把前缀 KV 状态写入 RAM cache
+        with self._gen_lock:
+            for sp in system_prompts:
+                self.model.create_completion(LocalQwen._prefix_text(sp), max_tokens=1)
+
+    def warmup(self) -> None:
+        with self._gen_lock:
+            self.model.create_completion("<|system|>\n<|user|>\n<|assistant|>", max_tokens=1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "model": self.path,
+            "json_constraint": dict(self.constraint_stats),
+            "stages": self._stage_snapshot(),
+        }
+
+    def close(self) -> None:
+        close = getattr(self.model, "close", None)
+        if close is not None:
+            close()
@@ -133,6 +133,18 @@ def _infer_items_by_goal(req: UserRequest) -> List[StrategyItem]:
             )
         )
 
+    if "wealth_legacy" in goal_set:
+        items.append(
+            StrategyItem(
+                coverage_type="whole_life",
+                recommended_sum_assured=max(3 * income, 500_000.0),
+                term_years=max(1, 105 - req.insured.age),
+                payment_mode="annual",
+                beneficiary=beneficiary,
+                rationale="终身寿险（含增额终身寿）定向传承，保额确定且可指定受益人，兼顾现金价值"
+            )
+        )
+
     if "retirement" in goal_set:
         items.append(
             StrategyItem(
@@ -1,35 +1,195 @@
 from __future__ import annotations
 
-import torch
-from typing import List, Optional
-from transformers import AutoModelForCausalLM, AutoTokenizer, GenerationConfig
-from peft import PeftModel, PeftConfig
+import copy
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
+# torch / transformers / peft 在用到时才导入：只需要配置、规则或数据库的入口（CLI、建库、测试）不承担数秒的初始化
 from ..config import model_config
+from ..lazy import torch as _torch
+from ..tracing import record_generation, span
+from .batching import GenerationBatcher
+from .json_constraint import JsonCompleteStop, JsonConstraint, JsonLogitsProcessor, TokenVocab, grammar_for
+from .stopping import GenerationTracker, RowSpec, StopStringFilter
 import asyncio
 
 
-class LocalQwen:
-    def __init__(self) -> None:
-        base_dir = model_config.base_model_dir
-        lora_dir = model_config.lora_adapter_dir
+_STREAM_END = object()
+
+
+class _EventStop:
+    # 流式调用方断开后，通过 event 让 generate 尽快结束（StoppingCriteriaList 只要求可调用）
+    def __init__(self, event: threading.Event) -> None:
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        torch = _torch()
+
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def prompt_text(system_prompt: str, user_prompt: str) -> str:
+    return LocalQwen._prefix_text(system_prompt) + LocalQwen._suffix_text(user_prompt)
+
 
-        self.tokenizer = AutoTokenizer.from_pretrained(base_dir, trust_remote_code=True)
-        base_model = AutoModelForCausalLM.from_pretrained(
-            base_dir,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto",
-            trust_remote_code=True,
+class _ChatBackend:
+    # 各推理后端共用：异步包装（微批或线程池）、流式桥接与分阶段 token 统计
+    batcher: Optional[GenerationBatcher] = None
+    stage_stats: Dict[str, Dict[str, Any]]
+
+    def _generate_rows(
+        self,
+        prompts: List[Tuple[str, str]],
+        schemas: Optional[List[Any]] = None,
+        stages: Optional[List[Optional[str]]] = None,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        # 每行返回 (文本, 用量)：prompt/cached/generated token 数、prefill/decode 耗时、速度与停止原因
+        raise NotImplementedError
+
+    def stream_chat(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        stop_event: Optional[threading.Event] = None,
+        schema: Any = None,
+        stage: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        raise NotImplementedError
+
+    def chat_batch(
+        self,
+        prompts: List[Tuple[str, str]],
+        schemas: Optional[List[Any]] = None,
+        stages: Optional[List[Optional[str]]] = None,
+    ) -> List[str]:
+        return [text for text, _ in self._generate_rows(prompts, schemas, stages)]
+
+    def chat(self, system_prompt: str, user_prompt: str, schema: Any = None, stage: Optional[str] = None) -> str:
+        return self.chat_batch([(system_prompt, user_prompt)], [schema], [stage])[0]
+
+    def _record_stage(self, stage: Optional[str], used: int, budget: int, reason: Optional[str]) -> None:
+        st = self.stage_stats.setdefault(
+            stage or "default", {"calls": 0, "tokens": 0, "max_tokens": 0, "budget": budget, "stops": Counter()}
         )
-        if lora_dir:
+        st["calls"] += 1
+        st["tokens"] += used
+        st["max_tokens"] = max(st["max_tokens"], used)
+        st["budget"] = budget
+        st["stops"][reason] += 1
+
+    def _stage_snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {
+                **{k: v for k, v in st.items() if k != "stops"},
+                "avg_tokens": st["tokens"] / st["calls"] if st["calls"] else 0.0,
+                "stops": dict(st["stops"]),
+            }
+            for name, st in self.stage_stats.items()
+        }
+
+    async def astream_chat(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        schema: Any = None,
+        stage: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        # usage 由调用方传入时，流结束后可从中读取本次生成的用量（推理进程转发给 API 进程）
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Any] = asyncio.Queue()
+        stop_event = threading.Event()
+        usage = {} if usage is None else usage
+
+        def emit(item: Any) -> None:
             try:
-                peft_cfg = PeftConfig.from_pretrained(lora_dir)
-                self.model = PeftModel.from_pretrained(base_model, lora_dir)
-            except Exception:
-                # 允许无 LoRA 或加载失败时退回基础模型
-                self.model = base_model
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # 事件循环已关闭，消费者不存在了
+                stop_event.set()
+
+        def pump() -> None:
+            try:
+                for piece in self.stream_chat(system_prompt, user_prompt, stop_event, schema, stage, usage):
+                    emit(piece)
+            except Exception as e:
+                emit(e)
+            finally:
+                emit(_STREAM_END)
+
+        with span(f"llm.{stage or 'chat'}", stream=True) as sp:
+            loop.run_in_executor(None, pump)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _STREAM_END:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                stop_event.set()
+            record_generation(sp, stage, usage)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.batcher.pending if self.batcher else 0
+
+    def close(self) -> None:
+        if self.batcher is not None:
+            self.batcher.close()
+
+    async def achat(
+        self, system_prompt: str, user_prompt: str, schema: Any = None, stage: Optional[str] = None
+    ) -> str:
+        # schema 为 pydantic 模型类或 List[...] 等类型，给定时按其 JSON Schema 约束解码；stage 决定生成预算并用于统计
+        with span(f"llm.{stage or 'chat'}") as sp:
+            text, usage = await self.agenerate(system_prompt, user_prompt, schema, stage)
+            record_generation(sp, stage, usage)
+        return text
+
+    async def agenerate(
+        self, system_prompt: str, user_prompt: str, schema: Any = None, stage: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        # 返回 (文本, 用量)，不记 span：achat 与推理进程的 IPC 服务共用
+        started = time.perf_counter()
+        if self.batcher is not None:
+            text, usage = await self.batcher.submit(system_prompt, user_prompt, schema, stage)
         else:
-            self.model = base_model
+            rows = await asyncio.to_thread(self._generate_rows, [(system_prompt, user_prompt)], [schema], [stage])
+            text, usage = rows[0]
+        # 总等待减去生成本身即排队（微批窗口 + 等待前一批）时间
+        elapsed_ms = 1000 * (time.perf_counter() - started)
+        usage["queue_ms"] = round(max(0.0, elapsed_ms - usage.get("generate_ms", 0.0)), 3)
+        return text, usage
+
+
+def load_llm() -> _ChatBackend:
+    # 按 LLM_BACKEND 选择推理后端；hf 与 int8 共用 LocalQwen（同一套 generate 路径），gguf 走 llama.cpp
+    if model_config.backend == "gguf":
+        from .llama_cpp_llm import LlamaCppQwen
+
+        return LlamaCppQwen()
+    if model_config.backend not in ("hf", "int8"):
+        raise ValueError(f"未知的推理后端: {model_config.backend}")
+    return LocalQwen()
+
+
+class LocalQwen(_ChatBackend):
+    def __init__(self) -> None:
+        from transformers import GenerationConfig
+
+        self.backend = model_config.backend
+        if self.backend == "int8":
+            self.model, self.tokenizer = self._load_int8()
+        else:
+            self.model, self.tokenizer = self._load_hf()
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
 
         self.model.eval()
         self.gen_cfg = GenerationConfig(
@@ -38,18 +198,302 @@ class LocalQwen:
             do_sample=True if model_config.temperature > 0 else False,
             top_p=0.95,
             repetition_penalty=1.05,
+            pad_token_id=self.tokenizer.pad_token_id,
         )
+        # 同一模型同一时刻只跑一个 generate，避免多线程争用
+        self._gen_lock = threading.Lock()
+        self._prefix_cache: Dict[str, Tuple[List[int], Any]] = {}
+        self.prefix_stats = {"hits": 0, "misses": 0, "tokens_saved": 0}
+        eos = self.model.generation_config.eos_token_id
+        eos_ids = list(eos) if isinstance(eos, (list, tuple)) else [eos]
+        self._eos_ids = [i for i in {*eos_ids, self.tokenizer.eos_token_id} if i is not None]
+        self._stop_strings = model_config.stop_string_list()
+        self._vocab: Optional[TokenVocab] = None
+        self.constraint_stats = {"rows": 0, "completed": 0, "fallback": 0}
+        self.stage_stats: Dict[str, Dict[str, Any]] = {}
+        self.batcher: Optional[GenerationBatcher] = None
+        if model_config.batch_max_size > 1:
+            self.batcher = GenerationBatcher(
+                self._generate_rows, model_config.batch_max_size, model_config.batch_window_ms
+            )
 
-    def chat(self, system_prompt: str, user_prompt: str) -> str:
-        prompt = f"<|system|>\n{system_prompt}\n<|user|>\n{user_prompt}\n<|assistant|>"
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
-        with torch.no_grad():
-            output_ids = self.model.generate(**inputs, generation_config=self.gen_cfg)
-        text = self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
-        # 简单截断：取assistant之后的内容
-        if "<|assistant|>" in text:
-            text = text.split("<|assistant|>", 1)[-1].strip()
-        return text
+    @staticmethod
+    def _load_hf() -> Tuple[Any, Any]:
+        from .model_export import load_merged, runtime_dtype
+
+        base_dir = model_config.base_model_dir
+        lora_dir = model_config.lora_adapter_dir
+        dtype = runtime_dtype()
+        if lora_dir:
+            try:
+                # LoRA 合并进基座权重；合并结果按目录哈希缓存，命中时直接 mmap 已合并的 checkpoint
+                return load_merged(base_dir, lora_dir, dtype, device_map="auto")
+            except Exception:
+                # 允许 LoRA 加载失败时退回基础模型
+                pass
+        return load_merged(base_dir, None, dtype, device_map="auto")
+
+    @staticmethod
+    def _load_int8() -> Tuple[Any, Any]:
+        from .model_export import INT8_MODEL, load_int8, load_merged, quantize_int8
+
+        merged_dir = model_config.merged_model_dir
+        if merged_dir and os.path.exists(os.path.join(merged_dir, INT8_MODEL)):
+            return load_int8(merged_dir)
+        # 没有导出产物时启动阶段现场合并 LoRA 再量化：常驻内存同样下降，但加载峰值仍是 fp32 模型
+        model, tokenizer = load_merged(model_config.base_model_dir, model_config.lora_adapter_dir or None, "float32")
+        return quantize_int8(model), tokenizer
+
+    @staticmethod
+    def _prefix_text(system_prompt: str) -> str:
+        return f"<|system|>\n{system_prompt}\n<|user|>\n"
+
+    @staticmethod
+    def _suffix_text(user_prompt: str) -> str:
+        return f"{user_prompt}\n<|assistant|>"
+
+    def _prefix_entry(self, system_prompt: str, count: int = 1) -> Optional[Tuple[List[int], Any]]:
+        # 需在 _gen_lock 内调用：未命中时会跑一次前缀 forward
+        if not model_config.prefix_cache:
+            return None
+        entry = self._prefix_cache.get(system_prompt)
+        if entry is None:
+            self.prefix_stats["misses"] += count
+            entry = self._build_prefix(system_prompt)
+        else:
+            self.prefix_stats["hits"] += count
+            self.prefix_stats["tokens_saved"] += len(entry[0]) * count
+        return entry
+
+    def _build_prefix(self, system_prompt: str) -> Tuple[List[int], Any]:
+        torch = _torch()
+
+        prefix_ids = self.tokenizer(self._prefix_text(system_prompt))["input_ids"]
+        ids = torch.tensor([prefix_ids], device=self.model.device)
+        out = self.model(input_ids=ids, use_cache=True)
+        entry = (prefix_ids, out.past_key_values)
+        if len(self._prefix_cache) < model_config.prefix_cache_max_entries:
+            self._prefix_cache[system_prompt] = entry
+        return entry
+
+    def precompute_prefixes(self, system_prompts: List[str]) -> None:
+        torch = _torch()
+
+        if not model_config.prefix_cache:
+            return
+        with self._gen_lock, torch.no_grad():
+            for sp in system_prompts:
+                if sp not in self._prefix_cache:
+                    self._build_prefix(sp)
+
+    def _build_inputs(self, prompts: List[Tuple[str, str]]) -> Tuple[Any, Any, Any]:
+        torch = _torch()
+
+        pad_id = self.tokenizer.pad_token_id
+        suffixes = [self.tokenizer(self._suffix_text(u), add_special_tokens=False)["input_ids"] for _, u in prompts]
+        systems = {sp for sp, _ in prompts}
+        entry = self._prefix_entry(prompts[0][0], len(prompts)) if len(systems) == 1 else None
+        rows: List[List[int]] = []
+        masks: List[List[int]] = []
+        width = max(len(x) for x in suffixes)
+        past = None
+        if entry is not None:
+            # 共享前缀 + 中间填充 + 各自后缀：前缀 KV 直接复用，填充位置由 attention_mask 屏蔽
+            prefix_ids, cached = entry
+            for suf in suffixes:
+                pad = width - len(suf)
+                rows.append(prefix_ids + [pad_id] * pad + suf)
+                masks.append([1] * len(prefix_ids) + [0] * pad + [1] * len(suf))
+            past = copy.deepcopy(cached)
+            if len(prompts) > 1:
+                past.batch_repeat_interleave(len(prompts))
+        else:
+            # 系统提示不一致时退回左填充的完整 prefill
+            seqs = [self.tokenizer(self._prefix_text(sp))["input_ids"] + suf for (sp, _), suf in zip(prompts, suffixes)]
+            width = max(len(x) for x in seqs)
+            for seq in seqs:
+                pad = width - len(seq)
+                rows.append([pad_id] * pad + seq)
+                masks.append([0] * pad + [1] * len(seq))
+        device = self.model.device
+        return torch.tensor(rows, device=device), torch.tensor(masks, device=device), past
+
+    def _token_vocab(self) -> TokenVocab:
+        # 全词表逐 token 解码一次（约数十万次解码），之后所有约束解码共用
+        if self._vocab is None:
+            size = max(self.model.config.vocab_size, len(self.tokenizer))
+            self._vocab = TokenVocab(self.tokenizer, size, self._eos_ids)
+        return self._vocab
+
+    def _constraint(self, schemas: Optional[List[Any]], prompt_len: int) -> Optional[JsonConstraint]:
+        if not model_config.json_constraint or not schemas or all(s is None for s in schemas):
+            return None
+        grammars = [grammar_for(s) if s is not None else None for s in schemas]
+        return JsonConstraint(grammars, self._token_vocab(), prompt_len, model_config.json_constraint_top_k)
+
+    def _constrained_kwargs(self, constraint: Optional[JsonConstraint], stops: List[Any]) -> Dict[str, Any]:
+        from transformers import LogitsProcessorList, StoppingCriteriaList
+
+        kwargs: Dict[str, Any] = {}
+        if constraint is not None:
+            kwargs["logits_processor"] = LogitsProcessorList([JsonLogitsProcessor(constraint)])
+            stops = stops + [JsonCompleteStop(constraint)]
+        if stops:
+            kwargs["stopping_criteria"] = StoppingCriteriaList(stops)
+        return kwargs
+
+    def _record_constraint(self, constraint: Optional[JsonConstraint]) -> None:
+        if constraint is None:
+            return
+        for row, grammar in enumerate(constraint.grammars):
+            if grammar is None:
+                continue
+            self.constraint_stats["rows"] += 1
+            self.constraint_stats["completed"] += int(constraint.done(row))
+            self.constraint_stats["fallback"] += int(constraint.failed[row])
+
+    def _tracker(
+        self, schemas: Optional[List[Any]], stages: Optional[List[Optional[str]]], n: int, prompt_len: int
+    ) -> GenerationTracker:
+        schemas = schemas or [None] * n
+        stages = stages or [None] * n
+        rows = [RowSpec(model_config.max_new_tokens_for(st), sc is not None) for sc, st in zip(schemas, stages)]
+        return GenerationTracker(self.tokenizer, rows, prompt_len, self._stop_strings, self._eos_ids)
+
+    def _record_usage(self, stages: Optional[List[Optional[str]]], tracker: GenerationTracker) -> None:
+        for row, stage in enumerate(stages or [None] * len(tracker.rows)):
+            self._record_stage(stage, tracker.used[row], tracker.rows[row].budget, tracker.reason[row])
+
+    @staticmethod
+    def _usage(tracker: GenerationTracker, row: int, prompt_tokens: int, cached: int, started: float) -> Dict[str, Any]:
+        ended = time.perf_counter()
+        first = tracker.first_token_at or ended
+        generate_s = ended - started
+        used = tracker.used[row]
+        return {
+            "batch_size": len(tracker.rows),
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached,
+            "generated_tokens": used,
+            "generate_ms": round(1000 * generate_s, 3),
+            "prefill_ms": round(1000 * (first - started), 3),
+            "decode_ms": round(1000 * (ended - first), 3),
+            "tokens_per_s": round(used / generate_s, 2) if generate_s > 0 else 0.0,
+            "stop": tracker.reason[row],
+        }
+
+    def _generate_rows(
+        self,
+        prompts: List[Tuple[str, str]],
+        schemas: Optional[List[Any]] = None,
+        stages: Optional[List[Optional[str]]] = None,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        torch = _torch()
+
+        with self._gen_lock, torch.no_grad():
+            started = time.perf_counter()
+            input_ids, attention_mask, past = self._build_inputs(prompts)
+            prompt_len = input_ids.shape[1]
+            # generate 会原地扩展 past，复用的前缀长度要在生成前取
+            cached = past.get_seq_length() if past is not None else 0
+            constraint = self._constraint(schemas, prompt_len)
+            tracker = self._tracker(schemas, stages, len(prompts), prompt_len)
+            # 批次按最大行预算生成，各行到达自己的预算、EOS、JSON 闭合或停止串后由 tracker 单独结束
+            output_ids = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past,
+                generation_config=self.gen_cfg,
+                max_new_tokens=tracker.max_budget,
+                **self._constrained_kwargs(constraint, [tracker]),
+            )
+            # 所有行的 prompt 长度一致，新生成部分从同一位置开始，只解码各行实际用到的 token
+            new_ids = output_ids[:, prompt_len:]
+            tracker.finalize(new_ids.shape[1])
+            self._record_constraint(constraint)
+            self._record_usage(stages, tracker)
+            prompt_tokens = attention_mask.sum(dim=1).tolist()
+            usages = [self._usage(tracker, row, int(prompt_tokens[row]), cached, started) for row in range(len(prompts))]
+        return list(zip(tracker.decode(new_ids.tolist()), usages))
+
+    def stream_chat(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        stop_event: Optional[threading.Event] = None,
+        schema: Any = None,
+        stage: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        from transformers import TextIteratorStreamer
+
+        torch = _torch()
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop_event = stop_event or threading.Event()
+        errors: List[BaseException] = []
+
+        def run() -> None:
+            try:
+                with self._gen_lock, torch.no_grad():
+                    started = time.perf_counter()
+                    input_ids, attention_mask, past = self._build_inputs([(system_prompt, user_prompt)])
+                    prompt_len = input_ids.shape[1]
+                    cached = past.get_seq_length() if past is not None else 0
+                    constraint = self._constraint([schema], prompt_len)
+                    tracker = self._tracker([schema], [stage], 1, prompt_len)
+                    output_ids = self.model.generate(
+                        input_ids=input_ids,
+                        attention_mask=attention_mask,
+                        past_key_values=past,
+                        generation_config=self.gen_cfg,
+                        max_new_tokens=tracker.max_budget,
+                        streamer=streamer,
+                        **self._constrained_kwargs(constraint, [_EventStop(stop_event), tracker]),
+                    )
+                    tracker.finalize(output_ids.shape[1] - prompt_len)
+                    self._record_constraint(constraint)
+                    self._record_usage([stage], tracker)
+                    if usage is not None:
+                        usage.update(self._usage(tracker, 0, int(attention_mask.sum()), cached, started))
+            except BaseException as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        # 停止串可能跨多个 piece 出现，先暂扣疑似前缀，确认不是停止串再输出
+        stops = StopStringFilter(self._stop_strings)
+        try:
+            for piece in streamer:
+                text = stops.push(piece)
+                if text:
+                    yield text
+                if stops.stopped:
+                    break
+            tail = stops.flush()
+            if tail:
+                yield tail
+        finally:
+            stop_event.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def warmup(self) -> None:
+        torch = _torch()
+
+        inputs = self.tokenizer("<|system|>\n<|user|>\n<|assistant|>", return_tensors="pt").to(self.model.device)
+        with self._gen_lock, torch.no_grad():
+            self.model.generate(**inputs, max_new_tokens=1, do_sample=False, pad_token_id=self.tokenizer.pad_token_id)
+        if model_config.json_constraint:
+            self._token_vocab()
 
-    async def achat(self, system_prompt: str, user_prompt: str) -> str:
-        return await asyncio.to_thread(self.chat, system_prompt, user_prompt) 
\ No newline at end of file
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "batching": self.batcher.stats.snapshot() if self.batcher else None,
+            "prefix_cache": {"entries": len(self._prefix_cache), **self.prefix_stats},
+            "json_constraint": dict(self.constraint_stats),
+            "stages": self._stage_snapshot(),
+        }
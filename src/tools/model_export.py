@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import model_config
+from ..lazy import torch as _torch
+
+# 导出目录内的文件名：int8 为整模块序列化（加载时无需先分配 fp32 权重），meta 记录来源与参数
+INT8_MODEL = "model_int8.pt"
+EXPORT_META = "export_meta.json"
+DTYPES = ("float32", "float16", "bfloat16")
+
+
+def checkpoint_key(base_dir: str, lora_dir: Optional[str], dtype: str) -> str:
+    # 目录指纹：所有文件的相对路径、大小与修改时间，加上 JSON 配置的内容；不读权重内容，启动时计算只需毫秒级
+    h = hashlib.sha256()
+    for root in filter(None, [base_dir, lora_dir]):
+        h.update(b"\x00dir\x00")
+        for dirpath, dirnames, files in os.walk(root):
+            dirnames.sort()
+            for name in sorted(files):
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                h.update(f"{os.path.relpath(path, root)}\x00{st.st_size}\x00{st.st_mtime_ns}\n".encode())
+                if name.endswith(".json"):
+                    with open(path, "rb") as f:
+                        h.update(f.read())
+    h.update(dtype.encode())
+    return h.hexdigest()[:16]
+
+
+def merged_cache_path(base_dir: str, lora_dir: Optional[str], dtype: str) -> Optional[str]:
+    if not lora_dir or not model_config.merged_cache_dir:
+        return None
+    return os.path.join(model_config.merged_cache_dir, checkpoint_key(base_dir, lora_dir, dtype))
+
+
+def _complete(path: Optional[str]) -> bool:
+    # meta 最后写入，存在即表示该 checkpoint 完整
+    return bool(path) and os.path.exists(os.path.join(path, EXPORT_META))
+
+
+def _from_pretrained(path: str, dtype: str, device_map: Optional[str]) -> Any:
+    from transformers import AutoModelForCausalLM
+
+    torch = _torch()
+
+    kwargs: Dict[str, Any] = {"torch_dtype": getattr(torch, dtype), "trust_remote_code": True}
+    if device_map:
+        kwargs["device_map"] = device_map
+    return AutoModelForCausalLM.from_pretrained(path, **kwargs)
+
+
+def _prune_superseded(path: str, meta: Dict[str, Any]) -> None:
+    # 同一基座 + LoRA 目录的旧 key（目录内容已变化）不会再命中，删除以免每次更新都多占一份完整权重
+    root = os.path.dirname(path)
+    for name in os.listdir(root):
+        other = os.path.join(root, name)
+        if other == path or not _complete(other):
+            continue
+        try:
+            with open(os.path.join(other, EXPORT_META), encoding="utf-8") as f:
+                old = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if (old.get("base_model_dir"), old.get("lora_adapter_dir"), old.get("dtype")) == (
+            meta["base_model_dir"], meta["lora_adapter_dir"], meta["dtype"]
+        ):
+            shutil.rmtree(other, ignore_errors=True)
+
+
+def save_merged(model: Any, tokenizer: Any, path: str, meta: Dict[str, Any]) -> None:
+    # 先写临时目录再改名，并发启动或中途退出不会留下半个 checkpoint
+    tmp = f"{path}.tmp-{os.getpid()}"
+    model.save_pretrained(tmp, safe_serialization=True)
+    tokenizer.save_pretrained(tmp)
+    _write_meta(tmp, meta)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # 其他进程已写好同一 key
+        shutil.rmtree(tmp, ignore_errors=True)
+    _prune_superseded(path, meta)
+
+
+def load_merged(
+    base_dir: str, lora_dir: Optional[str], dtype: str = "float32", device_map: Optional[str] = None
+) -> Tuple[Any, Any]:
+    from transformers import AutoTokenizer
+
+    cached = merged_cache_path(base_dir, lora_dir, dtype)
+    if _complete(cached):
+        # 命中缓存：只读一份已合并的 safetensors（按 mmap 加载），不再加载 LoRA
+        return _from_pretrained(cached, dtype, device_map).eval(), AutoTokenizer.from_pretrained(cached, trust_remote_code=True)
+    tokenizer = AutoTokenizer.from_pretrained(base_dir, trust_remote_code=True)
+    model = _from_pretrained(base_dir, dtype, device_map)
+    if lora_dir:
+        from peft import PeftModel
+
+        # LoRA 增量直接加回基座权重，推理时不再有额外的适配器矩阵乘
+        model = PeftModel.from_pretrained(model, lora_dir).merge_and_unload()
+        if cached and model_config.merged_cache_build:
+            meta = {"format": "merged", "base_model_dir": base_dir, "lora_adapter_dir": lora_dir, "dtype": dtype}
+            try:
+                os.makedirs(model_config.merged_cache_dir, exist_ok=True)
+                save_merged(model, tokenizer, cached, meta)
+            except OSError:
+                # 缓存目录不可写时只在内存中使用合并结果
+                pass
+    model.eval()
+    return model, tokenizer
+
+
+def runtime_dtype() -> str:
+    torch = _torch()
+
+    # 与 LocalQwen 加载精度一致：GPU 用 fp16，CPU 用 fp32
+    return "float16" if torch.cuda.is_available() else "float32"
+
+
+def quantize_int8(model: Any) -> Any:
+    torch = _torch()
+
+    # 仅权重量化：Linear 权重存 int8，激活在运行时按批动态量化，CPU 上走 int8 GEMM
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_int8(model_dir: str) -> Tuple[Any, Any]:
+    from transformers import AutoTokenizer
+
+    torch = _torch()
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+    model = torch.load(os.path.join(model_dir, INT8_MODEL), map_location="cpu", weights_only=False)
+    model.eval()
+    return model, tokenizer
+
+
+def _write_meta(out_dir: str, meta: Dict[str, Any]) -> None:
+    with open(os.path.join(out_dir, EXPORT_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def export_merged(out_dir: Optional[str], base_dir: str, lora_dir: Optional[str], dtype: str) -> str:
+    # out_dir 为空时写入启动阶段会自动识别的合并缓存
+    cached = merged_cache_path(base_dir, lora_dir, dtype)
+    if out_dir is None:
+        if cached is None:
+            raise ValueError("写入合并缓存需要 LoRA 目录与 MERGED_CACHE_DIR")
+        if not _complete(cached):
+            os.makedirs(model_config.merged_cache_dir, exist_ok=True)
+            model, tokenizer = load_merged(base_dir, lora_dir, dtype)
+            if not _complete(cached):
+                meta = {"format": "merged", "base_model_dir": base_dir, "lora_adapter_dir": lora_dir, "dtype": dtype}
+                save_merged(model, tokenizer, cached, meta)
+        return cached
+    model, tokenizer = load_merged(base_dir, lora_dir, dtype)
+    os.makedirs(out_dir, exist_ok=True)
+    model.save_pretrained(out_dir, safe_serialization=True)
+    tokenizer.save_pretrained(out_dir)
+    return out_dir
+
+
+def export_int8(out_dir: str, base_dir: str, lora_dir: Optional[str]) -> str:
+    torch = _torch()
+
+    # 动态量化需要浮点权重做标定，合并阶段固定 fp32
+    model, tokenizer = load_merged(base_dir, lora_dir, "float32")
+    os.makedirs(out_dir, exist_ok=True)
+    model.config.save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    path = os.path.join(out_dir, INT8_MODEL)
+    torch.save(quantize_int8(model), path)
+    return path
+
+
+def export_gguf(out_dir: str, merged_dir: str, llama_cpp_dir: str, outtype: str, quantize: Optional[str]) -> str:
+    # 借助 llama.cpp 自带的转换脚本与量化工具；q8_0 可直接转换，Q4_K_M 等需再经 llama-quantize
+    script = os.path.join(llama_cpp_dir, "convert_hf_to_gguf.py")
+    if not os.path.exists(script):
+        raise FileNotFoundError(f"未找到 llama.cpp 转换脚本: {script}")
+    path = os.path.join(out_dir, f"model-{outtype}.gguf")
+    subprocess.run([sys.executable, script, merged_dir, "--outfile", path, "--outtype", outtype], check=True)
+    if quantize:
+        binary = shutil.which("llama-quantize") or os.path.join(llama_cpp_dir, "build", "bin", "llama-quantize")
+        quantized = os.path.join(out_dir, f"model-{quantize.lower()}.gguf")
+        subprocess.run([binary, path, quantized, quantize], check=True)
+        path = quantized
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="合并 LoRA 并导出量化推理产物（一次性离线执行）")
+    parser.add_argument("--out", default=None, help="导出目录；--format merged 不指定时写入启动自动识别的合并缓存")
+    parser.add_argument("--format", choices=["merged", "int8", "gguf"], default="int8")
+    parser.add_argument("--base", default=model_config.base_model_dir)
+    parser.add_argument("--lora", default=model_config.lora_adapter_dir or "", help="置空则不合并 LoRA")
+    parser.add_argument(
+        "--dtype", choices=DTYPES, default=None, help="merged / gguf 的权重精度（默认 merged 与运行时一致，gguf 为 float16）"
+    )
+    parser.add_argument("--llama-cpp", default=os.getenv("LLAMA_CPP_DIR", ""), help="llama.cpp 源码目录（gguf 需要）")
+    parser.add_argument("--gguf-outtype", default="q8_0", help="convert_hf_to_gguf.py 的 --outtype（q8_0 / f16 / bf16）")
+    parser.add_argument("--quantize", default="", help="再用 llama-quantize 量化，如 Q4_K_M")
+    args = parser.parse_args()
+
+    if args.out is None and args.format != "merged":
+        parser.error(f"--format {args.format} 需要 --out")
+    started = time.perf_counter()
+    lora = args.lora or None
+    if args.dtype is None:
+        args.dtype = "float16" if args.format == "gguf" else runtime_dtype()
+    if args.format == "int8":
+        artifact = export_int8(args.out, args.base, lora)
+        env = {"LLM_BACKEND": "int8", "MERGED_MODEL_DIR": os.path.abspath(args.out)}
+    elif args.format == "merged":
+        artifact = export_merged(args.out, args.base, lora, args.dtype)
+        if args.out is None:
+            # 缓存命中由 LOCAL_QWEN_DIR / LORA_ADAPTER_DIR 自动识别，无需改配置
+            env = {}
+        else:
+            env = {"LLM_BACKEND": "hf", "LOCAL_QWEN_DIR": os.path.abspath(args.out), "LORA_ADAPTER_DIR": ""}
+    else:
+        if not args.llama_cpp:
+            parser.error("--format gguf 需要 --llama-cpp 或环境变量 LLAMA_CPP_DIR")
+        merged_dir = export_merged(os.path.join(args.out, "merged"), args.base, lora, args.dtype)
+        artifact = export_gguf(args.out, merged_dir, args.llama_cpp, args.gguf_outtype, args.quantize or None)
+        env = {"LLM_BACKEND": "gguf", "GGUF_MODEL_PATH": os.path.abspath(artifact)}
+
+    meta = {
+        "format": args.format,
+        "artifact": os.path.abspath(artifact),
+        "base_model_dir": args.base,
+        "lora_adapter_dir": lora,
+        "dtype": "float32" if args.format == "int8" else args.dtype,
+        "gguf_outtype": args.gguf_outtype if args.format == "gguf" else None,
+        "quantize": args.quantize or None,
+        "seconds": round(time.perf_counter() - started, 1),
+        "env": env,
+    }
+    _write_meta(artifact if args.out is None else args.out, meta)
+    print(json.dumps(meta, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
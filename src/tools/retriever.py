@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 import os
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+from ..config import rag_config
+from ..rag.lexical import BM25Index
 import asyncio
 
 _KB_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "knowledge")
 
 
-def _load_kb_docs() -> List[Tuple[str, str]]:
+def _load_kb_docs(kb_dir: str = _KB_DIR) -> List[Tuple[str, str]]:
     docs: List[Tuple[str, str]] = []
-    if not os.path.isdir(_KB_DIR):
+    if not os.path.isdir(kb_dir):
         return docs
-    for name in os.listdir(_KB_DIR):
+    for name in os.listdir(kb_dir):
         if not name.endswith(".md"):
             continue
-        path = os.path.join(_KB_DIR, name)
+        path = os.path.join(kb_dir, name)
         try:
             with open(path, "r", encoding="utf-8") as f:
                 docs.append((name, f.read()))
@@ -24,19 +27,18 @@ def _load_kb_docs() -> List[Tuple[str, str]]:
 
 
 class KnowledgeBase:
-    def __init__(self) -> None:
-        self.docs = _load_kb_docs()
+    def __init__(self, kb_dir: Optional[str] = None) -> None:
+        self.docs = _load_kb_docs(kb_dir or _KB_DIR)
+        # 文档级 BM25：按词项 IDF 与文档长度归一化打分，取代逐条 str.count 全文扫描
+        self.index = BM25Index(rag_config.lexical_tokenizer).build(
+            (i, f"{name}\n{content}") for i, (name, content) in enumerate(self.docs)
+        )
 
     def retrieve(self, hints: List[str], top_k: int = 3) -> List[str]:
         if not hints or not self.docs:
             return []
-        scored: List[Tuple[int, str]] = []
-        for name, content in self.docs:
-            score = sum(content.count(h) for h in hints)
-            if score:
-                scored.append((score, f"{name}:\n{content}"))
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [c for _, c in scored[:top_k]]
+        hits = self.index.search(" ".join(hints), top_k)
+        return [f"{self.docs[i][0]}:\n{self.docs[i][1]}" for i, _ in hits]
 
     async def aretrieve(self, hints: List[str], top_k: int = 3) -> List[str]:
         return await asyncio.to_thread(self.retrieve, hints, top_k) 
\ No newline at end of file
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence
+
+from ..lazy import torch as _torch
+
+
+@dataclass
+class RowSpec:
+    # 单行生成的 token 预算；json=True 时第一个完整 JSON 值闭合即停止
+    budget: int
+    json: bool = False
+
+
+class JsonBalance:
+    # 增量扫描生成文本：遇到第一个 { 或 [ 开始计深度，深度回到 0 即一个完整 JSON 值结束
+    __slots__ = ("depth", "in_str", "escape", "started")
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.in_str = False
+        self.escape = False
+        self.started = False
+
+    def feed(self, text: str) -> int:
+        # 返回闭合字符之后的下标；尚未闭合返回 -1
+        for i, ch in enumerate(text):
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = self.started
+            elif ch in "{[":
+                self.depth += 1
+                self.started = True
+            elif ch in "}]" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+
+def json_end(text: str) -> int:
+    return JsonBalance().feed(text)
+
+
+def cut_at_stop(text: str, stop_strings: Sequence[str]) -> str:
+    hits = [text.find(s) for s in stop_strings if s and s in text]
+    return text[: min(hits)] if hits else text
+
+
+# StoppingCriteria：逐行跟踪新 token，按 EOS / JSON 闭合 / 停止串 / 行预算结束该行，并记录实际用量
+class GenerationTracker:
+    def __init__(
+        self,
+        tokenizer: Any,
+        rows: Sequence[RowSpec],
+        prompt_len: int,
+        stop_strings: Sequence[str],
+        eos_ids: Sequence[int],
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.rows = list(rows)
+        self.prompt_len = prompt_len
+        self.stop_strings = tuple(s for s in stop_strings if s)
+        self._window = 2 * max((len(s) for s in self.stop_strings), default=0)
+        self.eos_ids = {i for i in eos_ids if i is not None}
+        n = len(self.rows)
+        self.used = [0] * n
+        self.reason: List[Optional[str]] = [None] * n
+        self._tail = [""] * n
+        self._json = [JsonBalance() if r.json else None for r in self.rows]
+        # 第一次被调用时首个新 token 已产出，用于拆分 prefill 与解码耗时
+        self.first_token_at: Optional[float] = None
+
+    @property
+    def max_budget(self) -> int:
+        return max(r.budget for r in self.rows)
+
+    def _stop(self, row: int, reason: str, used: int) -> None:
+        self.reason[row] = reason
+        self.used[row] = used
+
+    def _feed(self, row: int, token: int, step: int) -> None:
+        if token in self.eos_ids:
+            self._stop(row, "eos", step - 1)
+            return
+        # 保留特殊 token 的文本，<|im_start|> 之类的停止串才能被识别
+        piece = self.tokenizer.decode([token], skip_special_tokens=False)
+        balance = self._json[row]
+        if balance is not None and balance.feed(piece) >= 0:
+            self._stop(row, "json", step)
+            return
+        if self.stop_strings:
+            tail = (self._tail[row] + piece)[-self._window:]
+            self._tail[row] = tail
+            if any(s in tail for s in self.stop_strings):
+                self._stop(row, "stop", step)
+                return
+        if step >= self.rows[row].budget:
+            self._stop(row, "budget", step)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        torch = _torch()
+
+        step = input_ids.shape[1] - self.prompt_len
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if step > 0:
+            for row, token in enumerate(input_ids[:, -1].tolist()):
+                if self.reason[row] is None:
+                    self._feed(row, token, step)
+        done = [r is not None for r in self.reason]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def finalize(self, generated: int) -> None:
+        # generate 因全局上限或外部停止（断连）结束时，未判定的行记为用满已生成长度
+        for row, reason in enumerate(self.reason):
+            if reason is None:
+                self._stop(row, "length", generated)
+
+    def decode(self, new_ids: Any) -> List[str]:
+        texts = []
+        for row, ids in enumerate(new_ids):
+            text = self.tokenizer.decode(ids[: self.used[row]], skip_special_tokens=True)
+            if self.reason[row] == "stop":
+                text = cut_at_stop(text, self.stop_strings)
+            elif self.rows[row].json:
+                end = json_end(text)
+                if end >= 0:
+                    text = text[:end]
+            texts.append(text.strip())
+        return texts
+
+
+class StopStringFilter:
+    # 流式输出时暂扣可能是停止串前缀的尾部文本，避免把停止串推给客户端
+    def __init__(self, stop_strings: Sequence[str]) -> None:
+        self.stop_strings = tuple(s for s in stop_strings if s)
+        self._held = ""
+        self.stopped = False
+
+    def push(self, piece: str) -> str:
+        if self.stopped:
+            return ""
+        text = self._held + piece
+        cut = cut_at_stop(text, self.stop_strings)
+        if len(cut) < len(text):
+            self.stopped = True
+            self._held = ""
+            return cut
+        hold = 0
+        for s in self.stop_strings:
+            for k in range(min(len(s) - 1, len(text)), 0, -1):
+                if text.endswith(s[:k]):
+                    hold = max(hold, k)
+                    break
+        self._held = text[len(text) - hold:] if hold else ""
+        return text[: len(text) - hold]
+
+    def flush(self) -> str:
+        held, self._held = self._held, ""
+        return "" if self.stopped else held
+
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from .config import tracing_config
+
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# 直方图：名称 -> (说明, 桶上界)
+HISTOGRAMS: Dict[str, Tuple[str, Sequence[float]]] = {
+    "insur_http_request_duration_ms": ("HTTP 请求耗时（毫秒，流式响应计到最后一个字节）", LATENCY_BUCKETS_MS),
+    "insur_stage_duration_ms": ("各阶段 span 耗时（毫秒）", LATENCY_BUCKETS_MS),
+    "insur_llm_prompt_tokens": ("每次生成的 prompt token 数（含复用的前缀）", TOKEN_BUCKETS),
+    "insur_llm_generated_tokens": ("每次生成实际产出的 token 数", TOKEN_BUCKETS),
+    "insur_llm_queue_ms": ("生成请求在微批队列中的等待（毫秒）", LATENCY_BUCKETS_MS),
+    "insur_llm_prefill_ms": ("首 token 耗时：prefill + 第一步解码（毫秒）", LATENCY_BUCKETS_MS),
+    "insur_llm_decode_ms": ("首 token 之后的解码耗时（毫秒）", LATENCY_BUCKETS_MS),
+    "insur_llm_tokens_per_second": ("单次生成的产出速度（token/s）", RATE_BUCKETS),
+}
+COUNTERS: Dict[str, str] = {
+    "insur_http_requests_total": "HTTP 请求数",
+    "insur_llm_tokens_total": "LLM token 累计（kind=prompt/cached/generated）",
+}
+# 单个请求最多记录的 span 数；批量接口等长请求只保留前若干个，避免 trace 无界增长
+MAX_SPANS = 256
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "recent")
+
+    def __init__(self, buckets: Sequence[float], reservoir: int) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一格为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent: Deque[float] = deque(maxlen=max(1, reservoir))
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        data = sorted(self.recent)
+        out = {"count": self.count, "avg": round(self.sum / self.count, 3) if self.count else 0.0}
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            out[name] = round(data[min(len(data) - 1, int(q * len(data)))], 3) if data else 0.0
+        return out
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    # 进程内指标：直方图（Prometheus 桶 + 最近样本分位数）、计数器与按需求值的 gauge
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._hist: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            hist = self._hist.get(key)
+            if hist is None:
+                hist = self._hist[key] = _Histogram(HISTOGRAMS[name][1], tracing_config.reservoir)
+            hist.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], float]) -> None:
+        self._gauges[name] = (help_text, fn)
+
+    def render(self) -> str:
+        # Prometheus 文本格式（0.0.4）
+        lines: List[str] = []
+        with self._lock:
+            hists = sorted(self._hist.items())
+            counters = sorted(self._counters.items())
+            hist_snap = [(k, h.buckets, list(h.counts), h.sum, h.count) for k, h in hists]
+        for name, help_text in COUNTERS.items():
+            rows = [(labels, v) for (n, labels), v in counters if n == name]
+            if not rows:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f"{name}{_labels(labels)} {v:g}" for labels, v in rows]
+        for name, (help_text, _) in HISTOGRAMS.items():
+            rows = [row for row in hist_snap if row[0][0] == name]
+            if not rows:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (_, labels), buckets, counts, total, count in rows:
+                cumulative = 0
+                for upper, c in zip(list(buckets) + [float("inf")], counts):
+                    cumulative += c
+                    le = "+Inf" if upper == float("inf") else f"{upper:g}"
+                    bucket = _labels(labels, 'le="' + le + '"')
+                    lines.append(f"{name}_bucket{bucket} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for (name, labels), hist in sorted(self._hist.items()):
+                label = ",".join(f"{k}={v}" for k, v in labels) or "all"
+                out.setdefault(name, {})[label] = hist.summary()
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hist.clear()
+            self._counters.clear()
+
+
+metrics = Metrics()
+
+
+class Trace:
+    # 单个请求的 span 列表；子任务与 to_thread 线程通过 contextvar 继承同一个 Trace
+    __slots__ = ("start", "spans", "dropped")
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    def add(self, span: Span) -> None:
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def elapsed_ms(self) -> float:
+        return 1000 * (time.perf_counter() - self.start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        spans = sorted(self.spans, key=lambda s: s.start)
+        out: Dict[str, Any] = {
+            "total_ms": round(self.elapsed_ms(), 3),
+            "spans": [
+                {"name": s.name, "start_ms": round(1000 * (s.start - self.start), 3), "ms": round(s.ms, 3), **s.attrs}
+                for s in spans
+            ],
+        }
+        if self.dropped:
+            out["dropped"] = self.dropped
+        return out
+
+    def header(self, max_bytes: int = 0) -> str:
+        full = json.dumps(self.to_dict(), separators=(",", ":"), ensure_ascii=True)
+        if max_bytes <= 0 or len(full) <= max_bytes:
+            return full
+        # 超出上限：按阶段名汇总为 [次数, 总耗时]，仍超出时只保留耗时最多的阶段
+        stages: Dict[str, List[float]] = {}
+        for s in self.spans:
+            agg = stages.setdefault(s.name, [0, 0.0])
+            agg[0] += 1
+            agg[1] += s.ms
+        ranked = sorted(stages.items(), key=lambda kv: kv[1][1], reverse=True)
+        while True:
+            out = {
+                "total_ms": round(self.elapsed_ms(), 3),
+                "stages": {name: [int(n), round(ms, 3)] for name, (n, ms) in ranked},
+                "truncated": len(stages) - len(ranked) if len(ranked) < len(stages) else 0,
+                "summarized": True,
+            }
+            text = json.dumps(out, separators=(",", ":"), ensure_ascii=True)
+            if len(text) <= max_bytes or not ranked:
+                return text
+            ranked = ranked[: len(ranked) // 2]
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("insur_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "ms")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.ms = 0.0
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> Span:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.ms = 1000 * (time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        metrics.observe("insur_stage_duration_ms", self.ms, stage=self.name)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(self)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self) -> _NoopSpan:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs: Any) -> Any:
+    # 用法：with span("rag.search", queries=3) as sp: ...; sp.set(hits=4)
+    return Span(name, attrs) if tracing_config.enabled else NOOP_SPAN
+
+
+def record_generation(sp: Any, stage: Optional[str], usage: Dict[str, Any]) -> None:
+    # LLM 单次调用的 token 用量与速度：写入 span 属性并累计到直方图
+    if not tracing_config.enabled:
+        return
+    sp.set(**usage)
+    stage = stage or "chat"
+    for key, name in (
+        ("prompt_tokens", "insur_llm_prompt_tokens"),
+        ("generated_tokens", "insur_llm_generated_tokens"),
+        ("queue_ms", "insur_llm_queue_ms"),
+        ("prefill_ms", "insur_llm_prefill_ms"),
+        ("decode_ms", "insur_llm_decode_ms"),
+        ("tokens_per_s", "insur_llm_tokens_per_second"),
+    ):
+        if usage.get(key) is not None:
+            metrics.observe(name, usage[key], stage=stage)
+    for kind in ("prompt", "cached", "generated"):
+        if usage.get(f"{kind}_tokens"):
+            metrics.inc("insur_llm_tokens_total", usage[f"{kind}_tokens"], stage=stage, kind=kind)
+
+
+class TracingMiddleware:
+    # 纯 ASGI 中间件：为每个 HTTP 请求建立 Trace；响应头发出时按需附加 X-Trace，最后一个字节发出后记录总耗时
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not tracing_config.enabled:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        token = _current.set(trace)
+        headers = dict(scope.get("headers") or [])
+        debug = tracing_config.debug_header and headers.get(b"x-debug-trace") == b"1"
+        status = {"code": 500}
+
+        async def traced_send(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if debug:
+                    # 非流式响应此时端点已执行完毕，trace 是完整的；流式响应在 done 事件中另附完整 trace
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-trace", trace.header(tracing_config.header_max_bytes).encode())]}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                _observe_request(scope, status["code"], trace.elapsed_ms())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _current.reset(token)
+
+
+def _observe_request(scope: Dict[str, Any], status: int, ms: float) -> None:
+    # 用路由模板而不是原始路径作为标签，避免路径参数撑爆序列数
+    route = scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    method = scope.get("method", "")
+    metrics.observe("insur_http_request_duration_ms", ms, method=method, path=path)
+    metrics.inc("insur_http_requests_total", method=method, path=path, status=status)
+
+
+def debug_trace(headers: Any) -> Optional[Trace]:
+    # 流式接口用：请求要求调试 trace 时返回当前 Trace
+    if tracing_config.enabled and tracing_config.debug_header and headers.get("x-debug-trace") == "1":
+        return _current.get()
+    return None